@@ -1,4 +1,5 @@
 """ basics for an activitypub serializer """
+from collections import namedtuple
 from dataclasses import dataclass, fields, MISSING
 from json import JSONEncoder
 import logging
@@ -53,6 +54,21 @@ def naive_parse(activity_objects, activity_json, serializer=None):
     return serializer(activity_objects=activity_objects, **activity_json)
 
 
+ParseField = namedtuple("ParseField", ("name", "default", "required", "activity_type"))
+# the fields of each activity class and how to parse them
+parse_plans = {}
+
+
+def get_activity_type(field):
+    """the activity class a field holds, if it holds one"""
+    try:
+        if issubclass(field.type, ActivityObject):
+            return field.type
+    except TypeError:
+        pass
+    return None
+
+
 @dataclass(init=False)
 class ActivityObject:
     """actor activitypub json"""
@@ -64,35 +80,47 @@ class ActivityObject:
         """this lets you pass in an object with fields that aren't in the
         dataclass, which it ignores. Any field in the dataclass is required or
         has a default value"""
-        for field in fields(self):
+        for field in self.get_parse_plan():
             try:
                 value = kwargs[field.name]
                 if value in (None, MISSING, {}):
                     raise KeyError("Missing required field", field.name)
-                try:
-                    is_subclass = issubclass(field.type, ActivityObject)
-                except TypeError:
-                    is_subclass = False
                 # serialize a model obj
                 if hasattr(value, "to_activity"):
                     value = value.to_activity()
                 # parse a dict into the appropriate activity
-                elif is_subclass and isinstance(value, dict):
+                elif field.activity_type and isinstance(value, dict):
                     if activity_objects:
                         value = naive_parse(activity_objects, value)
                     else:
                         value = naive_parse(
-                            activity_objects, value, serializer=field.type
+                            activity_objects, value, serializer=field.activity_type
                         )
 
             except KeyError:
-                if field.default == MISSING and field.default_factory == MISSING:
+                if field.required:
                     raise ActivitySerializerError(
                         f"Missing required field: {field.name}"
                     )
                 value = field.default
             setattr(self, field.name, value)
 
+    @classmethod
+    def get_parse_plan(cls):
+        """the dataclass fields, looked over once for each activity class"""
+        plan = parse_plans.get(cls)
+        if plan is None:
+            plan = parse_plans[cls] = tuple(
+                ParseField(
+                    field.name,
+                    field.default,
+                    field.default == MISSING and field.default_factory == MISSING,
+                    get_activity_type(field),
+                )
+                for field in fields(cls)
+            )
+        return plan
+
     # pylint: disable=too-many-locals,too-many-branches,too-many-arguments
     def to_model(
         self, model=None, instance=None, allow_create=True, save=True, overwrite=True
@@ -244,21 +272,30 @@ def set_related_field(
         item.save()
 
 
+# each activity type and the model that stores it, filled in when the app is ready
+model_types = {}
+
+
+def register_model_types():
+    """look over the models once to see which activity types they store"""
+    for model in apps.get_models():
+        serializer = getattr(model, "activity_serializer", None)
+        activity_type = getattr(serializer, "type", None)
+        if activity_type:
+            # like the old lookup, the first model for a type wins
+            model_types.setdefault(activity_type, model)
+
+
 def get_model_from_type(activity_type):
     """given the activity, what type of model"""
-    models = apps.get_models()
-    model = [
-        m
-        for m in models
-        if hasattr(m, "activity_serializer")
-        and hasattr(m.activity_serializer, "type")
-        and m.activity_serializer.type == activity_type
-    ]
-    if not model:
+    if not model_types:
+        register_model_types()
+    try:
+        return model_types[activity_type]
+    except KeyError:
         raise ActivitySerializerError(
             f'No model found for activity type "{activity_type}"'
         )
-    return model[0]
 
 
 def resolve_remote_id(
@@ -1,14 +1,17 @@
 """ ActivityPub-specific json response wrapper """
-from django.http import JsonResponse
+import json
+
+from django.http import HttpResponse
 
 from .base_activity import ActivityEncoder
 
 
-class ActivitypubResponse(JsonResponse):
+class ActivitypubResponse(HttpResponse):
     """
     A class to be used in any place that's serializing responses for
-    Activitypub enabled clients. Uses JsonResponse under the hood, but already
-    configures some stuff beforehand. Made to be a drop-in replacement of
+    Activitypub enabled clients. Works like JsonResponse, but already
+    configures some stuff beforehand, and takes activities that have
+    already been serialized. Made to be a drop-in replacement of
     JsonResponse.
     """
 
@@ -24,4 +27,15 @@ class ActivitypubResponse(JsonResponse):
         if "content_type" not in kwargs:
             kwargs["content_type"] = "application/activity+json"
 
-        super().__init__(data, encoder, safe, json_dumps_params, **kwargs)
+        if isinstance(data, bytes):
+            # it's already been serialized, probably by to_activity_json
+            super().__init__(content=data, **kwargs)
+            return
+
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        data = json.dumps(data, cls=encoder, **(json_dumps_params or {}))
+        super().__init__(content=data, **kwargs)
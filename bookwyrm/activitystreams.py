@@ -1,20 +1,51 @@
 """ access the activity streams stored in redis """
 from datetime import timedelta
+from itertools import islice
+from uuid import uuid4
+
+from django.core.cache import cache
 from django.dispatch import receiver
 from django.db import transaction
-from django.db.models import signals, Q
+from django.db.models import prefetch_related_objects, signals, Q
 from django.utils import timezone
+from redis.exceptions import ResponseError
 
-from bookwyrm import models
+from bookwyrm import models, settings
+from bookwyrm.audience_cache import audience_cache
+from bookwyrm.models.user import get_feed_filter_choices
 from bookwyrm.redis_store import RedisStore, r
+from bookwyrm.settings import PAGE_LENGTH
 from bookwyrm.tasks import app, LOW, MEDIUM, HIGH
 
+# hydrated statuses include the author and book, which can change without
+# the status being saved, so they don't stick around for long
+HYDRATED_STATUS_TIMEOUT = 60 * 60
+
+
+class StreamPage(list):
+    """one page of statuses from a stream, and the cursors for the pages around it"""
+
+    def __init__(self, statuses, newest=None, oldest=None, **kwargs):
+        super().__init__(statuses)
+        # the (rank, id) of the first and last statuses on the page
+        self.newest = newest
+        self.oldest = oldest
+        self.has_previous = kwargs.get("has_previous", False)
+        self.has_next = kwargs.get("has_next", False)
+
+    def has_other_pages(self):
+        """is there anywhere to go from here"""
+        return self.has_previous or self.has_next
+
 
 class ActivityStream(RedisStore):
     """a category of activity stream (like home, local, books)"""
 
     def stream_id(self, user):
         """the redis key for this user's instance of this stream"""
+        if isinstance(user, int):
+            # allows the function to take an int or an obj
+            return f"{user}-{self.key}"
         return f"{user.id}-{self.key}"
 
     def unread_id(self, user):
@@ -31,20 +62,28 @@ class ActivityStream(RedisStore):
         """statuses are sorted by date published"""
         return obj.published_date.timestamp()
 
-    def add_status(self, status, increment_unread=False):
-        """add a status to users' feeds"""
+    def add_status(self, status, increment_unread=False, pipeline=None):
+        """add a status to users' feeds, using the pipeline if one is provided"""
+        execute = pipeline is None
+        audience = self.get_audience_ids(status)
         # the pipeline contains all the add-to-stream activities
-        pipeline = self.add_object_to_related_stores(status, execute=False)
+        pipeline = self.add_object_to_related_stores(
+            status,
+            execute=False,
+            stores=[self.stream_id(u) for u in audience],
+            pipeline=pipeline,
+        )
 
         if increment_unread:
-            for user in self.get_audience(status):
+            status_type = get_status_type(status)
+            for user_id in audience:
                 # add to the unread status count
-                pipeline.incr(self.unread_id(user))
+                pipeline.incr(self.unread_id(user_id))
                 # add to the unread status count for status type
-                pipeline.hincrby(
-                    self.unread_by_status_type_id(user), get_status_type(status), 1
-                )
+                pipeline.hincrby(self.unread_by_status_type_id(user_id), status_type, 1)
 
+        if not execute:
+            return
         # and go!
         pipeline.execute()
 
@@ -60,27 +99,85 @@ class ActivityStream(RedisStore):
         statuses = user.status_set.all()
         self.bulk_remove_objects_from_store(statuses, self.stream_id(viewer))
 
+    def get_activity_ids(self, user):
+        """the ids of the statuses to be displayed, newest first"""
+        # clear unreads for this feed
+        r.set(self.unread_id(user), 0)
+        r.delete(self.unread_by_status_type_id(user))
+
+        return [int(i) for i in self.get_store(self.stream_id(user))]
+
     def get_activity_stream(self, user):
         """load the statuses to be displayed"""
+        return self.get_statuses(self.get_activity_ids(user))
+
+    def get_activity_page(
+        self, user, allowed_types=None, max_cursor=None, min_cursor=None
+    ):
+        """load one page of statuses, older than max_cursor or newer than
+        min_cursor, which are the (rank, id) of a status on the page next to it"""
         # clear unreads for this feed
         r.set(self.unread_id(user), 0)
         r.delete(self.unread_by_status_type_id(user))
 
-        statuses = self.get_store(self.stream_id(user))
-        return (
-            models.Status.objects.select_subclasses()
-            .filter(id__in=statuses)
-            .select_related(
-                "user",
-                "reply_parent",
-                "comment__book",
-                "review__book",
-                "quotation__book",
-            )
-            .prefetch_related("mention_books", "mention_users")
-            .order_by("-published_date")
+        store = self.stream_id(user)
+        length = int(PAGE_LENGTH)
+        newer = min_cursor is not None
+        values = self.get_store_values(
+            store, min_cursor if newer else max_cursor, not newer, length
+        )
+        page = []
+        while len(page) < length:
+            chunk = list(islice(values, length))
+            page += filter_by_feed_filter_type(chunk, allowed_types)
+            if len(chunk) < length:
+                break
+
+        page = page[:length]
+        if newer:
+            page.reverse()
+        if not page:
+            return StreamPage([], has_previous=max_cursor is not None)
+
+        newest = (page[0][1], int(page[0][0]))
+        oldest = (page[-1][1], int(page[-1][0]))
+        has_newer = next(self.get_store_values(store, newest, False, length), None)
+        has_older = next(self.get_store_values(store, oldest, True, length), None)
+
+        return StreamPage(
+            self.get_statuses([int(i) for (i, _) in page]),
+            newest=newest,
+            oldest=oldest,
+            # the first page is the first page, even if there are filtered statuses
+            has_previous=has_newer is not None and (newer or max_cursor is not None),
+            has_next=has_older is not None,
         )
 
+    def get_statuses(self, status_ids):  # pylint: disable=no-self-use
+        """the statuses, ready to display and in the same order as the ids"""
+        status_ids = [int(i) for i in status_ids]
+        cached = cache.get_many([hydrated_status_id(i) for i in status_ids])
+        statuses = {s.id: s for s in cached.values()}
+
+        missing = [i for i in status_ids if i not in statuses]
+        if missing:
+            loaded = {
+                s.id: s
+                for s in models.Status.objects.select_subclasses()
+                .filter(id__in=missing)
+                .select_related("user", "reply_parent")
+                .prefetch_related("mention_users")
+            }
+            # these are the same for every viewer, so everybody can share them
+            cache.set_many(
+                {hydrated_status_id(i): s for (i, s) in loaded.items()},
+                timeout=HYDRATED_STATUS_TIMEOUT,
+            )
+            statuses.update(loaded)
+        statuses = [statuses[i] for i in status_ids if i in statuses]
+        add_status_books(statuses)
+        return statuses
+
     def get_unread_count(self, user):
         """get the unread status count for this user's feed"""
         return int(r.get(self.unread_id(user)) or 0)
@@ -97,8 +194,54 @@ class ActivityStream(RedisStore):
         """go from zero to a timeline"""
         self.populate_store(self.stream_id(user))
 
+    def get_audience_ids(self, status):  # pylint: disable=no-self-use
+        """given a status, the ids of the users who should see it
+
+        this is worked out from the cached follower and block sets, and should
+        always agree with get_audience"""
+        # direct messages don't appeard in feeds, direct comments/reviews/etc do
+        if status.privacy == "direct" and status.status_type == "Note":
+            return set()
+
+        author_id = status.user.id
+        parent_author_id = None
+        if status.reply_parent and status.reply_parent.privacy == "followers":
+            parent_author_id = status.reply_parent.user.id
+
+        keys = [
+            audience_cache.local_users_id,
+            audience_cache.blocks_id(author_id),
+            audience_cache.followers_id(author_id),
+        ]
+        if parent_author_id:
+            keys.append(audience_cache.followers_id(parent_author_id))
+        local_users, blocks, followers, *parent_followers = audience_cache.get_sets(
+            *keys
+        )
+
+        # everybody who could plausibly see this status
+        audience = local_users - blocks
+
+        # only visible to the poster and mentioned users
+        if status.privacy == "direct":
+            mentions = status.mention_users.filter(local=True).values_list(
+                "id", flat=True
+            )
+            return audience & ({author_id} | set(mentions))
+
+        # don't show replies to statuses the user can't see
+        if parent_author_id:
+            return audience & (
+                {author_id, parent_author_id} | (followers & parent_followers[0])
+            )
+
+        # only visible to the poster's followers and tagged users
+        if status.privacy == "followers":
+            return audience & ({author_id} | followers)
+        return audience
+
     def get_audience(self, status):  # pylint: disable=no-self-use
-        """given a status, what users should see it"""
+        """given a status, what users should see it (from the database)"""
         # direct messages don't appeard in feeds, direct comments/reviews/etc do
         if status.privacy == "direct" and status.status_type == "Note":
             return []
@@ -156,6 +299,14 @@ class HomeStream(ActivityStream):
 
     key = "home"
 
+    def get_audience_ids(self, status):
+        audience = super().get_audience_ids(status)
+        if not audience:
+            return audience
+        # the post's author or users following the author
+        followers = audience_cache.get_followers(status.user.id)
+        return audience & ({status.user.id} | followers)
+
     def get_audience(self, status):
         audience = super().get_audience(status)
         if not audience:
@@ -183,6 +334,12 @@ class LocalStream(ActivityStream):
 
     key = "local"
 
+    def get_audience_ids(self, status):
+        # this stream wants no part in non-public statuses
+        if status.privacy != "public" or not status.user.local:
+            return set()
+        return super().get_audience_ids(status)
+
     def get_audience(self, status):
         # this stream wants no part in non-public statuses
         if status.privacy != "public" or not status.user.local:
@@ -202,21 +359,41 @@ class BooksStream(ActivityStream):
 
     key = "books"
 
-    def get_audience(self, status):
-        """anyone with the mentioned book on their shelves"""
+    def get_work(self, status):  # pylint: disable=no-self-use
+        """the work a status belongs with on the books stream, if any"""
         # only show public statuses on the books feed,
         # and only statuses that mention books
         if status.privacy != "public" or not (
             status.mention_books.exists() or hasattr(status, "book")
         ):
-            return []
+            return None
 
-        work = (
+        return (
             status.book.parent_work
             if hasattr(status, "book")
             else status.mention_books.first().parent_work
         )
 
+    def get_audience_ids(self, status):
+        """anyone with the mentioned book on their shelves"""
+        work = self.get_work(status)
+        if not work:
+            return set()
+
+        audience = super().get_audience_ids(status)
+        if not audience:
+            return audience
+        shelved = models.ShelfBook.objects.filter(
+            user__local=True, book__parent_work=work
+        ).values_list("user__id", flat=True)
+        return audience & set(shelved)
+
+    def get_audience(self, status):
+        """anyone with the mentioned book on their shelves"""
+        work = self.get_work(status)
+        if not work:
+            return []
+
         audience = super().get_audience(status)
         if not audience:
             return []
@@ -310,6 +487,42 @@ def add_status_on_create(sender, instance, created, *args, **kwargs):
     )
 
 
+@receiver(signals.post_save)
+@receiver(signals.post_delete)
+# pylint: disable=unused-argument
+def clear_hydrated_status(sender, instance, *args, **kwargs):
+    """statuses that change need to be re-loaded for feeds"""
+    if not issubclass(sender, models.Status):
+        return
+    cache.delete(hydrated_status_id(instance.id))
+
+
+@receiver(signals.m2m_changed, sender=models.Status.mention_books.through)
+@receiver(signals.m2m_changed, sender=models.Status.mention_users.through)
+# pylint: disable=unused-argument
+def clear_hydrated_status_mentions(sender, instance, action, *args, **kwargs):
+    """mentions are part of a hydrated status"""
+    if not isinstance(instance, models.Status) or not action.startswith("post_"):
+        return
+    cache.delete(hydrated_status_id(instance.id))
+
+
+def add_status_books(statuses):
+    """books can't be pickled, so they're loaded for a page of statuses at a time
+    instead of being cached with them"""
+    book_ids = {s.book_id for s in statuses if getattr(s, "book_id", None)}
+    books = models.Edition.objects.in_bulk(book_ids)
+    for status in statuses:
+        if getattr(status, "book_id", None) in books:
+            status.book = books[status.book_id]
+    prefetch_related_objects(statuses, "mention_books")
+
+
+def hydrated_status_id(status_id):
+    """the cache key for a status that's ready to display"""
+    return f"hydrated-status-{status_id}"
+
+
 def add_status_on_create_command(sender, instance, created):
     """runs this code only after the database commit completes"""
     priority = HIGH
@@ -320,16 +533,76 @@ def add_status_on_create_command(sender, instance, created):
     ) or instance.created_date < instance.published_date - timedelta(days=1):
         priority = LOW
 
-    add_status_task.apply_async(
-        args=(instance.id,),
-        kwargs={"increment_unread": created},
-        queue=priority,
-    )
+    if settings.COALESCE_STREAM_WRITES:
+        add_status_to_pending(instance.id, created, priority)
+    else:
+        add_status_task.apply_async(
+            args=(instance.id,),
+            kwargs={"increment_unread": created},
+            queue=priority,
+        )
 
     if sender == models.Boost:
         handle_boost_task.delay(instance.id)
 
 
+def pending_statuses_id(priority):
+    """the redis key for statuses waiting to be added to streams"""
+    return f"pending-statuses-{priority}"
+
+
+def add_status_to_pending(status_id, increment_unread, priority):
+    """queue up a status for the next batch of stream updates"""
+    key = pending_statuses_id(priority)
+    pipeline = r.pipeline()
+    # a re-save shouldn't cancel out the unread count from creating the status
+    if increment_unread:
+        pipeline.hset(key, status_id, 1)
+    else:
+        pipeline.hsetnx(key, status_id, 0)
+    pipeline.hlen(key)
+    pending_count = pipeline.execute()[-1]
+
+    # only the status that fills the batch queues it, not every one after that
+    if pending_count == settings.STREAM_BATCH_SIZE:
+        add_status_batch_task.apply_async(args=(priority,), queue=priority)
+    elif pending_count == 1:
+        # this is the start of a new batch, make sure it gets handled eventually
+        add_status_batch_task.apply_async(
+            args=(priority,), queue=priority, countdown=settings.STREAM_BATCH_DELAY
+        )
+
+
+def claim_pending_statuses(priority):
+    """take all the waiting statuses, as the key they've been moved to while they're
+    handled and a dict of status id to increment_unread"""
+    key = pending_statuses_id(priority)
+    processing_key = f"{key}-processing-{uuid4().hex}"
+    try:
+        r.rename(key, processing_key)
+    except ResponseError:
+        # there aren't any, or another batch already took them
+        return None, {}
+    pending = r.hgetall(processing_key)
+    return processing_key, {int(k): bool(int(v)) for (k, v) in pending.items()}
+
+
+def restore_pending_statuses(priority, processing_key, pending):
+    """put statuses from a batch that didn't work back in line for the next one"""
+    key = pending_statuses_id(priority)
+    pipeline = r.pipeline()
+    for (status_id, increment_unread) in pending.items():
+        if increment_unread:
+            pipeline.hset(key, status_id, 1)
+        else:
+            pipeline.hsetnx(key, status_id, 0)
+    pipeline.delete(processing_key)
+    pipeline.execute()
+    add_status_batch_task.apply_async(
+        args=(priority,), queue=priority, countdown=settings.STREAM_BATCH_DELAY
+    )
+
+
 @receiver(signals.post_delete, sender=models.Boost)
 # pylint: disable=unused-argument
 def remove_boost_on_delete(sender, instance, *args, **kwargs):
@@ -511,6 +784,41 @@ def add_status_task(status_id, increment_unread=False):
         stream.add_status(status, increment_unread=increment_unread)
 
 
+@app.task(queue=HIGH)
+def add_status_batch_task(priority=HIGH):
+    """add all the pending statuses to the streams they should be in"""
+    (processing_key, pending) = claim_pending_statuses(priority)
+    if not pending:
+        return
+
+    # grouping by author means each author's audience is only loaded once
+    statuses = (
+        models.Status.objects.select_subclasses()
+        .filter(id__in=pending.keys(), deleted=False)
+        .select_related("user", "reply_parent__user")
+        .order_by("user", "published_date")
+    )
+    old_date = timezone.now() - timedelta(days=2)
+
+    try:
+        pipeline = r.pipeline()
+        with audience_cache.batch():
+            for status in statuses:
+                # same as add_status_task, csv imports don't count as unread
+                increment_unread = (
+                    pending[status.id] and status.created_date >= old_date
+                )
+                for stream in streams.values():
+                    stream.add_status(
+                        status, increment_unread=increment_unread, pipeline=pipeline
+                    )
+        pipeline.execute()
+    except Exception:
+        restore_pending_statuses(priority, processing_key, pending)
+        raise
+    r.delete(processing_key)
+
+
 @app.task(queue=MEDIUM)
 def remove_user_statuses_task(viewer_id, user_id, stream_list=None):
     """remove all statuses by a user from a viewer's stream"""
@@ -566,3 +874,57 @@ def get_status_type(status):
             status_type = "quotation"
 
     return status_type
+
+
+def feed_filter_type_id(status_id):
+    """the redis key for the feed filter type of a status"""
+    return f"{status_id}-feed-type"
+
+
+def get_feed_filter_type(status):
+    """the feed filter choice that hides this status, if any"""
+    if isinstance(status, models.Boost):
+        status = models.Status.objects.get_subclass(id=status.boosted_status_id)
+
+    if isinstance(status, models.Review):
+        return "review"
+    if isinstance(status, models.Comment):
+        return "comment"
+    if isinstance(status, models.Quotation):
+        return "quotation"
+    if isinstance(status, models.GeneratedNote):
+        return "everything"
+    # regular old notes are always shown
+    return None
+
+
+def set_feed_filter_type(status, pipeline):
+    """store the filter type for a subclassed status, so feeds don't need sql"""
+    filter_type = get_feed_filter_type(status) or ""
+    # it'll never change, but it only needs to be around while it's in feeds
+    pipeline.set(feed_filter_type_id(status.id), filter_type, ex=60 * 60 * 24 * 30)
+    return filter_type
+
+
+def filter_by_feed_filter_type(values, allowed_types):
+    """remove the values from a stream page that the user doesn't want to see"""
+    if allowed_types is None or set(get_feed_filter_choices()) <= set(allowed_types):
+        return values
+
+    status_ids = [int(i) for (i, _) in values]
+    filter_types = dict(zip(status_ids, r.mget(map(feed_filter_type_id, status_ids))))
+
+    # older statuses may not have had their type stored yet
+    missing = [i for (i, t) in filter_types.items() if t is None]
+    if missing:
+        pipeline = r.pipeline()
+        for status in models.Status.objects.select_subclasses().filter(id__in=missing):
+            filter_types[status.id] = set_feed_filter_type(status, pipeline).encode()
+        pipeline.execute()
+
+    allowed = {t.encode() for t in allowed_types} | {b""}
+    return [
+        value
+        for (status_id, value) in zip(status_ids, values)
+        if filter_types.get(status_id) in allowed
+    ]
@@ -34,9 +34,13 @@ class BookwyrmConfig(AppConfig):
 
     # pylint: disable=no-self-use
     def ready(self):
-        """set up OTLP and preview image files, if desired"""
+        """set up activity types, OTLP and preview image files, if desired"""
+        # pylint: disable=import-outside-toplevel
+        from bookwyrm.activitypub.base_activity import register_model_types
+
+        register_model_types()
+
         if settings.OTEL_EXPORTER_OTLP_ENDPOINT:
-            # pylint: disable=import-outside-toplevel
             from bookwyrm.telemetry import open_telemetry
 
             open_telemetry.instrumentDjango()
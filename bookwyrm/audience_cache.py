@@ -0,0 +1,193 @@
+""" the local follower and block sets used to work out who sees a status """
+from contextlib import contextmanager
+
+from django.dispatch import receiver
+from django.db import transaction
+from django.db.models import signals, Q
+
+from bookwyrm import models
+from bookwyrm.redis_store import r
+
+
+class AudienceCache:
+    """the local follower and block sets used to work out who sees a status"""
+
+    local_users_id = "local-users"
+    # stored in every set so that an empty set can be told apart from a missing one
+    sentinel = 0
+    # rebuild the sets from the database once in a while in case they drift
+    timeout = 60 * 60 * 24
+
+    def __init__(self):
+        # sets that have already been loaded, while in a batch
+        self.loaded = None
+
+    @contextmanager
+    def batch(self):
+        """re-use each set that's loaded until the batch is done"""
+        self.loaded = {}
+        try:
+            yield
+        finally:
+            self.loaded = None
+
+    def followers_id(self, user):  # pylint: disable=no-self-use
+        """the redis key for the local users following this user"""
+        if isinstance(user, int):
+            return f"{user}-local-followers"
+        return f"{user.id}-local-followers"
+
+    def blocks_id(self, user):  # pylint: disable=no-self-use
+        """the redis key for users blocking or blocked by this user"""
+        if isinstance(user, int):
+            return f"{user}-blocks"
+        return f"{user.id}-blocks"
+
+    def get_local_users(self):
+        """ids of active local users"""
+        return self.get_sets(self.local_users_id)[0]
+
+    def get_followers(self, user):
+        """ids of local users following this user"""
+        return self.get_sets(self.followers_id(user))[0]
+
+    def get_sets(self, *keys):
+        """load several sets in one round trip, rebuilding any that are missing"""
+        loaded = self.loaded if self.loaded is not None else {}
+        missing = [k for k in keys if k not in loaded]
+
+        if missing:
+            pipeline = r.pipeline()
+            for key in missing:
+                pipeline.smembers(key)
+
+            for key, members in zip(missing, pipeline.execute()):
+                ids = {int(m) for m in members}
+                if self.sentinel not in ids:
+                    ids = self.populate_set(key)
+                ids.discard(self.sentinel)
+                loaded[key] = ids
+        return [loaded[k] for k in keys]
+
+    def populate_set(self, key):
+        """go from zero to a set"""
+        ids = set(self.get_ids_for_set(key))
+        pipeline = r.pipeline()
+        pipeline.delete(key)
+        pipeline.sadd(key, self.sentinel, *ids)
+        pipeline.expire(key, self.timeout)
+        pipeline.execute()
+        return ids
+
+    def get_ids_for_set(self, key):  # pylint: disable=no-self-use
+        """the database query that backs a set"""
+        if key == self.local_users_id:
+            return models.User.objects.filter(is_active=True, local=True).values_list(
+                "id", flat=True
+            )
+
+        user_id, set_type = key.split("-", 1)
+        if set_type == "local-followers":
+            return models.UserFollows.objects.filter(
+                user_object__id=user_id, user_subject__local=True
+            ).values_list("user_subject__id", flat=True)
+
+        # blocks go both ways
+        blocks = models.UserBlocks.objects.filter(
+            Q(user_subject__id=user_id) | Q(user_object__id=user_id)
+        ).values_list("user_subject__id", "user_object__id")
+        return {
+            subject if object_id == int(user_id) else object_id
+            for (subject, object_id) in blocks
+        }
+
+    def add_to_set(self, key, user_id):  # pylint: disable=no-self-use
+        """add a user to a set, if it's been loaded it stays complete"""
+        r.sadd(key, user_id)
+
+    def remove_from_set(self, key, user_id):  # pylint: disable=no-self-use
+        """remove a user from a set"""
+        r.srem(key, user_id)
+
+
+audience_cache = AudienceCache()
+
+
+def add_block(block):
+    """a block means neither user sees the other's statuses"""
+    audience_cache.add_to_set(
+        audience_cache.blocks_id(block.user_subject), block.user_object.id
+    )
+    audience_cache.add_to_set(
+        audience_cache.blocks_id(block.user_object), block.user_subject.id
+    )
+
+
+def remove_block(block):
+    """undo a block in both directions"""
+    audience_cache.remove_from_set(
+        audience_cache.blocks_id(block.user_subject), block.user_object.id
+    )
+    audience_cache.remove_from_set(
+        audience_cache.blocks_id(block.user_object), block.user_subject.id
+    )
+
+
+@receiver(signals.post_save, sender=models.UserFollows)
+# pylint: disable=unused-argument
+def add_follower_on_follow(sender, instance, created, *args, **kwargs):
+    """local users following someone see their statuses"""
+    if not created or not instance.user_subject.local:
+        return
+    transaction.on_commit(
+        lambda: audience_cache.add_to_set(
+            audience_cache.followers_id(instance.user_object),
+            instance.user_subject.id,
+        )
+    )
+
+
+@receiver(signals.post_delete, sender=models.UserFollows)
+# pylint: disable=unused-argument
+def remove_follower_on_unfollow(sender, instance, *args, **kwargs):
+    """and stop seeing them on unfollow"""
+    if not instance.user_subject.local:
+        return
+    transaction.on_commit(
+        lambda: audience_cache.remove_from_set(
+            audience_cache.followers_id(instance.user_object),
+            instance.user_subject.id,
+        )
+    )
+
+
+@receiver(signals.post_save, sender=models.UserBlocks)
+# pylint: disable=unused-argument
+def add_block_on_block(sender, instance, *args, **kwargs):
+    """keep the block sets current"""
+    transaction.on_commit(lambda: add_block(instance))
+
+
+@receiver(signals.post_delete, sender=models.UserBlocks)
+# pylint: disable=unused-argument
+def remove_block_on_unblock(sender, instance, *args, **kwargs):
+    """unless there's still a block in the other direction"""
+    if models.UserBlocks.objects.filter(
+        user_subject=instance.user_object,
+        user_object=instance.user_subject,
+    ).exists():
+        return
+    transaction.on_commit(lambda: remove_block(instance))
+
+
+@receiver(signals.post_save, sender=models.User)
+# pylint: disable=unused-argument
+def update_local_users_on_user_save(sender, instance, *args, **kwargs):
+    """keep the set of local users who have feeds current"""
+    if not instance.local:
+        return
+    if instance.is_active:
+        action = audience_cache.add_to_set
+    else:
+        action = audience_cache.remove_from_set
+    transaction.on_commit(lambda: action(audience_cache.local_users_id, instance.id))
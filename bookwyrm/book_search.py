@@ -1,14 +1,26 @@
 """ using a bookwyrm instance as a source of book data """
 from dataclasses import asdict, dataclass
 from functools import reduce
+import hashlib
 import operator
+import time
+from uuid import uuid4
 
 from django.contrib.postgres.search import SearchRank, SearchQuery
-from django.db.models import F, Q
+from django.core.cache import cache
+from django.db.models import F, Q, signals
+from django.dispatch import receiver
 
 from bookwyrm import models
 from bookwyrm import connectors
 from bookwyrm.settings import MEDIA_FULL_URL
+from bookwyrm.utils import metrics
+
+# autocomplete searches the same prefixes over and over
+SEARCH_CACHE_TIMEOUT = 60 * 5
+# changed whenever an edition changes in a way searches would show. author
+# names aren't tracked, so renames show up when the results expire
+SEARCH_VERSION_KEY = "book-search-version"
 
 
 # pylint: disable=arguments-differ
@@ -17,8 +29,75 @@ def search(query, min_confidence=0, filters=None, return_first=False):
     filters = filters or []
     if not query:
         return []
-    query = query.strip()
+    query = normalize_query(query)
+    if filters:
+        # there's no telling what a filter is about
+        return search_uncached(query, min_confidence, filters, return_first)
+
+    start = time.perf_counter()
+    key = search_cache_id(query, min_confidence, return_first)
+    cached = cache.get(key)
+    hit = cached is not None
+    if hit:
+        results = load_cached_results(cached)
+    else:
+        results = search_uncached(query, min_confidence, filters, return_first)
+        if return_first:
+            results = [results] if results else []
+        else:
+            results = list(results)
+        # editions can't be pickled, so only their ids and ranks are kept
+        cache.set(
+            key,
+            [(r.id, getattr(r, "rank", None)) for r in results],
+            SEARCH_CACHE_TIMEOUT,
+        )
+
+    metrics.increment_many(
+        "book-search",
+        {
+            "hit" if hit else "miss": 1,
+            metrics.latency_field(time.perf_counter() - start): 1,
+        },
+    )
+    if return_first:
+        return results[0] if results else None
+    return results
+
+
+def load_cached_results(cached):
+    """the editions for cached search results, in the same order and with the
+    same rank. any that were deleted since are left out"""
+    editions = models.Edition.objects.in_bulk([i for (i, _) in cached])
+    results = []
+    for (edition_id, rank) in cached:
+        edition = editions.get(edition_id)
+        if not edition:
+            continue
+        if rank is not None:
+            edition.rank = rank
+        results.append(edition)
+    return results
+
+
+def normalize_query(query):
+    """searches that are the same except for spacing or case get the same results.
+    identifiers have no spaces and can be case sensitive"""
+    query = " ".join(query.split())
+    if " " in query:
+        return query.lower()
+    return query
+
+
+def search_cache_id(query, min_confidence, return_first):
+    """the cache key for a search, since it can be any text"""
+    version = cache.get_or_set(SEARCH_VERSION_KEY, lambda: uuid4().hex, None)
+    digest = hashlib.sha256(query.encode("utf-8")).hexdigest()
+    return f"book-search-{version}-{digest}-{min_confidence}-{return_first}"
 
+
+def search_uncached(query, min_confidence, filters, return_first):
+    """search the database, identifiers then titles and authors"""
     results = None
     # first, try searching unqiue identifiers
     # unique identifiers never have spaces, title/author usually do
@@ -98,21 +177,17 @@ def search_title_author(query, min_confidence, *filters, return_first=False):
     )
 
     # when there are multiple editions of the same work, pick the closest
-    editions_of_work = results.values_list("parent_work__id", flat=True).distinct()
+    best_editions = results.order_by("parent_work", "-rank", "-edition_rank").distinct(
+        "parent_work"
+    )
 
     # filter out multiple editions of the same work
-    list_results = []
-    for work_id in set(editions_of_work[:30]):
-        result = (
-            results.filter(parent_work=work_id)
-            .order_by("-rank", "-edition_rank")
-            .first()
-        )
-
-        if return_first:
-            return result
-        list_results.append(result)
-    return list_results
+    results = results.filter(id__in=best_editions.values("id")).order_by(
+        "-rank", "-edition_rank"
+    )
+    if return_first:
+        return results.first()
+    return list(results[:30])
 
 
 @dataclass
@@ -139,3 +214,27 @@ class SearchResult:
         serialized = asdict(self)
         del serialized["connector"]
         return serialized
+
+
+@receiver(signals.post_save, sender="bookwyrm.Edition")
+# pylint: disable=unused-argument
+def clear_search_cache(sender, instance, created, *args, **kwargs):
+    """editions were added, or changed in a way that searches would show. saves
+    that don't change them, like most during imports, keep the cache"""
+    if created or instance.search_tracker.changed():
+        cache.delete(SEARCH_VERSION_KEY)
+
+
+@receiver(signals.post_delete, sender="bookwyrm.Edition")
+# pylint: disable=unused-argument
+def clear_search_cache_delete(sender, instance, *args, **kwargs):
+    """editions were removed"""
+    cache.delete(SEARCH_VERSION_KEY)
+
+
+@receiver(signals.m2m_changed, sender="bookwyrm.Book_authors")
+# pylint: disable=unused-argument
+def clear_search_cache_authors(sender, instance, action, *args, **kwargs):
+    """books' authors changed"""
+    if action in ["post_add", "post_remove", "post_clear"]:
+        cache.delete(SEARCH_VERSION_KEY)
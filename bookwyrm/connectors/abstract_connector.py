@@ -10,6 +10,7 @@ import requests
 from requests.exceptions import RequestException
 
 from bookwyrm import activitypub, models, settings
+from . import rate_limit
 from .connector_manager import load_more_data, ConnectorException, raise_not_valid_url
 from .format_mappings import format_mappings
 
@@ -42,10 +43,7 @@ class AbstractMinimalConnector(ABC):
         """format the query url"""
         # Check if the query resembles an ISBN
         if maybe_isbn(query) and self.isbn_search_url and self.isbn_search_url != "":
-            # Up-case the ISBN string to ensure any 'X' check-digit is correct
-            # If the ISBN has only 9 characters, prepend missing zero
-            normalized_query = query.strip().upper().rjust(10, "0")
-            return f"{self.isbn_search_url}{normalized_query}"
+            return f"{self.isbn_search_url}{normalize_isbn(query)}"
         # NOTE: previously, we tried searching isbn and if that produces no results,
         # searched as free text. This, instead, only searches isbn if it's isbn-y
         return f"{self.search_url}{query}"
@@ -69,6 +67,43 @@ class AbstractMinimalConnector(ABC):
         """turn the result json from a search into a list"""
 
 
+class IsbnBatchMixin(ABC):
+    """for connectors whose apis can look up many isbns in one request"""
+
+    # how many isbns the api can look up in one request
+    isbn_batch_size = 50
+
+    def isbn_batch_search(self, isbns):
+        """look up many isbns in as few requests as possible, as a dict of each
+        isbn that was found to its search result"""
+        if not self.isbn_search_url:
+            return {}
+        isbns = list(dict.fromkeys(normalize_isbn(i) for i in isbns))
+
+        results = {}
+        for start in range(0, len(isbns), self.isbn_batch_size):
+            batch = isbns[start : start + self.isbn_batch_size]
+            try:
+                data = get_data(self.get_isbn_batch_url(batch))
+            except ConnectorException as err:
+                logger.info("Unable to look up isbns from %s: %s", self.name, err)
+                continue
+            results.update(
+                (isbn, result)
+                for (isbn, result) in self.parse_isbn_batch_data(data)
+                if isbn in batch
+            )
+        return results
+
+    @abstractmethod
+    def get_isbn_batch_url(self, isbns):
+        """the url to look up several isbns at once"""
+
+    @abstractmethod
+    def parse_isbn_batch_data(self, data):
+        """(isbn, search result) pairs from a batch lookup"""
+
+
 class AbstractConnector(AbstractMinimalConnector):
     """generic book data connector"""
 
@@ -226,6 +261,8 @@ def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
     """wrapper for request.get"""
     # check if the url is blocked
     raise_not_valid_url(url)
+    if not rate_limit.acquire_token(url):
+        raise ConnectorException(f"Rate limited: {url}")
 
     try:
         resp = requests.get(
@@ -243,6 +280,8 @@ def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
         logger.info(err)
         raise ConnectorException(err)
 
+    if resp.status_code == 429:
+        rate_limit.record_throttled(url, resp.headers.get("Retry-After"))
     if not resp.ok:
         raise ConnectorException()
     try:
@@ -257,6 +296,8 @@ def get_data(url, params=None, timeout=settings.QUERY_TIMEOUT):
 def get_image(url, timeout=10):
     """wrapper for requesting an image"""
     raise_not_valid_url(url)
+    if not rate_limit.acquire_token(url):
+        return None, None
     try:
         resp = requests.get(
             url,
@@ -269,6 +310,8 @@ def get_image(url, timeout=10):
         logger.info(err)
         return None, None
 
+    if resp.status_code == 429:
+        rate_limit.record_throttled(url, resp.headers.get("Retry-After"))
     if not resp.ok:
         return None, None
 
@@ -324,6 +367,13 @@ def unique_physical_format(format_text):
     return format_text
 
 
+def normalize_isbn(isbn):
+    """the form isbns are looked up in"""
+    # Up-case the ISBN string to ensure any 'X' check-digit is correct
+    # If the ISBN has only 9 characters, prepend missing zero
+    return isbn.strip().upper().rjust(10, "0")
+
+
 def maybe_isbn(query):
     """check if a query looks like an isbn"""
     isbn = re.sub(r"[\W_]", "", query)  # removes filler characters
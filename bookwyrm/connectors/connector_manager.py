@@ -1,22 +1,76 @@
 """ interface with whatever connectors the app has """
 import asyncio
+from collections import Counter
+from concurrent import futures
+import hashlib
 import importlib
 import ipaddress
 import logging
+import threading
+import time
 from urllib.parse import urlparse
 
 import aiohttp
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
 from django.dispatch import receiver
 from django.db.models import signals
+from redis.exceptions import RedisError
 
 from requests import HTTPError
 
 from bookwyrm import book_search, models
-from bookwyrm.settings import SEARCH_TIMEOUT, USER_AGENT
+from bookwyrm.redis_store import r
+from bookwyrm.settings import QUERY_TIMEOUT, SEARCH_TIMEOUT, USER_AGENT
 from bookwyrm.tasks import app, LOW
+from bookwyrm.utils import metrics
+from . import rate_limit
 
 logger = logging.getLogger(__name__)
 
+# how long past its timeout a search result is served while it's refreshed
+SEARCH_CACHE_STALE = 60 * 60 * 24 * 7
+# only one refresh at a time for each search
+SEARCH_REFRESH_TIMEOUT = 60
+# results that arrive after the search budget are kept at least this long, even
+# from connectors that don't cache their searches
+SEARCH_LATE_TIMEOUT = 60 * 5
+
+# how much each response time counts towards a connector's average
+LATENCY_WEIGHT = 0.2
+# searches wait this many times as long as a typical connector takes, in seconds
+SEARCH_BUDGET_FACTOR = 2
+SEARCH_MIN_BUDGET = 1
+# connectors that keep failing or answering slowly are left out for a while
+CONNECTOR_FAILURE_THRESHOLD = 3
+CONNECTOR_SKIP_TIME = 60 * 5
+
+# average in a response time, and count a failure or clear the count, all in
+# one step so that searches running at the same time don't lose each other's
+RECORD_HEALTH_SCRIPT = r.register_script(
+    """
+local seconds = tonumber(ARGV[1])
+local outcome = ARGV[2]
+local weight = tonumber(ARGV[3])
+if seconds then
+    local latency = tonumber(redis.call("HGET", KEYS[1], "latency"))
+    if latency then
+        -- an exponentially weighted average
+        seconds = weight * seconds + (1 - weight) * latency
+    end
+    redis.call("HSET", KEYS[1], "latency", tostring(seconds))
+end
+if outcome == "answered" then
+    redis.call("HSET", KEYS[1], "failures", 0)
+elseif outcome == "failed" then
+    local failures = redis.call("HINCRBY", KEYS[1], "failures", 1)
+    if failures >= tonumber(ARGV[4]) then
+        redis.call("HSET", KEYS[1], "skip", ARGV[5])
+    end
+end
+"""
+)
+
 
 class ConnectorException(HTTPError):
     """when the connector can't do what was asked"""
@@ -34,6 +88,10 @@ async def get_results(session, url, min_confidence, query, connector):
     params = {"min_confidence": min_confidence}
     try:
         async with session.get(url, headers=headers, params=params) as response:
+            if response.status == 429:
+                await sync_to_async(rate_limit.record_throttled)(
+                    url, response.headers.get("Retry-After")
+                )
             if not response.ok:
                 logger.info("Unable to connect to %s: %s", url, response.reason)
                 return
@@ -56,27 +114,154 @@ async def get_results(session, url, min_confidence, query, connector):
         logger.info(err)
 
 
-async def async_connector_search(query, items, min_confidence):
-    """Try a number of requests simultaneously"""
-    timeout = aiohttp.ClientTimeout(total=SEARCH_TIMEOUT)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = []
-        for url, connector in items:
-            tasks.append(
-                asyncio.ensure_future(
-                    get_results(session, url, min_confidence, query, connector)
+async def get_timed_results(session, url, min_confidence, query, connector):
+    """try this specific connector, and see how long it takes"""
+    start = time.perf_counter()
+    result = await get_results(session, url, min_confidence, query, connector)
+    return result, time.perf_counter() - start
+
+
+async def async_connector_search(
+    query, items, min_confidence, budget=None, answered=None
+):
+    """Try a number of requests simultaneously. The responses that are back within
+    the budget are passed to the answered future, if there is one, and the rest
+    are cached when they finish"""
+    if not items:
+        return []
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=SEARCH_TIMEOUT)
+    ) as session:
+        tasks = [
+            asyncio.ensure_future(
+                get_timed_results(session, url, min_confidence, query, connector)
+            )
+            for (url, connector) in items
+        ]
+        done, late = await asyncio.wait(tasks, timeout=budget)
+        if answered:
+            answered.set_result(
+                [task.result()[0] if task in done else None for task in tasks]
+            )
+        # the slower connectors aren't asked again, so wait for them to finish
+        if late:
+            await asyncio.wait(late)
+
+    timings = []
+    for (task, (_, connector)) in zip(tasks, items):
+        (result, seconds) = task.result()
+        if not result or seconds >= QUERY_TIMEOUT:
+            outcome = "failed"
+        elif task in late:
+            # being slower than the others isn't a failure, and the results can
+            # still be served next time
+            outcome = "late"
+            cache_response(query, result, min_confidence, late=True)
+        else:
+            outcome = "answered"
+        timings.append((connector.identifier, seconds, outcome))
+    record_connector_health(timings)
+    return [task.result()[0] for task in tasks]
+
+
+def connector_search(query, items, min_confidence, budget=None):
+    """the responses from connectors that answer within the budget, in order, with
+    None for the rest. Slower searches carry on in the background"""
+    answered = futures.Future()
+    searched = futures.Future()
+
+    def run_search():
+        """search in a thread of its own, so it can outlast this request"""
+        try:
+            searched.set_result(
+                asyncio.run(
+                    async_connector_search(
+                        query, items, min_confidence, budget, answered
+                    )
                 )
             )
+        except Exception as err:  # pylint: disable=broad-except
+            searched.set_exception(err)
+
+    threading.Thread(target=run_search, daemon=True).start()
+    futures.wait([answered, searched], return_when=futures.FIRST_COMPLETED)
+    if answered.done():
+        return answered.result()
+    return searched.result()
+
 
-        results = await asyncio.gather(*tasks)
-        return results
+def connector_health_id(identifier):
+    """the redis key for how a connector's searches have been going"""
+    return f"{identifier}-connector-health"
+
+
+def get_connector_health(connectors):
+    """the average response time, in seconds, of each connector, and whether it's
+    being left out of searches"""
+    pipeline = r.pipeline()
+    for connector in connectors:
+        pipeline.hmget(connector_health_id(connector.identifier), "latency", "skip")
+    try:
+        values = pipeline.execute()
+    except RedisError as err:
+        logger.warning("Unable to load connector health: %s", err)
+        return {}
+
+    now = time.time()
+    return {
+        connector.identifier: {
+            "latency": float(latency) if latency else None,
+            "skip": float(skip or 0) > now,
+        }
+        for (connector, (latency, skip)) in zip(connectors, values)
+    }
+
+
+def get_search_budget(latencies):
+    """how long to wait for connectors, from how long they usually take, so that
+    the slowest one doesn't hold up every search"""
+    latencies = sorted(l for l in latencies if l is not None)
+    if not latencies:
+        return SEARCH_TIMEOUT
+    median = latencies[len(latencies) // 2]
+    return min(SEARCH_TIMEOUT, max(SEARCH_MIN_BUDGET, SEARCH_BUDGET_FACTOR * median))
+
+
+def record_connector_health(timings):
+    """update average response times and failures from (identifier, seconds,
+    outcome) for each search, where the outcome is answered, failed, or late.
+    seconds is None for searches that weren't waited for"""
+    if not timings:
+        return
+    skip_until = time.time() + CONNECTOR_SKIP_TIME
+    try:
+        pipeline = r.pipeline()
+        for (identifier, seconds, outcome) in timings:
+            RECORD_HEALTH_SCRIPT(
+                keys=[connector_health_id(identifier)],
+                args=[
+                    "" if seconds is None else seconds,
+                    outcome,
+                    LATENCY_WEIGHT,
+                    CONNECTOR_FAILURE_THRESHOLD,
+                    skip_until,
+                ],
+                client=pipeline,
+            )
+        pipeline.execute()
+    except RedisError as err:
+        logger.warning("Unable to record connector health: %s", err)
+
+    metrics.increment_many(
+        "connector-search", Counter(outcome for (_, _, outcome) in timings)
+    )
 
 
 def search(query, min_confidence=0.1, return_first=False):
     """find books based on arbitary keywords"""
     if not query:
         return []
-    results = []
+    query = book_search.normalize_query(query)
 
     items = []
     for connector in get_connectors():
@@ -90,9 +275,29 @@ def search(query, min_confidence=0.1, return_first=False):
             continue
         items.append((url, connector))
 
-    # load as many results as we can
-    results = asyncio.run(async_connector_search(query, items, min_confidence))
-    results = [r for r in results if r]
+    responses = get_cached_responses(query, items, min_confidence)
+    health = get_connector_health([c for (_, c) in items])
+    uncached = [
+        (url, connector)
+        for (url, connector) in items
+        if not connector.identifier in responses
+        and not health.get(connector.identifier, {}).get("skip")
+    ]
+    if uncached:
+        budget = get_search_budget(
+            health.get(c.identifier, {}).get("latency") for (_, c) in uncached
+        )
+        # searches take their share of requests, but don't wait for them
+        for (url, _) in uncached:
+            rate_limit.acquire_token(url, interactive=True)
+        # load as many results as we can
+        for response in connector_search(query, uncached, min_confidence, budget):
+            # failed requests will return None
+            if response:
+                cache_response(query, response, min_confidence)
+                responses[response["connector"].identifier] = response
+    # in the same order as the connectors
+    results = [responses[c.identifier] for (_, c) in items if c.identifier in responses]
 
     if return_first:
         # find the best result from all the responses and return that
@@ -100,10 +305,84 @@ def search(query, min_confidence=0.1, return_first=False):
         all_results = sorted(all_results, key=lambda r: r.confidence, reverse=True)
         return all_results[0] if all_results else None
 
-    # failed requests will return None, so filter those out
     return results
 
 
+def search_cache_id(connector, query, min_confidence):
+    """the cache key for a connector's response to a search"""
+    digest = hashlib.sha256(query.encode("utf-8")).hexdigest()
+    return f"connector-search-{connector.identifier}-{digest}-{min_confidence}"
+
+
+def get_cached_responses(query, items, min_confidence):
+    """the responses that have been cached, refreshing any that are stale"""
+    keys = {
+        connector.identifier: search_cache_id(connector, query, min_confidence)
+        for (_, connector) in items
+    }
+    cached = cache.get_many(keys.values())
+
+    responses = {}
+    now = time.time()
+    for (_, connector) in items:
+        entry = cached.get(keys.get(connector.identifier))
+        if not entry:
+            continue
+        responses[connector.identifier] = {
+            "connector": connector,
+            "results": [
+                book_search.SearchResult(connector=connector, **r)
+                for r in entry["results"]
+            ],
+        }
+        if now - entry["fetched"] > connector.connector.search_cache_timeout:
+            refresh_later(connector, query, min_confidence)
+    return responses
+
+
+def refresh_later(connector, query, min_confidence):
+    """search a connector in the background, if it keeps its results"""
+    if not connector.connector.search_cache_timeout:
+        return
+    key = search_cache_id(connector, query, min_confidence)
+    if cache.add(f"{key}-refresh", True, SEARCH_REFRESH_TIMEOUT):
+        refresh_search_task.delay(connector.identifier, query, min_confidence)
+
+
+def cache_response(query, response, min_confidence, late=False):
+    """keep a connector's search results to serve again, and while they're stale.
+    Late results are kept for the next search, whether or not the connector
+    caches its searches"""
+    connector = response["connector"]
+    timeout = connector.connector.search_cache_timeout
+    if timeout:
+        timeout += SEARCH_CACHE_STALE
+    if late:
+        timeout = max(timeout, SEARCH_LATE_TIMEOUT)
+    if not timeout:
+        return
+    cache.set(
+        search_cache_id(connector, query, min_confidence),
+        {"fetched": time.time(), "results": [r.json() for r in response["results"]]},
+        timeout,
+    )
+
+
+@app.task(queue=LOW, bind=True)
+def refresh_search_task(self, identifier, query, min_confidence):
+    """search a connector again to replace stale results"""
+    connector = load_connector(models.Connector.objects.get(identifier=identifier))
+    url = connector.get_search_url(query)
+    with rate_limit.retry_when_limited(self):
+        if not rate_limit.acquire_token(url):
+            return
+    (response,) = asyncio.run(
+        async_connector_search(query, [(url, connector)], min_confidence)
+    )
+    if response:
+        cache_response(query, response, min_confidence)
+
+
 def first_search_result(query, min_confidence=0.1):
     """search until you find a result that fits"""
     # try local search first
@@ -114,6 +393,25 @@ def first_search_result(query, min_confidence=0.1):
     return search(query, min_confidence=min_confidence, return_first=True) or None
 
 
+def isbn_batch_search(isbns):
+    """the first search result for each of many isbns, from the connectors that can
+    look them up in bulk, in order of priority"""
+    # pylint: disable=import-outside-toplevel
+    from .abstract_connector import IsbnBatchMixin
+
+    results = {}
+    connectors = [c for c in get_connectors() if isinstance(c, IsbnBatchMixin)]
+    health = get_connector_health(connectors)
+    for connector in connectors:
+        if health.get(connector.identifier, {}).get("skip"):
+            continue
+        remaining = [i for i in isbns if i not in results]
+        if not remaining:
+            break
+        results.update(connector.isbn_batch_search(remaining))
+    return results
+
+
 def get_connectors():
     """load all connectors"""
     print("getting all connectors")
@@ -145,22 +443,24 @@ def get_or_create_connector(remote_id):
     return load_connector(connector_info)
 
 
-@app.task(queue=LOW)
-def load_more_data(connector_id, book_id):
+@app.task(queue=LOW, bind=True)
+def load_more_data(self, connector_id, book_id):
     """background the work of getting all 10,000 editions of LoTR"""
     connector_info = models.Connector.objects.get(id=connector_id)
     connector = load_connector(connector_info)
     book = models.Book.objects.select_subclasses().get(id=book_id)
-    connector.expand_book_data(book)
+    with rate_limit.retry_when_limited(self):
+        connector.expand_book_data(book)
 
 
-@app.task(queue=LOW)
-def create_edition_task(connector_id, work_id, data):
+@app.task(queue=LOW, bind=True)
+def create_edition_task(self, connector_id, work_id, data):
     """separate task for each of the 10,000 editions of LoTR"""
     connector_info = models.Connector.objects.get(id=connector_id)
     connector = load_connector(connector_info)
     work = models.Work.objects.select_subclasses().get(id=work_id)
-    connector.create_edition_from_data(work, data)
+    with rate_limit.retry_when_limited(self):
+        connector.create_edition_from_data(work, data)
 
 
 def load_connector(connector_info):
@@ -3,15 +3,17 @@ import re
 
 from bookwyrm import models
 from bookwyrm.book_search import SearchResult
-from .abstract_connector import AbstractConnector, Mapping
+from .abstract_connector import AbstractConnector, IsbnBatchMixin, Mapping
 from .abstract_connector import get_data
 from .connector_manager import ConnectorException, create_edition_task
 
 
-class Connector(AbstractConnector):
+class Connector(IsbnBatchMixin, AbstractConnector):
     """instantiate a connector for inventaire"""
 
     generated_remote_link_field = "inventaire_id"
+    # entities can be looked up by several uris at once
+    isbn_batch_size = 50
 
     def __init__(self, identifier):
         super().__init__(identifier)
@@ -114,6 +116,21 @@ class Connector(AbstractConnector):
                 connector=self,
             )
 
+    def get_isbn_batch_url(self, isbns):
+        # the isbn search url already ends in the first uri's prefix
+        return self.isbn_search_url + "|isbn:".join(isbns)
+
+    def parse_isbn_batch_data(self, data):
+        # isbns are looked up in a canonical form, which may not be what was asked for
+        requested = {v: k for (k, v) in (data.get("redirects") or {}).items()}
+        for (uri, entity) in (data.get("entities") or {}).items():
+            uri = requested.get(uri, uri)
+            if not uri.startswith("isbn:"):
+                continue
+            entities = {"entities": {uri: entity}}
+            for result in self.parse_isbn_search_data(entities):
+                yield (uri.split(":", 1)[-1], result)
+
     def is_work_data(self, data):
         return data.get("type") == "work"
 
@@ -3,16 +3,18 @@ import re
 
 from bookwyrm import models
 from bookwyrm.book_search import SearchResult
-from .abstract_connector import AbstractConnector, Mapping
+from .abstract_connector import AbstractConnector, IsbnBatchMixin, Mapping
 from .abstract_connector import get_data, infer_physical_format, unique_physical_format
 from .connector_manager import ConnectorException, create_edition_task
 from .openlibrary_languages import languages
 
 
-class Connector(AbstractConnector):
+class Connector(IsbnBatchMixin, AbstractConnector):
     """instantiate a connector for OL"""
 
     generated_remote_link_field = "openlibrary_link"
+    # the books api takes a list of bibkeys
+    isbn_batch_size = 50
 
     def __init__(self, identifier):
         super().__init__(identifier)
@@ -188,6 +190,15 @@ class Connector(AbstractConnector):
                 year=search_result.get("publish_date"),
             )
 
+    def get_isbn_batch_url(self, isbns):
+        # the isbn search url already ends in the first bibkey's prefix
+        return self.isbn_search_url + ",ISBN:".join(isbns)
+
+    def parse_isbn_batch_data(self, data):
+        for (bibkey, search_result) in data.items():
+            for result in self.parse_isbn_search_data({bibkey: search_result}):
+                yield (bibkey.split(":", 1)[-1], result)
+
     def load_edition_data(self, olkey):
         """query openlibrary for editions of a work"""
         url = f"{self.books_url}/works/{olkey}/editions"
@@ -0,0 +1,186 @@
+""" keep requests to each connector's api within its rate limit """
+from contextlib import contextmanager
+import logging
+import math
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from django.core.cache import cache
+from django.db.models import signals
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from bookwyrm import models
+from bookwyrm.redis_store import r
+from bookwyrm.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# whether the task that's running retries when it's rate limited
+retrying = threading.local()
+
+RATE_LIMITS_KEY = "connector-rate-limits"
+RATE_LIMITS_TIMEOUT = 60 * 5
+# the part of each bucket that background tasks leave for people who are waiting
+INTERACTIVE_SHARE = 0.2
+# background tasks give up on a request rather than wait this long, in seconds
+MAX_WAIT = 60 * 5
+# and on trying again after this many times
+MAX_RETRIES = 20
+# how long to back off when an api says we've made too many requests
+DEFAULT_RETRY_AFTER = 30
+
+# refill the bucket for the time since it was last used, then take a token if
+# there's one to spare, or say how long it'll be until there is
+TAKE_TOKEN_SCRIPT = r.register_script(
+    """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local reserve = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 + reserve then
+    tokens = tokens - 1
+else
+    wait = (1 + reserve - tokens) / rate
+end
+redis.call("HMSET", KEYS[1], "tokens", tostring(tokens), "updated", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil((burst - tokens) / rate) + 60)
+return tostring(wait)
+"""
+)
+
+
+def rate_limit_id(identifier):
+    """the redis key for a connector's token bucket"""
+    return f"{identifier}-rate-limit"
+
+
+def load_rate_limits():
+    """(identifier, rate, burst) for each hostname the connectors use"""
+    limits = {}
+    for connector in models.Connector.objects.filter(active=True).order_by("priority"):
+        limit = (connector.identifier, connector.rate_limit, connector.rate_limit_burst)
+        for url in [
+            connector.base_url,
+            connector.books_url,
+            connector.covers_url,
+            connector.search_url,
+            connector.isbn_search_url,
+        ]:
+            hostname = urlparse(url or "").netloc
+            if hostname:
+                limits.setdefault(hostname, limit)
+    return limits
+
+
+def get_rate_limit(url):
+    """the connector that a url belongs to, and its rate limit"""
+    limits = cache.get_or_set(RATE_LIMITS_KEY, load_rate_limits, RATE_LIMITS_TIMEOUT)
+    return limits.get(urlparse(url).netloc)
+
+
+def take_token(identifier, rate, burst, reserve=0):
+    """use up one request, returning 0 or the seconds to wait until one is free"""
+    args = [rate, burst, reserve, time.time()]
+    return float(TAKE_TOKEN_SCRIPT(keys=[rate_limit_id(identifier)], args=args))
+
+
+class RateLimited(Exception):
+    """there's no request to spare for a background task right now"""
+
+    def __init__(self, identifier, wait, refill_time):
+        super().__init__(f"Rate limited by {identifier} for {wait:.2f}s")
+        self.wait = wait
+        # how long it takes the bucket to fill up again
+        self.refill_time = refill_time
+
+
+@contextmanager
+def retry_when_limited(task):
+    """background tasks that run in this try again later when a connector's api
+    has no requests to spare, instead of waiting and holding up a worker"""
+    retrying.active = True
+    try:
+        yield
+    except RateLimited as err:
+        # spread the retries out so they don't all come back at once
+        raise task.retry(
+            countdown=err.wait + random.uniform(0, err.refill_time),
+            exc=err,
+            max_retries=MAX_RETRIES,
+        )
+    finally:
+        retrying.active = False
+
+
+def acquire_token(url, interactive=None):
+    """take one of a connector's requests. requests that someone is waiting on,
+    which is anything that isn't retrying when limited, go ahead of the rest.
+    tasks that are retrying raise RateLimited when there isn't one to spare.
+    False if it would be too long a wait"""
+    limit = get_rate_limit(url)
+    if not limit or not limit[1]:
+        return True
+    (identifier, rate, burst) = limit
+    if interactive is None:
+        interactive = not getattr(retrying, "active", False)
+    reserve = 0 if interactive else math.floor(burst * INTERACTIVE_SHARE)
+
+    try:
+        wait = take_token(identifier, rate, burst, reserve)
+    except RedisError as err:
+        logger.warning("Unable to check the rate limit for %s: %s", identifier, err)
+        return True
+    if not wait or interactive:
+        return True
+
+    if wait > MAX_WAIT:
+        logger.info("Gave up waiting for a request to %s", identifier)
+        metrics.increment_many("rate-limit", {f"{identifier}-gave-up": 1})
+        return False
+    metrics.increment_many(
+        "rate-limit",
+        {f"{identifier}-retries": 1, f"{identifier}-retry-ms": int(wait * 1000)},
+    )
+    raise RateLimited(identifier, wait, burst / rate)
+
+
+def record_throttled(url, retry_after=None):
+    """the api says we've made too many requests, so empty the bucket for as long
+    as it asks us to wait"""
+    limit = get_rate_limit(url)
+    if not limit:
+        return
+    (identifier, rate, burst) = limit
+    metrics.increment_many("rate-limit", {f"{identifier}-429": 1})
+    if not rate:
+        return
+
+    try:
+        seconds = int(retry_after)
+    except (TypeError, ValueError):
+        seconds = DEFAULT_RETRY_AFTER
+    key = rate_limit_id(identifier)
+    try:
+        pipeline = r.pipeline()
+        pipeline.hset(key, "tokens", -rate * seconds)
+        pipeline.hset(key, "updated", time.time())
+        pipeline.expire(key, math.ceil(seconds + burst / rate) + 60)
+        pipeline.execute()
+    except RedisError as err:
+        logger.warning("Unable to update the rate limit for %s: %s", identifier, err)
+
+
+@receiver(signals.post_save, sender="bookwyrm.Connector")
+@receiver(signals.post_delete, sender="bookwyrm.Connector")
+# pylint: disable=unused-argument
+def clear_rate_limits(sender, instance, *args, **kwargs):
+    """connectors were added, changed, or removed"""
+    cache.delete(RATE_LIMITS_KEY)
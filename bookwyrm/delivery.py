@@ -0,0 +1,320 @@
+""" keep track of who activities go to, which servers are accepting them, and
+retry the rest """
+from collections import Counter
+import json
+import logging
+import time
+from urllib.parse import urlparse
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import signals
+from django.dispatch import receiver
+from redis.exceptions import RedisError
+
+from bookwyrm import settings
+from bookwyrm.redis_store import r
+from bookwyrm.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# what happened when an activity was sent to an inbox
+DELIVERED = "delivered"
+FAILED = "failed"  # the server is up but won't take it, no point trying again
+RETRY = "retry"  # the server couldn't be reached or had an error
+
+# don't keep piling up activities for a server that might never come back
+MAX_PARKED_DELIVERIES = 1000
+PARKED_DELIVERY_TIMEOUT = 60 * 60 * 24 * 7
+
+# delivery sets are kept up to date, but get rebuilt every so often anyway
+DELIVERY_SET_TIMEOUT = 60 * 60 * 24 * 7
+# marks a delivery set as loaded, even if the user has no remote followers
+SENTINEL = "0"
+
+
+def get_host(url):
+    """the server name, in the same format as FederatedServer"""
+    return urlparse(url).netloc
+
+
+def delivery_health_id(host):
+    """the redis key for how deliveries to a server have been going"""
+    return f"{host}-delivery-health"
+
+
+def delivery_probe_id(host):
+    """the redis key that's set while a delivery is checking if a server is back"""
+    return f"{host}-delivery-probe"
+
+
+def parked_deliveries_id(host):
+    """the redis key for deliveries waiting for a server to come back"""
+    return f"{host}-parked-deliveries"
+
+
+def get_delivery_health(host):
+    """consecutive failures, when they started, and a score out of 100"""
+    failures, failing_since = r.hmget(
+        delivery_health_id(host), "failures", "failing_since"
+    )
+    failures = int(failures or 0)
+    return {
+        "failures": failures,
+        "failing_since": float(failing_since) if failing_since else None,
+        "score": 100 // (1 + failures),
+    }
+
+
+def get_retry_delay(attempt):
+    """exponential backoff, in seconds"""
+    return settings.DELIVERY_RETRY_DELAY * 4 ** attempt
+
+
+def filter_available(sender_id, activity, recipients):
+    """the recipients on servers that are taking deliveries. deliveries to servers
+    that have been down for a long time are parked until the server comes back"""
+    hosts = {get_host(inbox) for inbox in recipients}
+    pipeline = r.pipeline()
+    for host in hosts:
+        pipeline.hmget(delivery_health_id(host), "failures", "failing_since")
+    health = dict(zip(hosts, pipeline.execute()))
+
+    now = time.time()
+    dead = [
+        host
+        for (host, (failures, failing_since)) in health.items()
+        if int(failures or 0) >= settings.DELIVERY_FAILURE_THRESHOLD
+        and now - float(failing_since or now) >= settings.DELIVERY_DEAD_AFTER
+    ]
+    unavailable = set()
+    if dead:
+        # only the delivery that claims the probe gets through to see if the
+        # server is back
+        pipeline = r.pipeline()
+        for host in dead:
+            pipeline.set(
+                delivery_probe_id(host), 1, nx=True, ex=settings.DELIVERY_PROBE_DELAY
+            )
+        unavailable = {h for (h, probe) in zip(dead, pipeline.execute()) if not probe}
+
+    pipeline = r.pipeline()
+    available = []
+    for inbox in recipients:
+        if get_host(inbox) not in unavailable:
+            available.append(inbox)
+            continue
+        key = parked_deliveries_id(get_host(inbox))
+        pipeline.rpush(key, json.dumps([sender_id, activity, inbox]))
+        pipeline.ltrim(key, -1 * MAX_PARKED_DELIVERIES, -1)
+        pipeline.expire(key, PARKED_DELIVERY_TIMEOUT)
+
+    if unavailable:
+        counts = {"parked": len(recipients) - len(available)}
+        metrics.increment_many("deliveries", counts)
+    pipeline.execute()
+    return available
+
+
+def record_results(recipients, results):
+    """update server health from how a broadcast went. returns the inboxes to
+    retry, and any deliveries that were waiting on a server that's back"""
+    succeeded = set()
+    failed = set()
+    retry = []
+    for (inbox, result) in zip(recipients, results):
+        if result == RETRY:
+            failed.add(get_host(inbox))
+            retry.append(inbox)
+        else:
+            # even a rejected activity means the server is up
+            succeeded.add(get_host(inbox))
+    # one good delivery is enough to show the server is reachable
+    failed -= succeeded
+
+    now = time.time()
+    pipeline = r.pipeline()
+    for host in succeeded:
+        pipeline.delete(delivery_health_id(host))
+        pipeline.lrange(parked_deliveries_id(host), 0, -1)
+        pipeline.delete(parked_deliveries_id(host))
+    for host in failed:
+        pipeline.hincrby(delivery_health_id(host), "failures", 1)
+        pipeline.hsetnx(delivery_health_id(host), "failing_since", now)
+    responses = pipeline.execute()
+
+    unparked = []
+    # every succeeded host has three responses, and parked deliveries are second
+    for parked in responses[1 : 3 * len(succeeded) : 3]:
+        unparked += [json.loads(p) for p in parked]
+
+    metrics.increment_many("deliveries", Counter(results))
+    return retry, unparked
+
+
+def delivery_set_id(user_id, bookwyrm_user):
+    """the redis key for the inboxes of a user's remote followers"""
+    software = "bookwyrm" if bookwyrm_user else "other"
+    return f"{user_id}-delivery-{software}"
+
+
+def get_follower_inboxes(user, bookwyrm_user):
+    """the inbox each of a user's remote followers, on bookwyrm or not, should
+    get activities at"""
+    user_model = apps.get_model("bookwyrm.User", require_ready=True)
+    followers = (
+        user_model.viewer_aware_objects(user)
+        .filter(local=False, following=user, bookwyrm_user=bookwyrm_user)
+        .values_list("id", "shared_inbox", "inbox")
+    )
+    # ideally, we will send to shared inboxes for efficiency
+    return {i: shared_inbox or inbox for (i, shared_inbox, inbox) in followers}
+
+
+def get_delivery_set(user, software=None):
+    """the deduplicated inboxes for a user's remote followers, on bookwyrm
+    or on other software, or both"""
+    if software:
+        bookwyrm_users = [software == "bookwyrm"]
+    else:
+        bookwyrm_users = [True, False]
+
+    try:
+        return get_cached_delivery_set(user, bookwyrm_users)
+    except RedisError as err:
+        # the activity still needs to go out
+        logger.warning("Unable to load delivery set for %s: %s", user.id, err)
+    inboxes = set()
+    for bookwyrm_user in bookwyrm_users:
+        inboxes |= set(get_follower_inboxes(user, bookwyrm_user).values())
+    return list(inboxes)
+
+
+def get_cached_delivery_set(user, bookwyrm_users):
+    """the delivery sets from redis, loading any that are missing"""
+    pipeline = r.pipeline()
+    for bookwyrm_user in bookwyrm_users:
+        pipeline.hgetall(delivery_set_id(user.id, bookwyrm_user))
+
+    inboxes = set()
+    for (bookwyrm_user, values) in zip(bookwyrm_users, pipeline.execute()):
+        if SENTINEL.encode() not in values:
+            inboxes |= set(populate_delivery_set(user, bookwyrm_user).values())
+            continue
+        values.pop(SENTINEL.encode())
+        inboxes |= {v.decode("utf8") for v in values.values()}
+    return list(inboxes)
+
+
+def populate_delivery_set(user, bookwyrm_user):
+    """load a delivery set from the database"""
+    key = delivery_set_id(user.id, bookwyrm_user)
+    inboxes = get_follower_inboxes(user, bookwyrm_user)
+
+    pipeline = r.pipeline()
+    pipeline.delete(key)
+    pipeline.hset(key, SENTINEL, "")
+    for (follower_id, inbox) in inboxes.items():
+        pipeline.hset(key, follower_id, inbox)
+    pipeline.expire(key, DELIVERY_SET_TIMEOUT)
+    pipeline.execute()
+    return inboxes
+
+
+def update_follower(follower, user_ids):
+    """set where a remote user gets activities, for the users they follow. any
+    delivery set that isn't loaded will be rebuilt anyway"""
+    pipeline = r.pipeline()
+    for user_id in user_ids:
+        # the user may have switched software, or been deactivated
+        pipeline.hdel(delivery_set_id(user_id, True), follower.id)
+        pipeline.hdel(delivery_set_id(user_id, False), follower.id)
+        if follower.is_active:
+            pipeline.hset(
+                delivery_set_id(user_id, follower.bookwyrm_user),
+                follower.id,
+                follower.shared_inbox or follower.inbox,
+            )
+    pipeline.execute()
+
+
+def clear_followed_delivery_sets(follower_ids):
+    """drop the delivery sets of every local user these remote users follow, so
+    they're rebuilt from the database. queryset updates don't send signals"""
+    user_model = apps.get_model("bookwyrm.User", require_ready=True)
+    user_ids = list(
+        user_model.objects.filter(local=True, followers__id__in=follower_ids)
+        .values_list("id", flat=True)
+        .distinct()
+    )
+    if not user_ids:
+        return
+
+    def clear_delivery_sets():
+        pipeline = r.pipeline()
+        for user_id in user_ids:
+            pipeline.delete(
+                delivery_set_id(user_id, True), delivery_set_id(user_id, False)
+            )
+        try:
+            pipeline.execute()
+        except RedisError as err:
+            logger.warning("Unable to clear delivery sets: %s", err)
+
+    transaction.on_commit(clear_delivery_sets)
+
+
+# pylint: disable=unused-argument
+@receiver(signals.post_save, sender="bookwyrm.UserFollows")
+def add_follower_to_delivery_set(sender, instance, created, *args, **kwargs):
+    """a remote user followed a local user"""
+    if not created or instance.user_subject.local or not instance.user_object.local:
+        return
+    transaction.on_commit(
+        lambda: update_follower(instance.user_subject, [instance.user_object.id])
+    )
+
+
+@receiver(signals.post_delete, sender="bookwyrm.UserFollows")
+def remove_follower_from_delivery_set(sender, instance, *args, **kwargs):
+    """a remote user stopped following a local user, or was blocked"""
+    if instance.user_subject.local or not instance.user_object.local:
+        return
+    follower_id = instance.user_subject.id
+    user_id = instance.user_object.id
+
+    def remove_follower():
+        r.hdel(delivery_set_id(user_id, True), follower_id)
+        r.hdel(delivery_set_id(user_id, False), follower_id)
+
+    transaction.on_commit(remove_follower)
+
+
+@receiver(signals.pre_save, sender="bookwyrm.User")
+def check_active_status(sender, instance, *args, update_fields=None, **kwargs):
+    """whether a remote user is being activated or deactivated, compared with
+    what's in the database"""
+    instance.active_status_changed = False
+    if instance.local or not instance.id:
+        return
+    if update_fields is not None and "is_active" not in update_fields:
+        return
+    instance.active_status_changed = (
+        sender.objects.filter(id=instance.id)
+        .exclude(is_active=instance.is_active)
+        .exists()
+    )
+
+
+@receiver(signals.post_save, sender="bookwyrm.User")
+def update_delivery_sets(sender, instance, created, *args, **kwargs):
+    """a remote user's inbox, software, or active status changed"""
+    if created or instance.local:
+        return
+    if not instance.delivery_tracker.changed() and not getattr(
+        instance, "active_status_changed", False
+    ):
+        return
+    user_ids = list(instance.following.filter(local=True).values_list("id", flat=True))
+    if user_ids:
+        transaction.on_commit(lambda: update_follower(instance, user_ids))
@@ -1,8 +1,14 @@
 """ handle reading a csv from an external service, defaults are from Goodreads """
 import csv
+from itertools import chain, islice
+import logging
+
+from django.db.models import F
 from django.utils import timezone
 from bookwyrm.models import ImportJob, ImportItem
 
+logger = logging.getLogger(__name__)
+
 
 class Importer:
     """Generic class for csv data import from an outside service"""
@@ -33,24 +39,27 @@ class Importer:
         "reading": ["currently-reading", "reading", "currently reading"],
     }
 
+    # how many rows are read and saved at a time
+    chunk_size = 500
+
     def create_job(self, user, csv_file, include_reviews, privacy):
         """check over a csv and creates a database entry for the job"""
         csv_reader = csv.DictReader(csv_file, delimiter=self.delimiter)
-        rows = list(csv_reader)
-        if len(rows) < 1:
+        try:
+            first_row = next(csv_reader)
+        except StopIteration:
             raise ValueError("CSV file is empty")
-        rows = enumerate(rows)
 
         job = ImportJob.objects.create(
             user=user,
             include_reviews=include_reviews,
             privacy=privacy,
-            mappings=self.create_row_mappings(csv_reader.fieldnames),
+            # the reader still needs its own copy of the headers
+            mappings=self.create_row_mappings(list(csv_reader.fieldnames)),
             source=self.service,
         )
 
-        for index, entry in rows:
-            self.create_item(job, index, entry)
+        self.create_items(job, enumerate(chain([first_row], csv_reader)))
         return job
 
     def update_legacy_job(self, job):
@@ -59,13 +68,18 @@ class Importer:
         headers = list(items.first().data.keys())
         job.mappings = self.create_row_mappings(headers)
         job.updated_date = timezone.now()
-        job.save()
+        job.save(update_fields=["mappings", "updated_date"])
 
-        for item in items.all():
-            normalized = self.normalize_row(item.data, job.mappings)
-            normalized["shelf"] = self.get_shelf(normalized)
-            item.normalized_data = normalized
-            item.save()
+        items = items.all().iterator(chunk_size=self.chunk_size)
+        while True:
+            chunk = list(islice(items, self.chunk_size))
+            if not chunk:
+                break
+            for item in chunk:
+                normalized = self.normalize_row(item.data, job.mappings)
+                normalized["shelf"] = self.get_shelf(normalized)
+                item.normalized_data = normalized
+            ImportItem.objects.bulk_update(chunk, ["normalized_data"])
 
     def create_row_mappings(self, headers):
         """guess what the headers mean"""
@@ -78,11 +92,32 @@ class Importer:
             mappings[key] = value
         return mappings
 
-    def create_item(self, job, index, data):
-        """creates and saves an import item"""
+    def create_items(self, job, rows):
+        """creates and saves import items from (index, data) pairs, a chunk at a
+        time, so that big files aren't all in memory at once"""
+        rows = iter(rows)
+        count = 0
+        while True:
+            items = [
+                self.build_item(job, index, data)
+                for (index, data) in islice(rows, self.chunk_size)
+            ]
+            if not items:
+                break
+            ImportItem.objects.bulk_create(items)
+            # bulk creation skips the items' own updates to the progress counters
+            ImportJob.objects.filter(id=job.id).update(
+                total_items=F("total_items") + len(items)
+            )
+            count += len(items)
+            logger.info("Created %d items for import job %d", count, job.id)
+        job.refresh_from_db(fields=["total_items"])
+
+    def build_item(self, job, index, data):
+        """an unsaved import item for a row"""
         normalized = self.normalize_row(data, job.mappings)
         normalized["shelf"] = self.get_shelf(normalized)
-        ImportItem(job=job, index=index, data=data, normalized_data=normalized).save()
+        return ImportItem(job=job, index=index, data=data, normalized_data=normalized)
 
     def get_shelf(self, normalized_row):
         """determine which shelf to use"""
@@ -110,7 +145,6 @@ class Importer:
             mappings=original_job.mappings,
             retry=True,
         )
-        for item in items:
-            # this will re-normalize the raw data
-            self.create_item(job, item.index, item.data)
+        # this will re-normalize the raw data
+        self.create_items(job, ((item.index, item.data) for item in items))
         return job
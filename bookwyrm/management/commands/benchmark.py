@@ -0,0 +1,141 @@
+""" Time hot code paths """
+import json
+import pathlib
+import timeit
+import tracemalloc
+
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pkcs1_15  # pylint: disable=no-name-in-module
+from Crypto.Hash import SHA256
+from django.core.management.base import BaseCommand
+from django.utils.http import http_date
+
+from bookwyrm import activitypub, models, signatures
+from bookwyrm.activitypub.base_activity import parse_plans
+
+
+def sign_uncached(private_key, message):
+    """how signing worked before signers were cached"""
+    signer = pkcs1_15.new(RSA.import_key(private_key))
+    return signer.sign(SHA256.new(message.encode("utf8")))
+
+
+def benchmark_signatures():
+    """signing, parsing the key every time or not"""
+    private_key, _ = signatures.create_key_pair()
+    message = "\n".join(
+        [
+            "(request-target): post /user/mouse/inbox",
+            "host: example.com",
+            f"date: {http_date()}",
+            f"digest: {signatures.make_digest('hi')}",
+        ]
+    )
+    return {
+        "uncached": lambda: sign_uncached(private_key, message),
+        "cached": lambda: signatures.sign_message(private_key, message),
+    }
+
+
+def with_instance_fields(instance):
+    """how model instances were set up before field plans were shared"""
+    plan = instance.build_field_plan()
+    instance.__dict__.update(
+        {
+            "image_fields": list(plan.image_fields),
+            "many_to_many_fields": list(plan.many_to_many_fields),
+            "simple_fields": list(plan.simple_fields),
+            "activity_fields": list(plan.activity_fields),
+        }
+    )
+    return instance
+
+
+def benchmark_models():
+    """creating statuses and editions, sorting their fields each time or not"""
+    return {
+        "status per instance": lambda: with_instance_fields(models.Status()),
+        "status shared": models.Status,
+        "edition per instance": lambda: with_instance_fields(models.Edition()),
+        "edition shared": models.Edition,
+    }
+
+
+def load_activities():
+    """the activitypub fixtures from the tests that parse on their own"""
+    data = pathlib.Path(__file__).parents[2].joinpath("tests/data")
+    activities = []
+    for path in sorted(data.glob("[ab][pw]_*.json")):
+        activity = json.loads(path.read_bytes())
+        if not isinstance(activity, dict):
+            continue
+        try:
+            activitypub.parse(activity)
+        except activitypub.ActivitySerializerError:
+            continue
+        activities.append(activity)
+    return activities
+
+
+def parse_uncompiled(activities):
+    """how activities were parsed before field plans were kept"""
+    for activity in activities:
+        parse_plans.clear()
+        activitypub.parse(activity)
+
+
+def parse_compiled(activities):
+    """parse with the field plans each class keeps"""
+    for activity in activities:
+        activitypub.parse(activity)
+
+
+def benchmark_parse():
+    """parsing the test fixtures, looking over dataclass fields each time or not"""
+    activities = load_activities()
+    return {
+        "uncompiled": lambda: parse_uncompiled(activities),
+        "compiled": lambda: parse_compiled(activities),
+    }
+
+
+benchmarks = {
+    "signatures": benchmark_signatures,
+    "models": benchmark_models,
+    "parse": benchmark_parse,
+}
+
+
+class Command(BaseCommand):
+    """run a microbenchmark"""
+
+    help = "Time how many operations per second a hot code path can do"
+
+    def add_arguments(self, parser):
+        """what to time"""
+        parser.add_argument("name", choices=benchmarks.keys())
+        parser.add_argument(
+            "--number",
+            type=int,
+            default=1000,
+            help="How many times to run each version",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """print operations per second and memory kept for each version"""
+        number = options["number"]
+        for (version, run) in benchmarks[options["name"]]().items():
+            seconds = timeit.timeit(run, number=number)
+
+            # like a queryset, hold on to every result
+            tracemalloc.start()
+            results = [run() for _ in range(number)]
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del results
+
+            print(
+                f"{version}: {number / seconds:.0f} per second, "
+                f"{size / number:.0f} bytes each"
+            )
@@ -0,0 +1,41 @@
+""" Print the performance counters """
+from django.core.management.base import BaseCommand
+
+from bookwyrm.utils import metrics
+
+
+# pylint: disable=no-self-use
+class Command(BaseCommand):
+    """print counters from redis"""
+
+    help = "Show the performance counters collected in redis"
+
+    def add_arguments(self, parser):
+        """which counters to show"""
+        parser.add_argument(
+            "name",
+            nargs="?",
+            help="Only show this group of counters",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Reset the counters after showing them",
+        )
+
+    # pylint: disable=unused-argument
+    def handle(self, *args, **options):
+        """print each group of counters"""
+        names = [options["name"]] if options.get("name") else metrics.get_metric_names()
+        for name in names:
+            print(name)
+            counts = metrics.get_metrics(name)
+            for (field, value) in sorted(counts.items()):
+                print(f"  {field}: {value}")
+            for (percentile, bucket) in metrics.get_latency_percentiles(counts).items():
+                print(f"  p{percentile}: {bucket}")
+            lookups = counts.get("hit", 0) + counts.get("miss", 0)
+            if lookups:
+                print(f"  hit ratio: {counts.get('hit', 0) / lookups:.2f}")
+            if options.get("reset"):
+                metrics.reset_metrics(name)
@@ -0,0 +1,105 @@
+# Generated by Django 3.2.16 on 2022-12-01 18:00
+
+from django.db import migrations, models
+
+# the deduplication fields as of this migration
+BOOK_DATA_FIELDS = [
+    "remote_id",
+    "origin_id",
+    "openlibrary_key",
+    "inventaire_id",
+    "librarything_key",
+    "goodreads_key",
+    "bnf_id",
+    "viaf",
+    "wikidata",
+    "asin",
+]
+INDEXED_MODELS = [
+    ("Work", "bookwyrm.book", BOOK_DATA_FIELDS + ["lccn"]),
+    (
+        "Edition",
+        "bookwyrm.book",
+        BOOK_DATA_FIELDS + ["isbn_10", "isbn_13", "oclc_number"],
+    ),
+    (
+        "Author",
+        "bookwyrm.author",
+        BOOK_DATA_FIELDS + ["wikipedia_link", "isni", "gutenberg_id"],
+    ),
+]
+
+
+def index_identifiers(apps, schema_editor):
+    """add the identifiers of existing book data to the index"""
+    db_alias = schema_editor.connection.alias
+    identifier_model = apps.get_model("bookwyrm", "Identifier")
+
+    for (model_name, label, fields) in INDEXED_MODELS:
+        model = apps.get_model("bookwyrm", model_name)
+        values = model.objects.using(db_alias).values_list("id", *fields)
+        identifiers = []
+        for row in values.iterator(chunk_size=1000):
+            identifiers += [
+                identifier_model(
+                    model=label, field=field, value=value, object_id=row[0]
+                )
+                for (field, value) in zip(fields, row[1:])
+                if value
+            ]
+            if len(identifiers) >= 1000:
+                identifier_model.objects.using(db_alias).bulk_create(
+                    identifiers, ignore_conflicts=True
+                )
+                identifiers = []
+        identifier_model.objects.using(db_alias).bulk_create(
+            identifiers, ignore_conflicts=True
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0167_auto_20221125_1900"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Identifier",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("model", models.CharField(max_length=255)),
+                ("field", models.CharField(max_length=255)),
+                ("value", models.CharField(max_length=255)),
+                ("object_id", models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="identifier",
+            index=models.Index(
+                fields=["model", "value"], name="bookwyrm_id_model_7b2f67_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="identifier",
+            index=models.Index(
+                fields=["model", "object_id"], name="bookwyrm_id_model_27342a_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="identifier",
+            constraint=models.UniqueConstraint(
+                fields=("model", "object_id", "field", "value"),
+                name="unique_identifier",
+            ),
+        ),
+        migrations.RunPython(index_identifiers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2022-12-02 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0168_identifier"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="connector",
+            name="search_cache_timeout",
+            field=models.IntegerField(default=86400),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2022-12-05 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0169_connector_search_cache_timeout"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="connector",
+            name="rate_limit",
+            field=models.FloatField(default=5),
+        ),
+        migrations.AddField(
+            model_name="connector",
+            name="rate_limit_burst",
+            field=models.IntegerField(default=10),
+        ),
+    ]
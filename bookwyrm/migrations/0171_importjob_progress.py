@@ -0,0 +1,66 @@
+# Generated by Django 3.2.16 on 2022-12-06 17:00
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_items(apps, schema_editor):
+    """set the progress counters of existing jobs from their items"""
+    db_alias = schema_editor.connection.alias
+    job_model = apps.get_model("bookwyrm", "ImportJob")
+    jobs = job_model.objects.using(db_alias).annotate(
+        item_total=Count("items"),
+        item_completed=Count(
+            "items",
+            filter=Q(items__book__isnull=False) | Q(items__fail_reason__isnull=False),
+        ),
+        item_successful=Count("items", filter=Q(items__book__isnull=False)),
+        item_failed=Count("items", filter=Q(items__fail_reason__isnull=False)),
+    )
+    updated = []
+    for job in jobs.iterator(chunk_size=1000):
+        job.total_items = job.item_total
+        job.completed_items = job.item_completed
+        job.successful_items = job.item_successful
+        job.failed_items = job.item_failed
+        updated.append(job)
+        if len(updated) >= 1000:
+            job_model.objects.using(db_alias).bulk_update(
+                updated,
+                ["total_items", "completed_items", "successful_items", "failed_items"],
+            )
+            updated = []
+    job_model.objects.using(db_alias).bulk_update(
+        updated, ["total_items", "completed_items", "successful_items", "failed_items"]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bookwyrm", "0170_connector_rate_limit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="total_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="completed_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="successful_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="failed_items",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
@@ -6,6 +6,7 @@ from .book import Book, Work, Edition, BookDataModel
 from .author import Author
 from .link import Link, FileLink, LinkDomain
 from .connector import Connector
+from .identifier import Identifier
 
 from .shelf import Shelf, ShelfBook
 from .list import List, ListItem
@@ -1,30 +1,36 @@
 """ activitypub model functionality """
 import asyncio
-from base64 import b64encode
-from collections import namedtuple
+from collections import namedtuple, Counter
 from functools import reduce
 import json
 import operator
 import logging
+import os
 from typing import List
 from uuid import uuid4
 
 import aiohttp
-from Crypto.PublicKey import RSA
-from Crypto.Signature import pkcs1_15
-from Crypto.Hash import SHA256
 from django.apps import apps
+from django.core.cache import cache
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import Q, signals
+from django.dispatch import receiver
 from django.utils.http import http_date
 
-from bookwyrm import activitypub
+from bookwyrm import activitypub, delivery
 from bookwyrm.settings import USER_AGENT, PAGE_LENGTH
-from bookwyrm.signatures import make_signature, make_digest
-from bookwyrm.tasks import app, MEDIUM
+from bookwyrm.settings import BROADCAST_CONNECTIONS, BROADCAST_CONNECTIONS_PER_HOST
+from bookwyrm.settings import BROADCAST_KEEPALIVE, DELIVERY_MAX_ATTEMPTS
+from bookwyrm.signatures import make_signatures, make_digest, sign_message
+from bookwyrm.tasks import app, LOW, MEDIUM
+from bookwyrm.utils import metrics
 from bookwyrm.models.fields import ImageField, ManyToManyField
 
 logger = logging.getLogger(__name__)
+# changes to related objects, like a mentioned user's name, aren't tracked
+ACTIVITY_JSON_TIMEOUT = 60 * 60
+# found remote ids are checked against the object before they're used
+REMOTE_ID_TIMEOUT = 60 * 60 * 24
 # I tried to separate these classes into mutliple files but I kept getting
 # circular import errors so I gave up. I'm sure it could be done though!
 
@@ -36,64 +42,147 @@ def set_activity_from_property_field(activity, obj, field):
     activity[field[1]] = getattr(obj, field[0])
 
 
+FieldPlan = namedtuple(
+    "FieldPlan",
+    ("image_fields", "many_to_many_fields", "simple_fields", "activity_fields"),
+)
+# the fields of each model class, sorted by how they're serialized
+field_plans = {}
+
+
 class ActivitypubMixin:
     """add this mixin for models that are AP serializable"""
 
     activity_serializer = lambda: {}
     reverse_unfurl = False
+    # these are separate to avoid infinite recursion issues
+    deserialize_reverse_fields = ()
+    serialize_reverse_fields = ()
+
+    @classmethod
+    def get_field_plan(cls):
+        """the serializable fields, worked out once for each model class"""
+        plan = field_plans.get(cls)
+        if plan is None:
+            plan = field_plans[cls] = cls.build_field_plan()
+        return plan
 
-    def __init__(self, *args, **kwargs):
+    @classmethod
+    def build_field_plan(cls):
         """collect some info on model fields for later use"""
-        self.image_fields = []
-        self.many_to_many_fields = []
-        self.simple_fields = []  # "simple"
+        image_fields = []
+        many_to_many_fields = []
+        simple_fields = []  # "simple"
         # sort model fields by type
-        for field in self._meta.get_fields():
+        for field in cls._meta.get_fields():
             if not hasattr(field, "field_to_activity"):
                 continue
 
             if isinstance(field, ImageField):
-                self.image_fields.append(field)
+                image_fields.append(field)
             elif isinstance(field, ManyToManyField):
-                self.many_to_many_fields.append(field)
+                many_to_many_fields.append(field)
             else:
-                self.simple_fields.append(field)
+                simple_fields.append(field)
 
         # a list of allll the serializable fields
-        self.activity_fields = (
-            self.image_fields + self.many_to_many_fields + self.simple_fields
-        )
-        if hasattr(self, "property_fields"):
-            self.activity_fields += [
-                # pylint: disable=cell-var-from-loop
-                PropertyField(lambda a, o: set_activity_from_property_field(a, o, f))
-                for f in self.property_fields
+        activity_fields = image_fields + many_to_many_fields + simple_fields
+        if hasattr(cls, "property_fields"):
+            activity_fields += [
+                PropertyField(
+                    lambda a, o, f=f: set_activity_from_property_field(a, o, f)
+                )
+                for f in cls.property_fields
             ]
-
-        # these are separate to avoid infinite recursion issues
-        self.deserialize_reverse_fields = (
-            self.deserialize_reverse_fields
-            if hasattr(self, "deserialize_reverse_fields")
-            else []
-        )
-        self.serialize_reverse_fields = (
-            self.serialize_reverse_fields
-            if hasattr(self, "serialize_reverse_fields")
-            else []
+        return FieldPlan(
+            tuple(image_fields),
+            tuple(many_to_many_fields),
+            tuple(simple_fields),
+            tuple(activity_fields),
         )
 
-        super().__init__(*args, **kwargs)
+    @property
+    def image_fields(self):
+        """fields that are serialized as images"""
+        return self.get_field_plan().image_fields
+
+    @property
+    def many_to_many_fields(self):
+        """fields that are serialized as lists of objects"""
+        return self.get_field_plan().many_to_many_fields
+
+    @property
+    def simple_fields(self):
+        """every other serializable model field"""
+        return self.get_field_plan().simple_fields
+
+    @property
+    def activity_fields(self):
+        """all the serializable fields, including properties"""
+        return self.get_field_plan().activity_fields
 
     @classmethod
     def find_existing_by_remote_id(cls, remote_id):
-        """look up a remote id in the db"""
-        return cls.find_existing({"id": remote_id})
+        """look up a remote id in the db, starting with where it was last found"""
+        if not remote_id:
+            return cls.find_existing({"id": remote_id})
+
+        key = remote_id_key(remote_id)
+        found = cache.get(key)
+        if found:
+            result = cls.get_found_remote_id(remote_id, *found)
+            if result:
+                return result
+
+        result = cls.find_existing({"id": remote_id})
+        if result:
+            label = result._meta.label  # pylint: disable=protected-access
+            cache.set(key, (label, result.id), REMOTE_ID_TIMEOUT)
+        return result
+
+    @classmethod
+    def get_found_remote_id(cls, remote_id, label, pk):
+        """load the object a remote id was last found on, if it's still there"""
+        try:
+            model = apps.get_model(label, require_ready=True)
+        except LookupError:
+            return None
+        # the object was found on a different kind of model
+        if not issubclass(model, cls):
+            return None
+
+        result = model.objects.filter(id=pk).first()
+        # it was deleted, or its remote id changed
+        if not result or remote_id not in (
+            result.remote_id,
+            getattr(result, "origin_id", None),
+        ):
+            return None
+        return result
 
     @classmethod
     def find_existing(cls, data):
         """compare data to fields that can be used for deduplation.
         This always includes remote_id, but can also be unique identifiers
         like an isbn for an edition"""
+        filters = cls.get_deduplication_filters(data)
+        if not filters:
+            # if there are no deduplication fields, it will match the first
+            # item no matter what. this shouldn't happen but just in case.
+            return None
+
+        objects = cls.objects
+        if hasattr(objects, "select_subclasses"):
+            objects = objects.select_subclasses()
+
+        # an OR operation on all the match fields, sorry for the dense syntax
+        match = objects.filter(reduce(operator.or_, (Q(**f) for f in filters)))
+        # there OUGHT to be only one match
+        return match.first()
+
+    @classmethod
+    def get_deduplication_filters(cls, data):
+        """a queryset filter for each deduplication field that has a value"""
         filters = []
         # grabs all the data from the model to create django queryset filters
         for field in cls._meta.get_fields():
@@ -111,20 +200,7 @@ class ActivitypubMixin:
         if hasattr(cls, "origin_id") and "id" in data:
             # kinda janky, but this handles special case for books
             filters.append({"origin_id": data["id"]})
-
-        if not filters:
-            # if there are no deduplication fields, it will match the first
-            # item no matter what. this shouldn't happen but just in case.
-            return None
-
-        objects = cls.objects
-        if hasattr(objects, "select_subclasses"):
-            objects = objects.select_subclasses()
-
-        # an OR operation on all the match fields, sorry for the dense syntax
-        match = objects.filter(reduce(operator.or_, (Q(**f) for f in filters)))
-        # there OUGHT to be only one match
-        return match.first()
+        return filters
 
     def broadcast(self, activity, sender, software=None, queue=MEDIUM):
         """send out an activity"""
@@ -155,7 +231,10 @@ class ActivitypubMixin:
         recipients = [u.inbox for u in mentions or [] if not u.local]
 
         # unless it's a dm, all the followers should receive the activity
-        if privacy != "direct":
+        if privacy != "direct" and user and user.local:
+            # local users' followers are cached, deduplicated by shared inbox
+            recipients += delivery.get_delivery_set(user, software=software)
+        elif privacy != "direct":
             # we will send this out to a subset of all remote users
             queryset = (
                 user_model.viewer_aware_objects(user)
@@ -198,6 +277,17 @@ class ActivitypubMixin:
 class ObjectMixin(ActivitypubMixin):
     """add this mixin for object models that are AP serializable"""
 
+    def to_activity_json(self, pure=False):
+        """the encoded activity, serialized once for each version of the object"""
+        key = activity_json_id(self, pure)
+        activity_json = cache.get(key)
+        if activity_json is None:
+            activity_json = json.dumps(
+                self.to_activity(pure=pure), cls=activitypub.ActivityEncoder
+            ).encode("utf-8")
+            cache.set(key, activity_json, ACTIVITY_JSON_TIMEOUT)
+        return activity_json
+
     def save(self, *args, created=None, software=None, priority=MEDIUM, **kwargs):
         """broadcast created/updated/deleted objects as appropriate"""
         broadcast = kwargs.get("broadcast", True)
@@ -265,14 +355,12 @@ class ObjectMixin(ActivitypubMixin):
         signature = None
         create_id = self.remote_id + "/activity"
         if hasattr(activity_object, "content") and activity_object.content:
-            signer = pkcs1_15.new(RSA.import_key(user.key_pair.private_key))
-            content = activity_object.content
-            signed_message = signer.sign(SHA256.new(content.encode("utf8")))
-
             signature = activitypub.Signature(
                 creator=f"{user.remote_id}#main-key",
                 created=activity_object.published,
-                signatureValue=b64encode(signed_message).decode("utf8"),
+                signatureValue=sign_message(
+                    user.key_pair.private_key, activity_object.content
+                ),
             )
 
         return activitypub.Create(
@@ -506,59 +594,196 @@ def unfurl_related_field(related_field, sort_field=None):
     return related_field.remote_id
 
 
+class BroadcastClient:
+    """an event loop and http session that last as long as the worker process, so
+    connections to the same inboxes stay open from one broadcast to the next"""
+
+    def __init__(self):
+        self.pid = None
+        self.loop = None
+        self.session = None
+        # new and re-used connections by host, since the last time they were saved
+        self.connections = Counter()
+
+    def run(self, coroutine):
+        """run a coroutine on this process's event loop"""
+        if self.pid != os.getpid():
+            # a forked worker can't use its parent's event loop or sockets
+            self.pid = os.getpid()
+            self.loop = asyncio.new_event_loop()
+            self.session = None
+        try:
+            return self.loop.run_until_complete(coroutine)
+        finally:
+            self.save_connection_counts()
+
+    async def get_session(self):
+        """the shared session, with a connection pool for each host"""
+        if self.session is None or self.session.closed:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self.on_request_start)
+            trace_config.on_connection_create_end.append(self.on_connection_create)
+            trace_config.on_connection_reuseconn.append(self.on_connection_reuse)
+
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=BROADCAST_CONNECTIONS,
+                    limit_per_host=BROADCAST_CONNECTIONS_PER_HOST,
+                    keepalive_timeout=BROADCAST_KEEPALIVE,
+                ),
+                timeout=aiohttp.ClientTimeout(total=10),
+                trace_configs=[trace_config],
+            )
+        return self.session
+
+    # pylint: disable=unused-argument
+    @staticmethod
+    async def on_request_start(session, context, params):
+        """remember where the request is going"""
+        context.host = params.url.host
+
+    async def on_connection_create(self, session, context, params):
+        """a new connection (and tls handshake) was needed"""
+        self.connections[f"{context.host}-new"] += 1
+
+    async def on_connection_reuse(self, session, context, params):
+        """a connection was taken from the pool"""
+        self.connections[f"{context.host}-reused"] += 1
+
+    def save_connection_counts(self):
+        """add the counts to the totals in redis"""
+        metrics.increment_many("broadcast-connections", self.connections)
+        self.connections.clear()
+
+
+broadcast_client = BroadcastClient()
+
+
 @app.task(queue=MEDIUM)
-def broadcast_task(sender_id: int, activity: str, recipients: List[str]):
+def broadcast_task(
+    sender_id: int, activity: str, recipients: List[str], attempt: int = 0
+):
     """the celery task for broadcast"""
     user_model = apps.get_model("bookwyrm.User", require_ready=True)
     sender = user_model.objects.select_related("key_pair").get(id=sender_id)
-    asyncio.run(async_broadcast(recipients, sender, activity))
+    recipients = delivery.filter_available(sender_id, activity, recipients)
+    if not recipients:
+        return
+    results = broadcast_client.run(async_broadcast(recipients, sender, activity))
+    retry, unparked = delivery.record_results(recipients, results)
+
+    if retry and attempt + 1 < DELIVERY_MAX_ATTEMPTS:
+        broadcast_task.apply_async(
+            args=(sender_id, activity, retry, attempt + 1),
+            countdown=delivery.get_retry_delay(attempt),
+            queue=LOW,
+        )
+    # servers that came back get everything that was waiting for them
+    for (parked_sender_id, parked_activity, inbox) in unparked:
+        broadcast_task.apply_async(
+            args=(parked_sender_id, parked_activity, [inbox]),
+            queue=LOW,
+        )
 
 
 async def async_broadcast(recipients: List[str], sender, data: str):
     """Send all the broadcasts simultaneously"""
-    timeout = aiohttp.ClientTimeout(total=10)
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = []
-        for recipient in recipients:
-            tasks.append(
-                asyncio.ensure_future(sign_and_send(session, sender, data, recipient))
-            )
-
-        results = await asyncio.gather(*tasks)
-        return results
-
-
-async def sign_and_send(
-    session: aiohttp.ClientSession, sender, data: str, destination: str
-):
-    """Sign the messages and send them in an asynchronous bundle"""
-    now = http_date()
-
     if not sender.key_pair.private_key:
         # this shouldn't happen. it would be bad if it happened.
         raise ValueError("No private key found for sender")
 
+    now = http_date()
     digest = make_digest(data)
+    # the same key signs every copy, so sign them all together
+    signatures = make_signatures(sender, recipients, now, digest)
+
+    session = await broadcast_client.get_session()
+    tasks = []
+    for recipient in recipients:
+        headers = {
+            "Date": now,
+            "Digest": digest,
+            "Signature": signatures[recipient],
+            "Content-Type": "application/activity+json; charset=utf-8",
+            "User-Agent": USER_AGENT,
+        }
+        tasks.append(
+            asyncio.ensure_future(sign_and_send(session, data, recipient, headers))
+        )
+
+    results = await asyncio.gather(*tasks)
+    return results
 
-    headers = {
-        "Date": now,
-        "Digest": digest,
-        "Signature": make_signature(sender, destination, now, digest),
-        "Content-Type": "application/activity+json; charset=utf-8",
-        "User-Agent": USER_AGENT,
-    }
 
+async def sign_and_send(
+    session: aiohttp.ClientSession, data: str, destination: str, headers: dict
+):
+    """Send a signed message, as part of an asynchronous bundle"""
     try:
         async with session.post(destination, data=data, headers=headers) as response:
-            if not response.ok:
-                logger.exception(
-                    "Failed to send broadcast to %s: %s", destination, response.reason
-                )
-            return response
+            if response.ok:
+                return delivery.DELIVERED
+            logger.exception(
+                "Failed to send broadcast to %s: %s", destination, response.reason
+            )
+            # the server is having trouble, or asked us to slow down
+            if response.status >= 500 or response.status in [408, 429]:
+                return delivery.RETRY
+            return delivery.FAILED
     except asyncio.TimeoutError:
         logger.info("Connection timed out for url: %s", destination)
     except aiohttp.ClientError as err:
         logger.exception(err)
+    return delivery.RETRY
+
+
+def remote_id_key(remote_id):
+    """the cache key for the model and id a remote id was found on"""
+    return f"remote-id-{remote_id}"
+
+
+def activity_json_id(obj, pure=False):
+    """the cache key for one version of an object's activity"""
+    flavour = "pure" if pure else "bookwyrm"
+    version = obj.updated_date.timestamp() if obj.updated_date else None
+    label = obj._meta.label_lower  # pylint: disable=protected-access
+    return f"activity-json-{label}-{obj.id}-{version}-{flavour}"
+
+
+@receiver(signals.post_save)
+# pylint: disable=unused-argument
+def clear_activity_json(sender, instance, *args, **kwargs):
+    """updated_date isn't changed when it's left out of update_fields"""
+    if not isinstance(instance, ObjectMixin):
+        return
+    cache.delete_many([activity_json_id(instance, pure) for pure in [True, False]])
+
+
+@receiver(signals.m2m_changed)
+# pylint: disable=unused-argument,too-many-arguments
+def clear_activity_json_m2m(
+    sender, instance, action, reverse, model, pk_set, *args, **kwargs
+):
+    """changing a many to many field doesn't change the version either"""
+    if not action in ["post_add", "post_remove", "post_clear", "pre_clear"]:
+        return
+    if reverse and issubclass(model, ObjectMixin) and action != "post_clear":
+        # the field that changed belongs to the objects on the other side
+        if action == "pre_clear":
+            # they can't be found once they've been cleared
+            field = next(
+                f
+                for f in model._meta.many_to_many  # pylint: disable=protected-access
+                if f.remote_field.through is sender
+            )
+            related = model.objects.filter(**{field.name: instance})
+        else:
+            related = model.objects.filter(pk__in=pk_set)
+        keys = [activity_json_id(o, pure) for o in related for pure in [True, False]]
+        if keys:
+            cache.delete_many(keys)
+    if action != "pre_clear":
+        clear_activity_json(sender, instance)
 
 
 # pylint: disable=unused-argument
@@ -24,6 +24,7 @@ from bookwyrm.settings import (
 
 from .activitypub_mixin import OrderedCollectionPageMixin, ObjectMixin
 from .base_model import BookWyrmModel
+from .identifier import find_identifiers, remove_identifiers, update_identifiers
 from . import fields
 
 
@@ -97,6 +98,38 @@ class BookDataModel(ObjectMixin, BookWyrmModel):
         """only send book data updates to other bookwyrm instances"""
         super().broadcast(activity, sender, software=software, **kwargs)
 
+    @classmethod
+    def find_existing(cls, data):
+        """match deduplication fields using the identifier index"""
+        filters = cls.get_deduplication_filters(data)
+        # subclasses share the index, and can have identifiers of their own
+        for subclass in cls.__subclasses__():
+            filters += subclass.get_deduplication_filters(data)
+        matches = cls.find_by_identifiers([f.popitem() for f in filters])
+        # there OUGHT to be only one match
+        return min(matches.values(), key=lambda m: m.id, default=None)
+
+    @classmethod
+    def find_by_identifiers(cls, identifiers):
+        """the objects that (field, value) pairs like ("isbn_13", "978...")
+        belong to, for as many pairs as needed, in two queries"""
+        object_ids = find_identifiers(cls, identifiers)
+        if not object_ids:
+            return {}
+
+        objects = cls.objects
+        if hasattr(objects, "select_subclasses"):
+            objects = objects.select_subclasses()
+        found = objects.in_bulk(set().union(*object_ids.values()))
+
+        matches = {}
+        for (identifier, ids) in object_ids.items():
+            # ids from a different subclass aren't loaded
+            ids = [i for i in sorted(ids) if i in found]
+            if ids:
+                matches[identifier] = found[ids[0]]
+        return matches
+
 
 class Book(BookDataModel):
     """a generic book, which can mean either an edition or a work"""
@@ -313,6 +346,31 @@ class Edition(Book):
     )
     edition_rank = fields.IntegerField(default=0)
 
+    # the fields that local book searches match on or show
+    search_tracker = FieldTracker(
+        fields=[
+            "title",
+            "subtitle",
+            "series",
+            "cover",
+            "published_date",
+            "parent_work",
+            "edition_rank",
+            "remote_id",
+            "openlibrary_key",
+            "inventaire_id",
+            "librarything_key",
+            "goodreads_key",
+            "bnf_id",
+            "viaf",
+            "wikidata",
+            "asin",
+            "isbn_10",
+            "isbn_13",
+            "oclc_number",
+        ]
+    )
+
     activity_serializer = activitypub.Edition
     name_field = "title"
     serialize_reverse_fields = [("file_links", "fileLinks", "-created_date")]
@@ -445,3 +503,19 @@ def preview_image(instance, *args, **kwargs):
         transaction.on_commit(
             lambda: generate_edition_preview_image_task.delay(instance.id)
         )
+
+
+@receiver(models.signals.post_save)
+# pylint: disable=unused-argument
+def index_identifiers(sender, instance, *args, **kwargs):
+    """keep the identifier index up to date with book data"""
+    if isinstance(instance, BookDataModel):
+        update_identifiers(instance)
+
+
+@receiver(models.signals.post_delete)
+# pylint: disable=unused-argument
+def unindex_identifiers(sender, instance, *args, **kwargs):
+    """deleted book data can't be matched any more"""
+    if isinstance(instance, BookDataModel):
+        remove_identifiers(instance)
@@ -26,6 +26,11 @@ class Connector(BookWyrmModel):
     covers_url = models.CharField(max_length=255)
     search_url = models.CharField(max_length=255, null=True, blank=True)
     isbn_search_url = models.CharField(max_length=255, null=True, blank=True)
+    # how long search results are fresh for, in seconds. 0 turns off the cache
+    search_cache_timeout = models.IntegerField(default=60 * 60 * 24)
+    # requests per second, on average and in a burst. 0 turns off the limit
+    rate_limit = models.FloatField(default=5)
+    rate_limit_burst = models.IntegerField(default=10)
 
     def __str__(self):
         return f"{self.identifier} ({self.id})"
@@ -1,12 +1,22 @@
 """ connections to external ActivityPub servers """
+import logging
+import os
+import time
 from urllib.parse import urlparse
 
 from django.apps import apps
-from django.db import models
+from django.db import connection, models, transaction
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
+from model_utils import FieldTracker
+from redis.exceptions import RedisError
 
+from bookwyrm import delivery
+from bookwyrm.redis_store import r
 from .base_model import BookWyrmModel
 
+logger = logging.getLogger(__name__)
+
 FederationStatus = [
     ("federated", _("Federated")),
     ("blocked", _("Blocked")),
@@ -25,15 +35,19 @@ class FederatedServer(BookWyrmModel):
     application_version = models.CharField(max_length=255, null=True, blank=True)
     notes = models.TextField(null=True, blank=True)
 
+    field_tracker = FieldTracker(fields=["server_name", "status"])
+
     def block(self):
         """block a server"""
         self.status = "blocked"
         self.save(update_fields=["status"])
 
         # deactivate all associated users
-        self.user_set.filter(is_active=True).update(
-            is_active=False, deactivation_reason="domain_block"
-        )
+        users = self.user_set.filter(is_active=True)
+        user_ids = list(users.values_list("id", flat=True))
+        users.update(is_active=False, deactivation_reason="domain_block")
+        # and stop sending them activities
+        delivery.clear_followed_delivery_sets(user_ids)
 
         # check for related connectors
         if self.application_type == "bookwyrm":
@@ -47,9 +61,10 @@ class FederatedServer(BookWyrmModel):
         self.status = "federated"
         self.save(update_fields=["status"])
 
-        self.user_set.filter(deactivation_reason="domain_block").update(
-            is_active=True, deactivation_reason=None
-        )
+        users = self.user_set.filter(deactivation_reason="domain_block")
+        user_ids = list(users.values_list("id", flat=True))
+        users.update(is_active=True, deactivation_reason=None)
+        delivery.clear_followed_delivery_sets(user_ids)
 
         # check for related connectors
         if self.application_type == "bookwyrm":
@@ -62,7 +77,140 @@ class FederatedServer(BookWyrmModel):
 
     @classmethod
     def is_blocked(cls, url):
-        """look up if a domain is blocked"""
-        url = urlparse(url)
-        domain = url.netloc
-        return cls.objects.filter(server_name=domain, status="blocked").exists()
+        """look up if a domain, or a domain it's part of, is blocked"""
+        domains = get_domain_suffixes(urlparse(url).netloc)
+        blocked = blocked_domains.get()
+        if blocked is None:
+            return cls.objects.filter(
+                server_name__in=domains, status="blocked"
+            ).exists()
+        return not blocked.isdisjoint(domains)
+
+    @property
+    def delivery_health(self):
+        """how sending activities to this server has been going"""
+        return delivery.get_delivery_health(self.server_name)
+
+
+def get_domain_suffixes(domain):
+    """the domain and every domain it's a subdomain of"""
+    names = [domain]
+    host = domain.split(":")[0]
+    if host != domain:
+        names.append(host)
+    parts = host.split(".")
+    names += [".".join(parts[i:]) for i in range(1, len(parts))]
+    return names
+
+
+class BlockedDomains:
+    """every blocked server name, loaded once per process and reloaded when
+    any process hears that a server was blocked or unblocked"""
+
+    channel = "blocked-domains"
+    # seconds to wait before trying redis again
+    retry_delay = 60
+
+    def __init__(self):
+        self.pid = None
+        self.listener = None
+        self.retry_at = 0
+        self.domains = None
+        # counts changes, so a load that raced with one isn't kept
+        self.generation = 0
+
+    def get(self):
+        """the blocked domains, or None if they have to be checked in the database"""
+        if not self.subscribe():
+            return None
+        domains = self.domains
+        if domains is None:
+            if connection.in_atomic_block:
+                # what's loaded now might not be committed, or might be rolled back
+                return None
+            generation = self.generation
+            domains = set(
+                FederatedServer.objects.filter(status="blocked").values_list(
+                    "server_name", flat=True
+                )
+            )
+            if generation == self.generation:
+                self.domains = domains
+        return domains
+
+    def subscribe(self):
+        """listen for changes in a background thread"""
+        if self.pid != os.getpid():
+            # threads don't survive a fork
+            self.pid = os.getpid()
+            self.listener = None
+        if self.listener is not None and self.listener.is_alive():
+            return True
+        if time.time() < self.retry_at:
+            return False
+
+        # anything could have changed while nobody was listening
+        self.clear()
+        try:
+            pubsub = r.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self.handle_message})
+            self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except RedisError as err:
+            # there's no way to know about changes, so don't keep a copy
+            logger.warning("Unable to subscribe to blocked domain changes: %s", err)
+            self.listener = None
+            self.retry_at = time.time() + self.retry_delay
+            return False
+        return True
+
+    # pylint: disable=unused-argument
+    def handle_message(self, message):
+        """a server was blocked or unblocked somewhere"""
+        self.clear()
+
+    def clear(self):
+        """forget the blocked domains, including any being loaded right now"""
+        self.generation += 1
+        self.domains = None
+
+    def invalidate(self):
+        """reload here, and tell every process to reload once the change is
+        committed, so none of them load the blocked domains from before it"""
+        self.clear()
+        transaction.on_commit(self.publish)
+
+    def publish(self):
+        """tell every process, this one included, to reload"""
+        self.clear()
+        try:
+            r.publish(self.channel, "")
+        except RedisError as err:
+            logger.warning("Unable to publish blocked domain change: %s", err)
+
+
+blocked_domains = BlockedDomains()
+
+
+# pylint: disable=unused-argument
+@receiver(models.signals.post_save, sender=FederatedServer)
+def update_blocked_domains(sender, instance, created, *args, **kwargs):
+    """a server's status changed, or a blocked server was added or renamed"""
+    if created:
+        if instance.status == "blocked":
+            blocked_domains.invalidate()
+        return
+    if instance.field_tracker.previous("status") is None:
+        # the save that sets a new server's remote_id, which the created save covers
+        return
+    if instance.field_tracker.has_changed("status") or (
+        instance.status == "blocked"
+        and instance.field_tracker.has_changed("server_name")
+    ):
+        blocked_domains.invalidate()
+
+
+@receiver(models.signals.post_delete, sender=FederatedServer)
+def remove_blocked_domain(sender, instance, *args, **kwargs):
+    """a blocked server was deleted"""
+    if instance.status == "blocked":
+        blocked_domains.invalidate()
@@ -0,0 +1,106 @@
+""" an index of the external identifiers that book data can be matched on """
+from functools import reduce
+import operator
+
+from django.db import models
+from django.db.models import Q
+
+
+class Identifier(models.Model):
+    """one deduplication value, like an isbn or remote id, of a book or author"""
+
+    # books, works and editions share ids, so they're indexed together
+    model = models.CharField(max_length=255)
+    field = models.CharField(max_length=255)
+    value = models.CharField(max_length=255)
+    object_id = models.IntegerField()
+
+    class Meta:
+        """looked up by value, updated by object"""
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=["model", "object_id", "field", "value"],
+                name="unique_identifier",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["model", "value"]),
+            models.Index(fields=["model", "object_id"]),
+        ]
+
+
+# _meta is django's public api for model options
+# pylint: disable=protected-access
+def get_index_label(model):
+    """the model that owns the ids, which may be a parent of this model"""
+    parents = model._meta.get_parent_list()
+    return (parents[-1] if parents else model)._meta.label_lower
+
+
+def get_identifiers(instance):
+    """the deduplication values an object can be found by"""
+    identifiers = set()
+    for field in instance._meta.get_fields():
+        if not getattr(field, "deduplication_field", False):
+            continue
+        value = getattr(instance, field.name)
+        if value:
+            identifiers.add((field.name, str(value)))
+    if getattr(instance, "origin_id", None):
+        identifiers.add(("origin_id", instance.origin_id))
+    return identifiers
+
+
+def update_identifiers(instance):
+    """bring an object's entries in the index up to date"""
+    indexed = Identifier.objects.filter(
+        model=get_index_label(type(instance)), object_id=instance.id
+    )
+    identifiers = get_identifiers(instance)
+    current = set(indexed.values_list("field", "value"))
+
+    removed = current - identifiers
+    if removed:
+        indexed.filter(
+            reduce(operator.or_, (Q(field=f, value=v) for (f, v) in removed))
+        ).delete()
+
+    added = identifiers - current
+    Identifier.objects.bulk_create(
+        [
+            Identifier(
+                model=get_index_label(type(instance)),
+                field=field,
+                value=value,
+                object_id=instance.id,
+            )
+            for (field, value) in added
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def remove_identifiers(instance):
+    """take a deleted object out of the index"""
+    Identifier.objects.filter(
+        model=get_index_label(type(instance)), object_id=instance.id
+    ).delete()
+
+
+def find_identifiers(model, identifiers):
+    """the ids of the objects each (field, value) pair belongs to, in one query"""
+    identifiers = {(f, str(v)) for (f, v) in identifiers if v}
+    if not identifiers:
+        return {}
+
+    matches = Identifier.objects.filter(
+        model=get_index_label(model), value__in={v for (_, v) in identifiers}
+    ).values_list("field", "value", "object_id")
+
+    object_ids = {}
+    for (field, value, object_id) in matches:
+        # the same value may be indexed for a different field
+        if (field, value) in identifiers:
+            object_ids.setdefault((field, value), set()).add(object_id)
+    return object_ids
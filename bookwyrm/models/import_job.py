@@ -1,16 +1,22 @@
 """ track progress of goodreads imports """
+from itertools import chain, islice
+import logging
 import math
 import re
 import dateutil.parser
 
+from celery.exceptions import Retry
 from django.db import models
+from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
-from bookwyrm.connectors import connector_manager
+from bookwyrm.connectors import connector_manager, rate_limit, ConnectorException
+from bookwyrm.connectors import maybe_isbn, normalize_isbn
 from bookwyrm.models import (
     User,
     Book,
+    Connector,
     Edition,
     Work,
     ShelfBook,
@@ -22,6 +28,11 @@ from bookwyrm.models import (
 from bookwyrm.tasks import app, LOW
 from .fields import PrivacyLevels
 
+logger = logging.getLogger(__name__)
+
+# how many items are looked up and queued at a time
+IMPORT_CHUNK_SIZE = 500
+
 
 def unquote_string(text):
     """resolve csv quote weirdness"""
@@ -69,6 +80,12 @@ class ImportJob(models.Model):
         max_length=50, choices=ImportStatuses, default="pending", null=True
     )
 
+    # kept up to date as items are saved, so progress doesn't need counting
+    total_items = models.IntegerField(default=0)
+    completed_items = models.IntegerField(default=0)
+    successful_items = models.IntegerField(default=0)
+    failed_items = models.IntegerField(default=0)
+
     def start_job(self):
         """Report that the job has started"""
         task = start_import_task.delay(self.id)
@@ -81,7 +98,7 @@ class ImportJob(models.Model):
         """Report that the job has completed"""
         self.status = "complete"
         self.complete = True
-        self.pending_items.update(fail_reason=_("Import stopped"))
+        self.fail_pending_items()
         self.save(update_fields=["status", "complete"])
 
     def stop_job(self):
@@ -89,7 +106,7 @@ class ImportJob(models.Model):
         self.status = "stopped"
         self.complete = True
         self.save(update_fields=["status", "complete"])
-        self.pending_items.update(fail_reason=_("Import stopped"))
+        self.fail_pending_items()
 
         # stop starting
         app.control.revoke(self.task_id, terminate=True)
@@ -98,6 +115,28 @@ class ImportJob(models.Model):
         )
         app.control.revoke(list(tasks))
 
+    def recount_progress(self):
+        """count the progress counters from scratch, for when items were changed
+        without being saved"""
+        done = models.Q(book__isnull=False) | models.Q(fail_reason__isnull=False)
+        counts = self.items.aggregate(
+            total_items=models.Count("id"),
+            completed_items=models.Count("id", filter=done),
+            successful_items=models.Count("id", filter=models.Q(book__isnull=False)),
+            failed_items=models.Count("id", filter=models.Q(fail_reason__isnull=False)),
+        )
+        ImportJob.objects.filter(id=self.id).update(**counts)
+
+    def fail_pending_items(self):
+        """mark everything that hasn't been done yet as failed, all at once"""
+        count = self.pending_items.update(fail_reason=_("Import stopped"))
+        if count:
+            ImportJob.objects.filter(id=self.id).update(
+                completed_items=models.F("completed_items") + count,
+                failed_items=models.F("failed_items") + count,
+            )
+            self.refresh_from_db(fields=["completed_items", "failed_items"])
+
     @property
     def pending_items(self):
         """items that haven't been processed yet"""
@@ -106,30 +145,38 @@ class ImportJob(models.Model):
     @property
     def item_count(self):
         """How many books do you want to import???"""
-        return self.items.count()
+        return self.total_items
 
     @property
     def percent_complete(self):
         """How far along?"""
-        item_count = self.item_count
-        if not item_count:
+        if not self.total_items:
             return 0
-        return math.floor((item_count - self.pending_item_count) / item_count * 100)
+        return math.floor(self.completed_items / self.total_items * 100)
 
     @property
     def pending_item_count(self):
         """And how many pending items??"""
-        return self.pending_items.count()
+        return max(0, self.total_items - self.completed_items)
 
     @property
     def successful_item_count(self):
         """How many found a book?"""
-        return self.items.filter(book__isnull=False).count()
+        return self.successful_items
 
     @property
     def failed_item_count(self):
         """How many found a book?"""
-        return self.items.filter(fail_reason__isnull=False).count()
+        return self.failed_items
+
+    def get_progress(self):
+        """how the import is going, for checking on it as it runs"""
+        return {
+            "item_count": self.item_count,
+            "complete_count": self.completed_items,
+            "percent": self.percent_complete,
+            "complete": self.complete,
+        }
 
 
 class ImportItem(models.Model):
@@ -153,15 +200,56 @@ class ImportItem(models.Model):
     )
     task_id = models.CharField(max_length=200, null=True, blank=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # what the job's progress counters have this item down as, which is
+        # nothing until it's been saved or loaded
+        self.counted_progress = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.counted_progress = instance.get_progress_counters()
+        return instance
+
+    def save(self, *args, **kwargs):
+        """keep the job's progress counters up to date"""
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+
+        progress = self.get_progress_counters()
+        changes = {
+            field: int(value) - int(self.counted_progress.get(field, False))
+            for (field, value) in progress.items()
+            if value != self.counted_progress.get(field, False)
+        }
+        if adding:
+            changes["total_items"] = 1
+        self.counted_progress = progress
+        if not changes:
+            return
+        ImportJob.objects.filter(id=self.job_id).update(
+            updated_date=timezone.now(),
+            **{field: models.F(field) + change for (field, change) in changes.items()},
+        )
+
+    def get_progress_counters(self):
+        """which of the job's progress counters this item counts towards"""
+        return {
+            "completed_items": bool(self.book_id or self.fail_reason),
+            "successful_items": bool(self.book_id),
+            "failed_items": bool(self.fail_reason),
+        }
+
     def update_job(self):
         """let the job know when the items get work done"""
         job = self.job
         if job.complete:
             return
 
-        job.updated_date = timezone.now()
-        job.save()
-        if not job.pending_items.exists() and not job.complete:
+        # the counters are kept up to date when items are saved
+        job.refresh_from_db(fields=["total_items", "completed_items", "complete"])
+        if not job.pending_item_count and not job.complete:
             job.complete_job()
 
     def resolve(self):
@@ -330,31 +418,136 @@ class ImportItem(models.Model):
 
 @app.task(queue=LOW)
 def start_import_task(job_id):
-    """trigger the child tasks for each row"""
+    """trigger the child tasks for each chunk of rows"""
     job = ImportJob.objects.get(id=job_id)
     # don't start the job if it was stopped from the UI
     if job.complete:
         return
 
-    # these are sub-tasks so that one big task doesn't use up all the memory in celery
-    for item in job.items.all():
-        task = import_item_task.delay(item.id)
-        item.task_id = task.id
-        item.save()
+    # these are sub-tasks so that one big task doesn't use up all the memory in
+    # celery, and so that looking books up for one chunk doesn't hold up the rest
+    item_ids = job.items.values_list("id", flat=True).iterator(
+        chunk_size=IMPORT_CHUNK_SIZE
+    )
+    while True:
+        chunk = list(islice(item_ids, IMPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        import_chunk_task.delay(job.id, chunk)
     job.status = "active"
-    job.save()
+    # items may already have updated the progress counters
+    job.save(update_fields=["status"])
 
 
-@app.task(queue=LOW)
-def import_item_task(item_id):
-    """resolve a row into a book"""
+@app.task(queue=LOW, bind=True)
+def import_chunk_task(self, job_id, item_ids):
+    """look up the books for a chunk of rows, then trigger the child task for
+    each row"""
+    job = ImportJob.objects.get(id=job_id)
+    # make sure the job has not been stopped
+    if job.complete:
+        return
+
+    chunk = list(job.items.filter(id__in=item_ids))
+    # books that are already here don't need to be searched for
+    known_books = find_known_books(chunk)
+    # and the rest can be looked up remotely a batch at a time
+    try:
+        with rate_limit.retry_when_limited(self):
+            remote_books = find_remote_books(
+                i for i in chunk if i.id not in known_books
+            )
+    except Retry:
+        raise
+    except Exception as err:  # pylint: disable=broad-except
+        # the items can still be searched for one at a time
+        logger.exception("Unable to look up isbns for import %s: %s", job_id, err)
+        remote_books = {}
+    for item in chunk:
+        task = import_item_task.delay(
+            item.id,
+            book_id=known_books.get(item.id),
+            remote_book=remote_books.get(item.id),
+        )
+        item.task_id = task.id
+    ImportItem.objects.bulk_update(chunk, ["task_id"])
+
+
+def find_known_books(items):
+    """the ids of editions in the database that match items' isbns or openlibrary
+    keys, looked up all at once"""
+    identifiers = {}
+    for item in items:
+        if item.book_id:
+            continue
+        # same as resolve, an isbn is used instead of a key if there is one
+        if item.isbn:
+            isbn = normalize_isbn(item.isbn)
+            identifiers[item.id] = [("isbn_13", isbn), ("isbn_10", isbn)]
+        elif item.openlibrary_key:
+            identifiers[item.id] = [("openlibrary_key", item.openlibrary_key)]
+
+    found = Edition.find_by_identifiers(chain(*identifiers.values()))
+    known_books = {}
+    for (item_id, item_identifiers) in identifiers.items():
+        matches = [found[i].id for i in item_identifiers if i in found]
+        if matches:
+            known_books[item_id] = matches[0]
+    return known_books
+
+
+def find_remote_books(items):
+    """the connector id and remote id of search results for items' isbns, from
+    connectors that can look up lots of isbns at once"""
+    isbns = {
+        item.id: normalize_isbn(item.isbn)
+        for item in items
+        if not item.book_id and item.isbn and maybe_isbn(item.isbn)
+    }
+    if not isbns:
+        return {}
+
+    results = connector_manager.isbn_batch_search(list(isbns.values()))
+    return {
+        item_id: (results[isbn].connector.connector.id, results[isbn].key)
+        for (item_id, isbn) in isbns.items()
+        if isbn in results
+    }
+
+
+def get_remote_book(connector_id, remote_id):
+    """load a book that was found for an item, if it can be"""
+    connector_info = Connector.objects.filter(id=connector_id).first()
+    if not connector_info:
+        return None
+    connector = connector_manager.load_connector(connector_info)
+    try:
+        return connector.get_or_create_book(remote_id)
+    except ConnectorException:
+        # it can still be searched for
+        return None
+
+
+@app.task(queue=LOW, bind=True)
+def import_item_task(self, item_id, book_id=None, remote_book=None):
+    """resolve a row into a book, unless it was already found"""
     item = ImportItem.objects.get(id=item_id)
     # make sure the job has not been stopped
     if item.job.complete:
         return
 
+    if book_id and not item.book_id:
+        # if it's gone, it can be searched for after all
+        item.book = Edition.objects.filter(id=book_id).first()
+
     try:
-        item.resolve()
+        with rate_limit.retry_when_limited(self):
+            if remote_book and not item.book:
+                item.book = get_remote_book(*remote_book)
+            item.resolve()
+    except Retry:
+        # it'll be tried again once there are requests to spare
+        raise
     except Exception as err:  # pylint: disable=broad-except
         item.fail_reason = _("Error loading book")
         item.save()
@@ -459,3 +652,23 @@ def handle_imported_book(item):
         # only broadcast this review to other bookwyrm instances
         item.linked_review = review
     item.save()
+
+
+@receiver(models.signals.pre_delete, sender=Book)
+# pylint: disable=unused-argument
+def find_imported_book_jobs(sender, instance, *args, **kwargs):
+    """the jobs whose items will lose this book when it's deleted"""
+    instance.import_job_ids = list(
+        ImportItem.objects.filter(book=instance)
+        .values_list("job_id", flat=True)
+        .distinct()
+    )
+
+
+@receiver(models.signals.post_delete, sender=Book)
+# pylint: disable=unused-argument
+def recount_imported_book_jobs(sender, instance, *args, **kwargs):
+    """items lose their book in a queryset update, which doesn't go through
+    ImportItem.save, so the jobs' progress has to be counted again"""
+    for job in ImportJob.objects.filter(id__in=getattr(instance, "import_job_ids", [])):
+        job.recount_progress()
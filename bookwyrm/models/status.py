@@ -17,7 +17,7 @@ from model_utils.managers import InheritanceManager
 from bookwyrm import activitypub
 from bookwyrm.preview_images import generate_edition_preview_image_task
 from bookwyrm.settings import ENABLE_PREVIEW_IMAGES
-from .activitypub_mixin import ActivitypubMixin, ActivityMixin
+from .activitypub_mixin import ActivitypubMixin, ActivityMixin, FieldPlan
 from .activitypub_mixin import OrderedCollectionPageMixin
 from .base_model import BookWyrmModel
 from .readthrough import ProgressMode
@@ -437,16 +437,18 @@ class Boost(ActivityMixin, Status):
 
         super().save(*args, **kwargs)
 
-    def __init__(self, *args, **kwargs):
-        """the user field is "actor" here instead of "attributedTo" """
-        super().__init__(*args, **kwargs)
+    deserialize_reverse_fields = ()
 
+    @classmethod
+    def build_field_plan(cls):
+        """the user field is "actor" here instead of "attributedTo" """
         reserve_fields = ["user", "boosted_status", "published_date", "privacy"]
-        self.simple_fields = [f for f in self.simple_fields if f.name in reserve_fields]
-        self.activity_fields = self.simple_fields
-        self.many_to_many_fields = []
-        self.image_fields = []
-        self.deserialize_reverse_fields = []
+        simple_fields = tuple(
+            f
+            for f in super().build_field_plan().simple_fields
+            if f.name in reserve_fields
+        )
+        return FieldPlan((), (), simple_fields, simple_fields)
 
 
 # pylint: disable=unused-argument
@@ -176,6 +176,9 @@ class User(OrderedCollectionPageMixin, AbstractUser):
     name_field = "username"
     property_fields = [("following_link", "following")]
     field_tracker = FieldTracker(fields=["name", "avatar"])
+    # changes to where a remote user gets activities. is_active can't be tracked
+    # because it's a plain attribute on AbstractBaseUser
+    delivery_tracker = FieldTracker(fields=["inbox", "shared_inbox", "bookwyrm_user"])
 
     # two factor authentication
     two_factor_auth = models.BooleanField(default=None, blank=True, null=True)
@@ -21,12 +21,15 @@ class RedisStore(ABC):
         """the object and rank"""
         return {obj.id: self.get_rank(obj)}
 
-    def add_object_to_related_stores(self, obj, execute=True):
+    def add_object_to_related_stores(
+        self, obj, execute=True, stores=None, pipeline=None
+    ):
         """add an object to all suitable stores"""
         value = self.get_value(obj)
+        stores = self.get_stores_for_object(obj) if stores is None else stores
         # we want to do this as a bulk operation, hence "pipeline"
-        pipeline = r.pipeline()
-        for store in self.get_stores_for_object(obj):
+        pipeline = r.pipeline() if pipeline is None else pipeline
+        for store in stores:
             # add the status to the feed
             pipeline.zadd(store, value)
             # trim the store
@@ -70,6 +73,45 @@ class RedisStore(ABC):
         """load the values in a store"""
         return r.zrevrange(store, 0, -1, **kwargs)
 
+    def get_store_values(
+        self, store, cursor=None, newest_first=True, length=50
+    ):  # pylint: disable=no-self-use
+        """values and their ranks in rank order, highest first unless newest_first
+        is False, starting after a (rank, value) cursor. values with the same rank
+        are ordered by their bytes, so the cursor can't skip or repeat any"""
+        if cursor is not None and not isinstance(cursor[1], bytes):
+            cursor = (cursor[0], f"{cursor[1]}".encode())
+        start = 0
+        while True:
+            if newest_first:
+                values = r.zrevrangebyscore(
+                    store,
+                    "+inf" if cursor is None else cursor[0],
+                    "-inf",
+                    start=start,
+                    num=length,
+                    withscores=True,
+                )
+            else:
+                values = r.zrangebyscore(
+                    store,
+                    "-inf" if cursor is None else cursor[0],
+                    "+inf",
+                    start=start,
+                    num=length,
+                    withscores=True,
+                )
+            for (value, score) in values:
+                if (
+                    cursor is None
+                    or (newest_first and (score, value) < cursor)
+                    or (not newest_first and (score, value) > cursor)
+                ):
+                    yield (value, score)
+            if len(values) < length:
+                return
+            start += length
+
     def populate_store(self, store):
         """go from zero to a store"""
         pipeline = r.pipeline()
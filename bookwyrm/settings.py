@@ -21,7 +21,7 @@ RELEASE_API = env(
 PAGE_LENGTH = env("PAGE_LENGTH", 15)
 DEFAULT_LANGUAGE = env("DEFAULT_LANGUAGE", "English")
 
-JS_CACHE = "e678183c"
+JS_CACHE = "b4a1d7e9"
 
 # email
 EMAIL_BACKEND = env("EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
@@ -209,11 +209,37 @@ REDIS_ACTIVITY_DB_INDEX = env("REDIS_ACTIVITY_DB_INDEX", 0)
 
 MAX_STREAM_LENGTH = int(env("MAX_STREAM_LENGTH", 200))
 
+# collect new statuses in redis and add them to streams in batches
+COALESCE_STREAM_WRITES = env.bool("COALESCE_STREAM_WRITES", False)
+# how many pending statuses trigger a batch right away
+STREAM_BATCH_SIZE = env.int("STREAM_BATCH_SIZE", 100)
+# how long in seconds a status can wait for its batch to fill
+STREAM_BATCH_DELAY = env.int("STREAM_BATCH_DELAY", 5)
+
 STREAMS = [
     {"key": "home", "name": _("Home Timeline"), "shortname": _("Home")},
     {"key": "books", "name": _("Books Timeline"), "shortname": _("Books")},
 ]
 
+# Federation
+# connections kept open for sending activities, per celery worker process
+BROADCAST_CONNECTIONS = env.int("BROADCAST_CONNECTIONS", 100)
+# how many requests can be sent to the same host at once
+BROADCAST_CONNECTIONS_PER_HOST = env.int("BROADCAST_CONNECTIONS_PER_HOST", 10)
+# seconds to keep an idle connection open for the next broadcast
+BROADCAST_KEEPALIVE = env.int("BROADCAST_KEEPALIVE", 60)
+# failed deliveries are retried after 1, 4, 16... minutes
+DELIVERY_MAX_ATTEMPTS = env.int("DELIVERY_MAX_ATTEMPTS", 6)
+DELIVERY_RETRY_DELAY = env.int("DELIVERY_RETRY_DELAY", 60)
+# stop sending to a server after this many failures over this many seconds,
+# and check whether it's back every so often
+DELIVERY_FAILURE_THRESHOLD = env.int("DELIVERY_FAILURE_THRESHOLD", 10)
+DELIVERY_DEAD_AFTER = env.int("DELIVERY_DEAD_AFTER", 60 * 60 * 6)
+DELIVERY_PROBE_DELAY = env.int("DELIVERY_PROBE_DELAY", 60 * 60)
+# only do quick checks on incoming activities in the web process, and leave
+# blocklists and signatures for celery
+INBOX_DEFERRED_VERIFICATION = env.bool("INBOX_DEFERRED_VERIFICATION", False)
+
 # Search configuration
 # total time in seconds that the instance will spend searching connectors
 SEARCH_TIMEOUT = int(env("SEARCH_TIMEOUT", 8))
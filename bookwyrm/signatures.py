@@ -1,5 +1,6 @@
 """ signs activitypub activities """
 import hashlib
+from functools import lru_cache
 from urllib.parse import urlparse
 import datetime
 from base64 import b64encode, b64decode
@@ -10,6 +11,8 @@ from Crypto.Signature import pkcs1_15  # pylint: disable=no-name-in-module
 from Crypto.Hash import SHA256
 
 MAX_SIGNATURE_AGE = 300
+# parsed keys to keep, for the users who post the most
+SIGNER_CACHE_SIZE = 256
 
 
 def create_key_pair():
@@ -22,25 +25,51 @@ def create_key_pair():
     return private_key, public_key
 
 
+@lru_cache(maxsize=SIGNER_CACHE_SIZE)
+def get_signer(private_key):
+    """parsing a key is slow, so keep signers for recently used keys. the cache
+    is keyed by the key itself, so a new key never gets an old signer"""
+    return pkcs1_15.new(RSA.import_key(private_key))
+
+
+@lru_cache(maxsize=SIGNER_CACHE_SIZE)
+def get_verifier(public_key):
+    """the same, for the keys of servers that send us the most activities"""
+    return pkcs1_15.new(RSA.import_key(public_key))
+
+
+def sign_message(private_key, message):
+    """the base64 signature for a string"""
+    signed_message = get_signer(private_key).sign(SHA256.new(message.encode("utf8")))
+    return b64encode(signed_message).decode("utf8")
+
+
 def make_signature(sender, destination, date, digest):
     """uses a private key to sign an outgoing message"""
-    inbox_parts = urlparse(destination)
-    signature_headers = [
-        f"(request-target): post {inbox_parts.path}",
-        f"host: {inbox_parts.netloc}",
-        f"date: {date}",
-        f"digest: {digest}",
-    ]
-    message_to_sign = "\n".join(signature_headers)
-    signer = pkcs1_15.new(RSA.import_key(sender.key_pair.private_key))
-    signed_message = signer.sign(SHA256.new(message_to_sign.encode("utf8")))
-    signature = {
-        "keyId": f"{sender.remote_id}#main-key",
-        "algorithm": "rsa-sha256",
-        "headers": "(request-target) host date digest",
-        "signature": b64encode(signed_message).decode("utf8"),
-    }
-    return ",".join(f'{k}="{v}"' for (k, v) in signature.items())
+    return make_signatures(sender, [destination], date, digest)[destination]
+
+
+def make_signatures(sender, destinations, date, digest):
+    """sign the same message for each of its destinations"""
+    private_key = sender.key_pair.private_key
+    key_id = f"{sender.remote_id}#main-key"
+    signatures = {}
+    for destination in destinations:
+        inbox_parts = urlparse(destination)
+        signature_headers = [
+            f"(request-target): post {inbox_parts.path}",
+            f"host: {inbox_parts.netloc}",
+            f"date: {date}",
+            f"digest: {digest}",
+        ]
+        signature = {
+            "keyId": key_id,
+            "algorithm": "rsa-sha256",
+            "headers": "(request-target) host date digest",
+            "signature": sign_message(private_key, "\n".join(signature_headers)),
+        }
+        signatures[destination] = ",".join(f'{k}="{v}"' for (k, v) in signature.items())
+    return signatures
 
 
 def make_digest(data):
@@ -92,11 +121,10 @@ class Signature:
 
         return cls(key_id, headers, signature)
 
-    def verify(self, public_key, request):
-        """verify rsa signature"""
-        if http_date_age(request.headers["date"]) > MAX_SIGNATURE_AGE:
+    def verify(self, public_key, request, received=None):
+        """verify rsa signature, as of when the request was received"""
+        if http_date_age(request.headers["date"], received) > MAX_SIGNATURE_AGE:
             raise ValueError(f"Request too old: {request.headers['date']}")
-        public_key = RSA.import_key(public_key)
 
         comparison_string = []
         for signed_header_name in self.headers.split(" "):
@@ -110,16 +138,15 @@ class Signature:
                 )
         comparison_string = "\n".join(comparison_string)
 
-        signer = pkcs1_15.new(public_key)
         digest = SHA256.new()
         digest.update(comparison_string.encode())
 
         # raises a ValueError if it fails
-        signer.verify(digest, self.signature)
+        get_verifier(public_key).verify(digest, self.signature)
 
 
-def http_date_age(datestr):
+def http_date_age(datestr, now=None):
     """age of a signature in seconds"""
     parsed = datetime.datetime.strptime(datestr, "%a, %d %b %Y %H:%M:%S GMT")
-    delta = datetime.datetime.utcnow() - parsed
+    delta = (now or datetime.datetime.utcnow()) - parsed
     return delta.total_seconds()
@@ -74,6 +74,9 @@ let BookWyrm = new (class {
     initReccuringTasks() {
         // Polling
         document.querySelectorAll("[data-poll]").forEach((liveArea) => this.polling(liveArea));
+        document
+            .querySelectorAll("[data-import-progress]")
+            .forEach((box) => this.pollImportProgress(box));
     }
 
     /**
@@ -114,6 +117,60 @@ let BookWyrm = new (class {
         );
     }
 
+    /**
+     * Update an import's progress bar until the import is done.
+     *
+     * @param  {Object} box   - DOM node
+     * @param  {int}    delay - frequency for polling in ms
+     * @return {undefined}
+     */
+    pollImportProgress(box, delay) {
+        const bookwyrm = this;
+
+        delay = delay || 5000;
+        delay += Math.random() * 1000;
+
+        setTimeout(function () {
+            fetch("/api/updates/import/" + box.dataset.importProgress)
+                .then((response) => {
+                    if (!response.ok) {
+                        throw new Error(response.statusText);
+                    }
+
+                    return response.json();
+                })
+                .then((data) => {
+                    if (data.complete) {
+                        // show the results
+                        window.location.reload();
+                        return;
+                    }
+                    bookwyrm.updateImportProgress(box, data);
+                    bookwyrm.pollImportProgress(box, delay * 1.1);
+                })
+                // keep trying if a request fails, just less often
+                .catch(() => bookwyrm.pollImportProgress(box, delay * 1.5));
+        }, delay);
+    }
+
+    /**
+     * Update an import's progress bar.
+     *
+     * @param  {object} box  - DOM node
+     * @param  {object} data - json formatted response from a fetch
+     * @return {undefined}
+     */
+    updateImportProgress(box, data) {
+        const progress = box.querySelector("progress");
+
+        progress.value = data.complete_count;
+        progress.max = data.item_count;
+        progress.setAttribute("aria-valuenow", data.complete_count);
+        progress.setAttribute("aria-valuemax", data.item_count);
+        progress.innerText = data.percent + " %";
+        box.querySelector("[data-import-percent]").innerText = data.percent + "%";
+    }
+
     /**
      * Update a counter.
      *
@@ -3,6 +3,7 @@ from django import template
 
 from bookwyrm import models
 from bookwyrm.utils.cache import get_or_set
+from bookwyrm.utils.interactions import get_interactions
 
 
 register = template.Library()
@@ -11,6 +12,10 @@ register = template.Library()
 @register.filter(name="liked")
 def get_user_liked(user, status):
     """did the given user fav a status?"""
+    interactions = get_interactions(user)
+    if interactions and status.id in interactions.status_ids:
+        return status.id in interactions.liked
+
     return get_or_set(
         f"fav-{user.id}-{status.id}",
         lambda u, s: models.Favorite.objects.filter(user=u, status=s).exists(),
@@ -23,6 +28,10 @@ def get_user_liked(user, status):
 @register.filter(name="boosted")
 def get_user_boosted(user, status):
     """did the given user fav a status?"""
+    interactions = get_interactions(user)
+    if interactions and status.id in interactions.status_ids:
+        return status.id in interactions.boosted
+
     return get_or_set(
         f"boost-{user.id}-{status.id}",
         lambda u: status.boosters.filter(user=u).exists(),
@@ -41,6 +50,10 @@ def get_user_saved_lists(user, book_list):
 def get_relationship(context, user_object):
     """caches the relationship between the logged in user and another user"""
     user = context["request"].user
+    interactions = get_interactions(user)
+    if interactions and user_object.id in interactions.user_ids:
+        return interactions.relationships[user_object.id]
+
     return get_or_set(
         f"cached-relationship-{user.id}-{user_object.id}",
         get_relationship_name,
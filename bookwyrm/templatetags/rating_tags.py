@@ -4,6 +4,7 @@ from django.db.models import Avg
 
 from bookwyrm import models
 from bookwyrm.utils import cache
+from bookwyrm.utils.interactions import get_interactions
 
 
 register = template.Library()
@@ -27,6 +28,10 @@ def get_rating(book, user):
 @register.filter(name="user_rating")
 def get_user_rating(book, user):
     """get a user's rating of a book"""
+    interactions = get_interactions(user)
+    if interactions and book.id in interactions.book_ids:
+        return interactions.ratings.get(book.id, 0)
+
     rating = (
         models.Review.objects.filter(
             user=user,
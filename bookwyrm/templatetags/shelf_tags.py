@@ -4,6 +4,7 @@ from django.utils.translation import gettext_lazy as _
 
 from bookwyrm import models
 from bookwyrm.utils import cache
+from bookwyrm.utils.interactions import get_interactions
 
 
 register = template.Library()
@@ -57,6 +58,10 @@ def get_translated_shelf_name(shelf):
 def active_shelf(context, book):
     """check what shelf a user has a book on, if any"""
     user = context["request"].user
+    interactions = get_interactions(user)
+    if interactions and book.id in interactions.book_ids:
+        return interactions.shelves[book.id] or {"book": book}
+
     return cache.get_or_set(
         f"active_shelf-{user.id}-{book.id}",
         lambda u, b: (
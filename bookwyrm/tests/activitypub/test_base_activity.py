@@ -4,7 +4,7 @@ import json
 import pathlib
 from unittest.mock import patch
 
-from dataclasses import dataclass
+from dataclasses import dataclass, MISSING
 from django.test import TestCase
 from PIL import Image
 import responses
@@ -12,6 +12,9 @@ import responses
 from bookwyrm import activitypub
 from bookwyrm.activitypub.base_activity import (
     ActivityObject,
+    get_model_from_type,
+    model_types,
+    parse_plans,
     resolve_remote_id,
     set_related_field,
 )
@@ -82,6 +85,30 @@ class BaseActivity(TestCase):
         self.assertEqual(instance.id, "a")
         self.assertEqual(instance.type, "TestObject")
 
+    def test_get_parse_plan(self, *_):
+        """fields are looked over once for each class"""
+        parse_plans.pop(activitypub.Note, None)
+        plan = activitypub.Note.get_parse_plan()
+        self.assertIs(activitypub.Note.get_parse_plan(), plan)
+        self.assertIsNot(activitypub.Comment.get_parse_plan(), plan)
+
+        fields = {f.name: f for f in plan}
+        self.assertTrue(fields["id"].required)
+        self.assertFalse(fields["content"].required)
+        self.assertIsNone(fields["content"].activity_type)
+        # default factories aren't required, and still default to MISSING
+        self.assertFalse(fields["cc"].required)
+        self.assertEqual(fields["cc"].default, MISSING)
+
+        fields = {f.name: f for f in activitypub.Create.get_parse_plan()}
+        self.assertIs(fields["object"].activity_type, ActivityObject)
+        # not an activity, so it's left as a dict
+        self.assertIsNone(fields["signature"].activity_type)
+        self.assertFalse(fields["signature"].required)
+
+        fields = {f.name: f for f in activitypub.Person.get_parse_plan()}
+        self.assertIs(fields["icon"].activity_type, activitypub.Image)
+
     def test_serialize(self, *_):
         """simple function for converting dataclass to dict"""
         instance = ActivityObject(id="a", type="b")
@@ -90,6 +117,14 @@ class BaseActivity(TestCase):
         self.assertEqual(serialized["id"], "a")
         self.assertEqual(serialized["type"], "b")
 
+    def test_get_model_from_type(self, *_):
+        """the activity types are looked up once"""
+        self.assertEqual(get_model_from_type("Edition"), models.Edition)
+        self.assertEqual(get_model_from_type("Person"), models.User)
+        self.assertTrue(model_types)
+        with self.assertRaises(ActivitySerializerError):
+            get_model_from_type("Fish")
+
     @responses.activate
     def test_resolve_remote_id(self, *_):
         """look up or load remote data"""
@@ -1,7 +1,8 @@
 """ testing activitystreams """
 from datetime import datetime
 from unittest.mock import patch
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from bookwyrm import activitystreams, models
@@ -104,12 +105,133 @@ class Activitystreams(TestCase):
         with patch("bookwyrm.activitystreams.r.set"), patch(
             "bookwyrm.activitystreams.r.delete"
         ), patch("bookwyrm.activitystreams.ActivityStream.get_store") as redis_mock:
-            redis_mock.return_value = [status.id, status2.id]
+            redis_mock.return_value = [status2.id, status.id]
             result = self.test_stream.get_activity_stream(self.local_user)
-        self.assertEqual(result.count(), 2)
-        self.assertEqual(result.first(), status2)
-        self.assertEqual(result.last(), status)
-        self.assertIsInstance(result.first(), models.Comment)
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0], status2)
+        self.assertEqual(result[1], status)
+        self.assertIsInstance(result[0], models.Comment)
+
+    def test_get_statuses_cached(self, *_):
+        """hydrated statuses come from the cache when they can"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        status2 = models.Status.objects.create(user=self.remote_user, content="hi")
+        with patch("bookwyrm.activitystreams.cache") as cache_mock:
+            cache_mock.get_many.return_value = {f"hydrated-status-{status.id}": status}
+            result = self.test_stream.get_statuses([status2.id, status.id])
+        self.assertEqual(result, [status2, status])
+        cache_mock.get_many.assert_called_once_with(
+            [f"hydrated-status-{status2.id}", f"hydrated-status-{status.id}"]
+        )
+        # only the missing status is loaded and stored
+        self.assertEqual(
+            list(cache_mock.set_many.call_args[0][0].keys()),
+            [f"hydrated-status-{status2.id}"],
+        )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    def test_get_statuses_locmem_cache(self, *_):
+        """statuses are stored in a real cache, and their books loaded with them"""
+        cache.clear()
+        review = models.Review.objects.create(
+            user=self.local_user, book=self.book, content="hi", rating=5
+        )
+        review.mention_books.add(self.book)
+        self.test_stream.get_statuses([review.id])
+
+        # the books and mentioned books are all that's loaded
+        with self.assertNumQueries(2):
+            (result,) = self.test_stream.get_statuses([review.id])
+            self.assertEqual(result.book.title, "test book")
+            self.assertEqual(list(result.mention_books.all()), [self.book])
+            self.assertEqual(result.user, self.local_user)
+        self.assertIsInstance(result, models.Review)
+
+    @patch("bookwyrm.redis_store.r")
+    @patch("bookwyrm.activitystreams.r")
+    def test_get_activity_page(self, _, store_mock, *__):
+        """load one page of statuses"""
+        status = models.Status.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="direct",
+        )
+        status2 = models.Comment.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="direct",
+            book=self.book,
+        )
+        page = [(str(status2.id).encode(), 2.0), (str(status.id).encode(), 1.0)]
+        store_mock.zrevrangebyscore.side_effect = [page, [page[1], (b"1", 0.5)]]
+        store_mock.zrangebyscore.return_value = [page[0]]
+
+        result = self.test_stream.get_activity_page(self.local_user)
+        self.assertEqual(list(result), [status2, status])
+        self.assertIsInstance(result[0], models.Comment)
+        self.assertEqual(result.newest, (2.0, status2.id))
+        self.assertEqual(result.oldest, (1.0, status.id))
+        self.assertFalse(result.has_previous)
+        self.assertTrue(result.has_next)
+        self.assertEqual(store_mock.zrevrangebyscore.call_args_list[0][0][1], "+inf")
+        self.assertEqual(store_mock.zrevrangebyscore.call_args_list[1][0][1], 1.0)
+
+    @patch("bookwyrm.redis_store.r")
+    def test_get_store_values(self, redis_mock, *_):
+        """statuses with the same rank as the cursor are neither skipped nor repeated"""
+        redis_mock.zrevrangebyscore.return_value = [
+            (b"3", 2.0),
+            (b"2", 2.0),
+            (b"1", 2.0),
+            (b"4", 1.0),
+        ]
+        values = list(self.test_stream.get_store_values("store", (2.0, 2)))
+        self.assertEqual(values, [(b"1", 2.0), (b"4", 1.0)])
+        self.assertEqual(redis_mock.zrevrangebyscore.call_args[0][1:], (2.0, "-inf"))
+
+        redis_mock.zrangebyscore.return_value = [(b"1", 2.0), (b"2", 2.0), (b"3", 2.0)]
+        values = list(self.test_stream.get_store_values("store", (2.0, 2), False))
+        self.assertEqual(values, [(b"3", 2.0)])
+
+    @patch("bookwyrm.activitystreams.r")
+    def test_filter_by_feed_filter_type(self, redis_mock, *_):
+        """remove statuses by type using the stored types"""
+        status = models.Status.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="direct",
+        )
+        status2 = models.Comment.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="direct",
+            book=self.book,
+        )
+        values = [(str(status2.id).encode(), 2.0), (str(status.id).encode(), 1.0)]
+        redis_mock.mget.return_value = [b"comment", None]
+
+        result = activitystreams.filter_by_feed_filter_type(values, ["review"])
+        self.assertEqual(result, [values[1]])
+        # the missing type gets stored
+        redis_mock.pipeline.return_value.set.assert_called_once()
+
+        result = activitystreams.filter_by_feed_filter_type(
+            values, ["review", "comment", "quotation", "everything"]
+        )
+        self.assertEqual(result, values)
+
+    def test_get_feed_filter_type(self, *_):
+        """what filter hides a status"""
+        status = models.Status.objects.create(user=self.remote_user, content="hi")
+        self.assertIsNone(activitystreams.get_feed_filter_type(status))
+        review = models.Review.objects.create(
+            user=self.remote_user, content="hi", book=self.book
+        )
+        self.assertEqual(activitystreams.get_feed_filter_type(review), "review")
+        boost = models.Boost.objects.create(user=self.local_user, boosted_status=review)
+        self.assertEqual(activitystreams.get_feed_filter_type(boost), "review")
 
     def test_abstractstream_get_audience(self, *_):
         """get a list of users that should see a status"""
@@ -66,6 +66,60 @@ class ActivitystreamsSignals(TestCase):
         self.assertEqual(args["args"][0], status.id)
         self.assertEqual(args["queue"], "high_priority")
 
+    @patch("bookwyrm.activitystreams.settings.COALESCE_STREAM_WRITES", True)
+    @patch("bookwyrm.activitystreams.r")
+    def test_add_status_on_create_coalesce(self, redis_mock, *_):
+        """new statuses wait in a batch"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        redis_mock.pipeline.return_value.execute.return_value = [1, 1]
+        with patch(
+            "bookwyrm.activitystreams.add_status_task.apply_async"
+        ) as mock, patch(
+            "bookwyrm.activitystreams.add_status_batch_task.apply_async"
+        ) as batch_mock:
+            activitystreams.add_status_on_create_command(models.Status, status, True)
+        self.assertFalse(mock.called)
+        redis_mock.pipeline.return_value.hset.assert_called_once_with(
+            "pending-statuses-high_priority", status.id, 1
+        )
+        # the first status in a batch schedules the batch
+        self.assertEqual(batch_mock.call_count, 1)
+        kwargs = batch_mock.call_args[1]
+        self.assertEqual(kwargs["args"], ("high_priority",))
+        self.assertEqual(kwargs["countdown"], 5)
+
+        redis_mock.pipeline.return_value.execute.return_value = [1, 100]
+        with patch(
+            "bookwyrm.activitystreams.add_status_batch_task.apply_async"
+        ) as batch_mock:
+            activitystreams.add_status_on_create_command(models.Status, status, False)
+        # a full batch runs right away
+        self.assertEqual(batch_mock.call_count, 1)
+        self.assertFalse("countdown" in batch_mock.call_args[1])
+
+        redis_mock.pipeline.return_value.execute.return_value = [1, 101]
+        with patch(
+            "bookwyrm.activitystreams.add_status_batch_task.apply_async"
+        ) as batch_mock:
+            activitystreams.add_status_on_create_command(models.Status, status, False)
+        # but it's only queued once
+        self.assertFalse(batch_mock.called)
+
+    def test_clear_hydrated_status(self, *_):
+        """changed statuses are removed from the cache"""
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        with patch("bookwyrm.activitystreams.cache.delete") as mock:
+            status.save(broadcast=False)
+        mock.assert_called_with(f"hydrated-status-{status.id}")
+
+        with patch("bookwyrm.activitystreams.cache.delete") as mock:
+            status.mention_users.add(self.local_user)
+        mock.assert_called_with(f"hydrated-status-{status.id}")
+
     def test_add_status_on_create_created_low_priority(self, *_):
         """a new statuses has entered"""
         # created later than publication
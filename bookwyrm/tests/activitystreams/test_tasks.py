@@ -1,6 +1,7 @@
 """ testing activitystreams """
 from unittest.mock import patch
 from django.test import TestCase
+from redis.exceptions import RedisError, ResponseError
 from bookwyrm import activitystreams, models
 
 
@@ -90,6 +91,51 @@ class Activitystreams(TestCase):
         args = mock.call_args[0]
         self.assertEqual(args[0], self.status)
 
+    @patch("bookwyrm.activitystreams.r")
+    def test_add_status_batch_task(self, redis_mock):
+        """add all the pending statuses to all streams"""
+        redis_mock.hgetall.return_value = {str(self.status.id).encode(): b"1"}
+        with patch("bookwyrm.activitystreams.ActivityStream.add_status") as mock:
+            activitystreams.add_status_batch_task()
+        self.assertEqual(mock.call_count, 3)
+        args = mock.call_args[0]
+        self.assertEqual(args[0], self.status)
+        kwargs = mock.call_args[1]
+        self.assertTrue(kwargs["increment_unread"])
+        self.assertEqual(kwargs["pipeline"], redis_mock.pipeline.return_value)
+
+        # the batch is only deleted once it's been handled
+        processing_key = redis_mock.rename.call_args[0][1]
+        self.assertTrue(processing_key.startswith("pending-statuses-high_priority-"))
+        redis_mock.delete.assert_called_once_with(processing_key)
+
+    @patch("bookwyrm.activitystreams.r")
+    def test_add_status_batch_task_failed(self, redis_mock):
+        """statuses go back in line if the batch doesn't work"""
+        redis_mock.hgetall.return_value = {str(self.status.id).encode(): b"1"}
+        redis_mock.pipeline.return_value.execute.side_effect = [RedisError(), None]
+        with patch("bookwyrm.activitystreams.ActivityStream.add_status"), patch(
+            "bookwyrm.activitystreams.add_status_batch_task.apply_async"
+        ) as batch_mock:
+            with self.assertRaises(RedisError):
+                activitystreams.add_status_batch_task()
+
+        processing_key = redis_mock.rename.call_args[0][1]
+        redis_mock.pipeline.return_value.hset.assert_called_once_with(
+            "pending-statuses-high_priority", self.status.id, 1
+        )
+        redis_mock.pipeline.return_value.delete.assert_called_once_with(processing_key)
+        self.assertFalse(redis_mock.delete.called)
+        self.assertEqual(batch_mock.call_count, 1)
+
+    @patch("bookwyrm.activitystreams.r")
+    def test_add_status_batch_task_empty(self, redis_mock):
+        """nothing to do"""
+        redis_mock.rename.side_effect = ResponseError("no such key")
+        with patch("bookwyrm.activitystreams.ActivityStream.add_status") as mock:
+            activitystreams.add_status_batch_task()
+        self.assertFalse(mock.called)
+
     def test_remove_user_statuses_task(self):
         """remove all statuses by a user from another users' feeds"""
         with patch(
@@ -166,3 +166,27 @@ class AbstractConnector(TestCase):
 
         with self.assertRaises(ConnectorException):
             get_data("http://127.0.0.1/image/jpg")
+
+    @patch("bookwyrm.connectors.rate_limit.acquire_token")
+    def test_get_data_rate_limited(self, token_mock):
+        """don't make requests that had to wait too long"""
+        token_mock.return_value = False
+        with self.assertRaises(ConnectorException):
+            get_data("https://example.com/books/1")
+        token_mock.assert_called_once_with("https://example.com/books/1")
+
+    @responses.activate
+    @patch("bookwyrm.connectors.rate_limit.record_throttled")
+    @patch("bookwyrm.connectors.rate_limit.acquire_token")
+    def test_get_data_throttled(self, token_mock, throttled_mock):
+        """back off when the api says to"""
+        token_mock.return_value = True
+        responses.add(
+            responses.GET,
+            "https://example.com/books/1",
+            status=429,
+            headers={"Retry-After": "120"},
+        )
+        with self.assertRaises(ConnectorException):
+            get_data("https://example.com/books/1")
+        throttled_mock.assert_called_once_with("https://example.com/books/1", "120")
@@ -1,8 +1,15 @@
 """ interface between the app and various connectors """
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 import responses
 
-from bookwyrm import models
+from bookwyrm import models, settings
+from bookwyrm.book_search import SearchResult
 from bookwyrm.connectors import connector_manager
 from bookwyrm.connectors.bookwyrm_connector import Connector as BookWyrmConnector
 
@@ -55,6 +62,219 @@ class ConnectorManager(TestCase):
         results = connector_manager.search("")
         self.assertEqual(results, [])
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    @patch("bookwyrm.connectors.connector_manager.get_connector_health")
+    def test_search_cached(self, health_mock):
+        """remote results are kept and served again"""
+        health_mock.return_value = {}
+        cache.clear()
+        calls = []
+
+        def search_mock(query, items, *_):
+            calls.append(query)
+            return [
+                {
+                    "connector": connector,
+                    "results": [
+                        SearchResult(
+                            title="Remote",
+                            key="http://fake.ciom/book/1",
+                            connector=connector,
+                        )
+                    ],
+                }
+                for (_, connector) in items
+            ]
+
+        with patch(
+            "bookwyrm.connectors.connector_manager.connector_search", search_mock
+        ):
+            results = connector_manager.search("Example  Book")
+            cached_results = connector_manager.search("example book")
+
+        self.assertEqual(calls, ["example book"])
+        self.assertEqual(len(cached_results), 1)
+        self.assertEqual(
+            cached_results[0]["connector"].identifier, "test_connector_remote"
+        )
+        self.assertEqual(
+            cached_results[0]["results"][0].title, results[0]["results"][0].title
+        )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    @patch("bookwyrm.connectors.connector_manager.refresh_search_task.delay")
+    def test_search_stale(self, refresh_mock):
+        """stale results are served while they're refreshed"""
+        cache.clear()
+        connector = connector_manager.load_connector(self.remote_connector)
+        cache.set(
+            connector_manager.search_cache_id(connector, "example book", 0.1),
+            {"fetched": 0, "results": [{"title": "Old", "key": "http://fake.ciom/b"}]},
+        )
+        results = connector_manager.search("example book")
+        self.assertEqual(results[0]["results"][0].title, "Old")
+        refresh_mock.assert_called_once_with(
+            "test_connector_remote", "example book", 0.1
+        )
+
+        # only one refresh at a time
+        connector_manager.search("example book")
+        self.assertEqual(refresh_mock.call_count, 1)
+
+    def test_get_search_budget(self):
+        """wait for the typical connector, not the slowest"""
+        timeout = settings.SEARCH_TIMEOUT
+        self.assertEqual(connector_manager.get_search_budget([None]), timeout)
+        self.assertEqual(connector_manager.get_search_budget([0.1, 0.2]), 1)
+        self.assertEqual(connector_manager.get_search_budget([0.5, 1.5, 7]), 3)
+        self.assertEqual(connector_manager.get_search_budget([6, 7]), timeout)
+
+    @patch("bookwyrm.connectors.connector_manager.metrics")
+    @patch("bookwyrm.connectors.connector_manager.RECORD_HEALTH_SCRIPT")
+    @patch("bookwyrm.connectors.connector_manager.r")
+    def test_record_connector_health(self, redis_mock, script_mock, metrics_mock):
+        """each search is recorded in one step, and late ones aren't failures"""
+        connector_manager.record_connector_health(
+            [
+                ("fast.example", 2.0, "answered"),
+                ("down.example", 0.5, "failed"),
+                ("slow.example", None, "late"),
+            ]
+        )
+        calls = [c[1] for c in script_mock.call_args_list]
+        self.assertEqual(
+            [c["keys"] for c in calls],
+            [
+                ["fast.example-connector-health"],
+                ["down.example-connector-health"],
+                ["slow.example-connector-health"],
+            ],
+        )
+        self.assertEqual(calls[0]["args"][:2], [2.0, "answered"])
+        self.assertEqual(calls[1]["args"][:2], [0.5, "failed"])
+        self.assertEqual(calls[2]["args"][:2], ["", "late"])
+        self.assertEqual(calls[0]["client"], redis_mock.pipeline.return_value)
+        redis_mock.pipeline.return_value.execute.assert_called_once()
+        self.assertEqual(
+            metrics_mock.increment_many.call_args[0][1],
+            {"answered": 1, "failed": 1, "late": 1},
+        )
+
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    @patch("bookwyrm.connectors.connector_manager.record_connector_health")
+    def test_connector_search_late(self, health_mock):
+        """slow connectors aren't waited for, but their results are still cached"""
+        cache.clear()
+        self.remote_connector.search_cache_timeout = 0
+        self.remote_connector.save()
+        connector = connector_manager.load_connector(self.remote_connector)
+        response = {
+            "connector": connector,
+            "results": [
+                SearchResult(
+                    title="Slow", key="http://fake.ciom/book/1", connector=connector
+                )
+            ],
+        }
+        finished = threading.Event()
+
+        async def results_mock(_, url, *__):
+            if url == "http://fake.ciom/slow":
+                await asyncio.sleep(0.2)
+                finished.set()
+            return response, 0.1
+
+        with patch(
+            "bookwyrm.connectors.connector_manager.get_timed_results", results_mock
+        ), patch("bookwyrm.connectors.connector_manager.refresh_later") as refresh:
+            results = connector_manager.connector_search(
+                "example book",
+                [
+                    ("http://fake.ciom/fast", connector),
+                    ("http://fake.ciom/slow", connector),
+                ],
+                0.1,
+                budget=0.05,
+            )
+            self.assertEqual(results, [response, None])
+            self.assertTrue(finished.wait(2))
+            # the health is recorded once the straggler has been cached
+            for _ in range(20):
+                if health_mock.called:
+                    break
+                time.sleep(0.05)
+
+        self.assertFalse(refresh.called)
+        self.assertEqual(
+            [o for (_, _, o) in health_mock.call_args[0][0]], ["answered", "late"]
+        )
+        cached = cache.get(
+            connector_manager.search_cache_id(connector, "example book", 0.1)
+        )
+        self.assertEqual(cached["results"][0]["title"], "Slow")
+
+    @patch("bookwyrm.connectors.connector_manager.get_connector_health")
+    def test_search_skips_failing_connectors(self, health_mock):
+        """connectors that keep failing aren't searched"""
+        health_mock.return_value = {
+            "test_connector_remote": {"latency": 6.0, "skip": True}
+        }
+        with patch(
+            "bookwyrm.connectors.connector_manager.connector_search"
+        ) as search_mock:
+            results = connector_manager.search("example book")
+        self.assertEqual(results, [])
+        self.assertFalse(search_mock.called)
+
+    @patch("bookwyrm.connectors.connector_manager.get_connector_health")
+    def test_isbn_batch_search(self, health_mock):
+        """each connector that can look up isbns in bulk gets the ones that are left"""
+        health_mock.return_value = {}
+        models.Connector.objects.create(
+            identifier="openlibrary.org",
+            priority=2,
+            connector_file="openlibrary",
+            base_url="https://openlibrary.org",
+            books_url="https://openlibrary.org",
+            covers_url="https://covers.openlibrary.org",
+            search_url="https://openlibrary.org/search?q=",
+            isbn_search_url="https://openlibrary.org/isbn",
+        )
+        models.Connector.objects.create(
+            identifier="inventaire.io",
+            priority=3,
+            connector_file="inventaire",
+            base_url="https://inventaire.io",
+            books_url="https://inventaire.io",
+            covers_url="https://covers.inventaire.io",
+            search_url="https://inventaire.io/search?q=",
+            isbn_search_url="https://inventaire.io/isbn",
+        )
+        first = SearchResult(title="First", key="https://example.com/1", connector=1)
+        second = SearchResult(title="Second", key="https://example.com/2", connector=2)
+        with patch(
+            "bookwyrm.connectors.openlibrary.Connector.isbn_batch_search"
+        ) as openlibrary_mock, patch(
+            "bookwyrm.connectors.inventaire.Connector.isbn_batch_search"
+        ) as inventaire_mock:
+            openlibrary_mock.return_value = {"0000000001": first}
+            inventaire_mock.return_value = {"0000000002": second}
+            results = connector_manager.isbn_batch_search(
+                ["0000000001", "0000000002", "0000000003"]
+            )
+
+        self.assertEqual(results, {"0000000001": first, "0000000002": second})
+        openlibrary_mock.assert_called_once_with(
+            ["0000000001", "0000000002", "0000000003"]
+        )
+        inventaire_mock.assert_called_once_with(["0000000002", "0000000003"])
+
     def test_first_search_result(self):
         """only get one search result"""
         result = connector_manager.first_search_result("Example")
@@ -173,6 +173,25 @@ class Inventaire(TestCase):
             "https://covers.inventaire.io/img/entities/12345",
         )
 
+    def test_get_isbn_batch_url(self):
+        """several uris in one request"""
+        url = self.connector.get_isbn_batch_url(["9782290349229", "2290349224"])
+        self.assertEqual(url, "https://inventaire.io/isbn9782290349229|isbn:2290349224")
+
+    def test_parse_isbn_batch_data(self):
+        """results for each isbn, as it was asked for"""
+        search_file = pathlib.Path(__file__).parent.joinpath(
+            "../data/inventaire_isbn_search.json"
+        )
+        search_results = json.loads(search_file.read_bytes())
+        search_results["redirects"] = {"isbn:2290349224": "isbn:9782290349229"}
+
+        result = list(self.connector.parse_isbn_batch_data(search_results))
+        self.assertEqual(len(result), 1)
+        isbn, result = result[0]
+        self.assertEqual(isbn, "2290349224")
+        self.assertEqual(result.title, "L'homme aux cercles bleus")
+
     def test_parse_isbn_search_data_empty(self):
         """another search type"""
         search_results = {}
@@ -149,6 +149,48 @@ class Openlibrary(TestCase):
         self.assertEqual(result.year, "2002")
         self.assertEqual(result.connector, self.connector)
 
+    def test_get_isbn_batch_url(self):
+        """several bibkeys in one request"""
+        url = self.connector.get_isbn_batch_url(["9782070427796", "0060273224"])
+        self.assertEqual(
+            url, "https://openlibrary.org/isbn9782070427796,ISBN:0060273224"
+        )
+
+    def test_parse_isbn_batch_data(self):
+        """results for each isbn"""
+        datafile = pathlib.Path(__file__).parent.joinpath("../data/ol_isbn_search.json")
+        search_data = json.loads(datafile.read_bytes())
+        result = list(self.connector.parse_isbn_batch_data(search_data))
+        self.assertEqual(len(result), 1)
+
+        isbn, result = result[0]
+        self.assertEqual(isbn, "9782070427796")
+        self.assertEqual(result.title, "Les ombres errantes")
+        self.assertEqual(result.key, "https://openlibrary.org/books/OL16262504M")
+
+    def test_isbn_batch_search(self):
+        """isbns are looked up a batch at a time"""
+        datafile = pathlib.Path(__file__).parent.joinpath("../data/ol_isbn_search.json")
+        search_data = json.loads(datafile.read_bytes())
+        self.connector.isbn_batch_size = 2
+        with patch("bookwyrm.connectors.abstract_connector.get_data") as get_data:
+            get_data.side_effect = [search_data, ConnectorException()]
+            result = self.connector.isbn_batch_search(
+                ["9782070427796", "0060273224", " 060273224", "9780062445315"]
+            )
+
+        self.assertEqual(get_data.call_count, 2)
+        self.assertEqual(
+            get_data.call_args_list[0][0][0],
+            "https://openlibrary.org/isbn9782070427796,ISBN:0060273224",
+        )
+        self.assertEqual(
+            get_data.call_args_list[1][0][0],
+            "https://openlibrary.org/isbn9780062445315",
+        )
+        self.assertEqual(list(result.keys()), ["9782070427796"])
+        self.assertEqual(result["9782070427796"].title, "Les ombres errantes")
+
     @responses.activate
     def test_load_edition_data(self):
         """format url from key and make request"""
@@ -0,0 +1,109 @@
+""" keeping requests to connectors within their limits """
+from unittest.mock import call, MagicMock, patch
+
+from django.test import TestCase
+
+from bookwyrm import models
+from bookwyrm.connectors import rate_limit
+
+
+@patch("bookwyrm.connectors.rate_limit.metrics")
+class RateLimit(TestCase):
+    """token buckets for each connector"""
+
+    def setUp(self):
+        """a connector with a rate limit"""
+        self.connector = models.Connector.objects.create(
+            identifier="example.com",
+            connector_file="openlibrary",
+            base_url="https://example.com",
+            books_url="https://example.com/books",
+            covers_url="https://covers.example.com",
+            search_url="https://example.com/search?q=",
+            rate_limit=5,
+            rate_limit_burst=10,
+        )
+
+    def test_get_rate_limit(self, _):
+        """find the connector from any of its urls"""
+        self.assertEqual(
+            rate_limit.get_rate_limit("https://example.com/books/1"),
+            ("example.com", 5, 10),
+        )
+        self.assertEqual(
+            rate_limit.get_rate_limit("https://covers.example.com/1.jpg"),
+            ("example.com", 5, 10),
+        )
+        self.assertIsNone(rate_limit.get_rate_limit("https://other.example.com/"))
+
+    @patch("bookwyrm.connectors.rate_limit.take_token")
+    def test_acquire_token_unlimited(self, take_mock, _):
+        """a rate limit of 0 is no limit"""
+        self.connector.rate_limit = 0
+        self.connector.save()
+        result = rate_limit.acquire_token("https://example.com/books/1")
+        self.assertTrue(result)
+        self.assertFalse(take_mock.called)
+
+    @patch("bookwyrm.connectors.rate_limit.take_token")
+    def test_acquire_token_interactive(self, take_mock, _):
+        """searches don't wait, and can use the whole bucket"""
+        take_mock.return_value = 0.5
+        result = rate_limit.acquire_token(
+            "https://example.com/books/1", interactive=True
+        )
+        self.assertTrue(result)
+        take_mock.assert_called_once_with("example.com", 5, 10, 0)
+
+    @patch("bookwyrm.connectors.rate_limit.take_token")
+    def test_acquire_token_background(self, take_mock, metrics_mock):
+        """background tasks leave some for searches, and try again later"""
+        take_mock.return_value = 0.5
+        with self.assertRaises(rate_limit.RateLimited) as context:
+            rate_limit.acquire_token("https://example.com/books/1", interactive=False)
+        self.assertEqual(context.exception.wait, 0.5)
+        self.assertEqual(context.exception.refill_time, 2)
+        take_mock.assert_called_once_with("example.com", 5, 10, 2)
+        metrics_mock.increment_many.assert_called_once_with(
+            "rate-limit", {"example.com-retries": 1, "example.com-retry-ms": 500}
+        )
+
+    @patch("bookwyrm.connectors.rate_limit.take_token")
+    def test_acquire_token_too_long(self, take_mock, _):
+        """give up rather than wait forever"""
+        take_mock.return_value = rate_limit.MAX_WAIT + 1
+        result = rate_limit.acquire_token(
+            "https://example.com/books/1", interactive=False
+        )
+        self.assertFalse(result)
+
+    @patch("bookwyrm.connectors.rate_limit.take_token")
+    def test_retry_when_limited(self, take_mock, _):
+        """tasks are retried later instead of waiting"""
+        take_mock.return_value = 0.5
+        task = MagicMock()
+        task.retry.return_value = Exception("retry")
+        with self.assertRaises(Exception) as context:
+            with rate_limit.retry_when_limited(task):
+                rate_limit.acquire_token("https://example.com/books/1")
+        self.assertEqual(str(context.exception), "retry")
+        self.assertFalse(rate_limit.retrying.active)
+
+        kwargs = task.retry.call_args[1]
+        self.assertIsInstance(kwargs["exc"], rate_limit.RateLimited)
+        self.assertEqual(kwargs["max_retries"], rate_limit.MAX_RETRIES)
+        self.assertTrue(0.5 <= kwargs["countdown"] <= 2.5)
+
+        # outside of a task, requests go ahead
+        self.assertTrue(rate_limit.acquire_token("https://example.com/books/1"))
+
+    @patch("bookwyrm.connectors.rate_limit.r")
+    def test_record_throttled(self, redis_mock, metrics_mock):
+        """empty the bucket for as long as the api says"""
+        rate_limit.record_throttled("https://example.com/books/1", "60")
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.hset.assert_any_call("example.com-rate-limit", "tokens", -300)
+        self.assertEqual(
+            metrics_mock.increment_many.call_args_list,
+            [call("rate-limit", {"example.com-429": 1})],
+        )
@@ -1,7 +1,8 @@
 """ testing import """
 from collections import namedtuple
+from io import StringIO
 import pathlib
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 import datetime
 import pytz
 
@@ -9,8 +10,11 @@ from django.test import TestCase
 import responses
 
 from bookwyrm import models
+from bookwyrm.book_search import SearchResult
+from bookwyrm.connectors import rate_limit
 from bookwyrm.importers import Importer
-from bookwyrm.models.import_job import start_import_task, import_item_task
+from bookwyrm.models.import_job import start_import_task, import_chunk_task
+from bookwyrm.models.import_job import import_item_task
 from bookwyrm.models.import_job import handle_imported_book
 
 
@@ -19,7 +23,7 @@ def make_date(*args):
     return datetime.datetime(*args, tzinfo=pytz.UTC)
 
 
-# pylint: disable=consider-using-with
+# pylint: disable=consider-using-with, too-many-public-methods
 @patch("bookwyrm.suggested_users.rerank_suggestions_task.delay")
 @patch("bookwyrm.activitystreams.populate_stream_task.delay")
 @patch("bookwyrm.activitystreams.add_book_statuses_task.delay")
@@ -78,6 +82,24 @@ class GenericImporter(TestCase):
         self.assertEqual(import_items[3].normalized_data["id"], "10")
         self.assertEqual(import_items[3].normalized_data["title"], "Patisserie at Home")
 
+    def test_create_job_chunks(self, *_):
+        """rows are saved a few at a time"""
+        self.importer.chunk_size = 3
+        with patch("bookwyrm.models.ImportItem.objects.bulk_create") as bulk_create:
+            self.importer.create_job(self.local_user, self.csv, False, "public")
+        self.assertEqual(
+            [len(c[0][0]) for c in bulk_create.call_args_list],
+            [3, 1],
+        )
+
+    def test_create_job_empty(self, *_):
+        """a file with headers and no rows can't be imported"""
+        with self.assertRaises(ValueError):
+            self.importer.create_job(
+                self.local_user, StringIO("id,title\n"), False, "public"
+            )
+        self.assertFalse(models.ImportJob.objects.exists())
+
     def test_create_retry_job(self, *_):
         """trying again with items that didn't import"""
         import_job = self.importer.create_job(
@@ -120,12 +142,123 @@ class GenericImporter(TestCase):
             self.local_user, self.csv, False, "unlisted"
         )
 
+        with patch("bookwyrm.models.import_job.import_chunk_task.delay") as mock:
+            start_import_task(import_job.id)
+        item_ids = list(import_job.items.values_list("id", flat=True))
+        mock.assert_called_once_with(import_job.id, item_ids)
+
         MockTask = namedtuple("Task", ("id"))
         with patch("bookwyrm.models.import_job.import_item_task.delay") as mock:
             mock.return_value = MockTask(123)
-            start_import_task(import_job.id)
+            import_chunk_task.run(import_job.id, item_ids)
+
+        self.assertEqual(mock.call_count, 4)
+
+    def test_import_chunk_task_known_books(self, *_):
+        """books that are already in the database aren't searched for"""
+        self.book.isbn_13 = "9781250313195"
+        self.book.save()
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+        item = import_job.items.get(index=0)
+
+        MockTask = namedtuple("Task", ("id"))
+        with patch("bookwyrm.models.import_job.import_item_task.delay") as mock:
+            mock.return_value = MockTask(123)
+            import_chunk_task.run(import_job.id, [i.id for i in import_job.items.all()])
 
         self.assertEqual(mock.call_count, 4)
+        self.assertIn(
+            ((item.id,), {"book_id": self.book.id, "remote_book": None}),
+            mock.call_args_list,
+        )
+        self.assertEqual([c[1]["book_id"] for c in mock.call_args_list].count(None), 3)
+        item.refresh_from_db()
+        self.assertEqual(item.task_id, "123")
+
+    def test_import_chunk_task_remote_books(self, *_):
+        """isbns are looked up remotely all at once"""
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+        item = import_job.items.get(index=0)
+        connector = Mock()
+        connector.connector.id = 7
+        result = SearchResult(
+            title="Test", key="https://example.com/book/2", connector=connector
+        )
+
+        MockTask = namedtuple("Task", ("id"))
+        with patch(
+            "bookwyrm.connectors.connector_manager.isbn_batch_search"
+        ) as search, patch("bookwyrm.models.import_job.import_item_task.delay") as mock:
+            search.return_value = {"9781250313195": result}
+            mock.return_value = MockTask(123)
+            import_chunk_task.run(import_job.id, [i.id for i in import_job.items.all()])
+
+        self.assertEqual(search.call_count, 1)
+        self.assertIn("9781250313195", search.call_args[0][0])
+        self.assertIn(
+            (
+                (item.id,),
+                {"book_id": None, "remote_book": (7, "https://example.com/book/2")},
+            ),
+            mock.call_args_list,
+        )
+
+    def test_import_chunk_task_remote_books_error(self, *_):
+        """items are still queued when the isbns can't be looked up"""
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+
+        MockTask = namedtuple("Task", ("id"))
+        with patch(
+            "bookwyrm.connectors.connector_manager.isbn_batch_search"
+        ) as search, patch("bookwyrm.models.import_job.import_item_task.delay") as mock:
+            search.side_effect = rate_limit.RateLimited("example.com", 400, 10)
+            mock.return_value = MockTask(123)
+            import_chunk_task.run(import_job.id, [i.id for i in import_job.items.all()])
+
+        self.assertEqual(mock.call_count, 4)
+        self.assertEqual([c[1]["remote_book"] for c in mock.call_args_list], [None] * 4)
+
+    def test_import_item_task_known_book(self, *_):
+        """a book that was found ahead of time"""
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+        import_item = models.ImportItem.objects.get(job=import_job, index=0)
+        with patch(
+            "bookwyrm.models.import_job.ImportItem.get_book_from_identifier"
+        ) as resolve, patch(
+            "bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"
+        ):
+            import_item_task.run(import_item.id, book_id=self.book.id)
+        self.assertFalse(resolve.called)
+        import_item.refresh_from_db()
+        self.assertEqual(import_item.book_id, self.book.id)
+
+    def test_import_item_task_remote_book(self, *_):
+        """a book that was found remotely ahead of time"""
+        import_job = self.importer.create_job(
+            self.local_user, self.csv, False, "unlisted"
+        )
+        import_item = models.ImportItem.objects.get(job=import_job, index=0)
+        with patch(
+            "bookwyrm.models.import_job.ImportItem.get_book_from_identifier"
+        ) as resolve, patch(
+            "bookwyrm.models.import_job.get_remote_book"
+        ) as get_remote_book, patch(
+            "bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"
+        ):
+            get_remote_book.return_value = self.book
+            import_item_task.run(import_item.id, remote_book=(7, "https://example.com"))
+        self.assertFalse(resolve.called)
+        get_remote_book.assert_called_once_with(7, "https://example.com")
+        import_item.refresh_from_db()
+        self.assertEqual(import_item.book_id, self.book.id)
 
     @responses.activate
     def test_import_item_task(self, *_):
@@ -143,7 +276,7 @@ class GenericImporter(TestCase):
             with patch(
                 "bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"
             ) as mock:
-                import_item_task(import_item.id)
+                import_item_task.run(import_item.id)
                 kwargs = mock.call_args.kwargs
         self.assertEqual(kwargs["queue"], "low_priority")
         import_item.refresh_from_db()
@@ -1,17 +1,22 @@
 """ testing model activitypub utilities """
+import json
 from unittest.mock import patch
 from collections import namedtuple
 from dataclasses import dataclass
 import re
 from django import db
 from django.test import TestCase
+from redis.exceptions import RedisError
 
 from bookwyrm.activitypub.base_activity import ActivityObject
 from bookwyrm import models
 from bookwyrm.models import base_model
 from bookwyrm.models.activitypub_mixin import (
+    ACTIVITY_JSON_TIMEOUT,
+    activity_json_id,
     ActivitypubMixin,
     ActivityMixin,
+    BroadcastClient,
     broadcast_task,
     ObjectMixin,
     OrderedCollectionMixin,
@@ -21,6 +26,8 @@ from bookwyrm.settings import PAGE_LENGTH
 
 
 # pylint: disable=invalid-name,too-many-public-methods
+# recipients come from the database, see test_delivery for the cache
+@patch("bookwyrm.delivery.get_cached_delivery_set", side_effect=RedisError)
 @patch("bookwyrm.activitystreams.add_status_task.delay")
 @patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
 class ActivitypubMixins(TestCase):
@@ -109,6 +116,34 @@ class ActivitypubMixins(TestCase):
         # test subclass match
         result = models.Status.find_existing_by_remote_id("https://comment.net")
 
+    def test_find_existing_by_remote_id_cached(self, *_):
+        """skip the deduplication query for remote ids that were found before"""
+        book = models.Edition.objects.create(
+            title="Test Edition", remote_id="http://book.com/book"
+        )
+        with patch("bookwyrm.models.activitypub_mixin.cache") as cache_mock:
+            cache_mock.get.return_value = None
+            result = models.Book.find_existing_by_remote_id("http://book.com/book")
+            self.assertEqual(result, book)
+            cache_mock.set.assert_called_once_with(
+                "remote-id-http://book.com/book", ("bookwyrm.Edition", book.id), 86400
+            )
+
+            cache_mock.get.return_value = ("bookwyrm.Edition", book.id)
+            with self.assertNumQueries(1):
+                result = models.Book.find_existing_by_remote_id("http://book.com/book")
+            self.assertEqual(result, book)
+            self.assertIsInstance(result, models.Edition)
+
+            # the wrong kind of model
+            result = models.User.find_existing_by_remote_id("http://book.com/book")
+            self.assertIsNone(result)
+
+            # a stale entry
+            cache_mock.get.return_value = ("bookwyrm.Edition", book.id + 1)
+            result = models.Edition.find_existing_by_remote_id("http://book.com/book")
+            self.assertEqual(result, book)
+
     def test_find_existing(self, *_):
         """match a blob of data to a model"""
         book = models.Edition.objects.create(
@@ -423,13 +458,147 @@ class ActivitypubMixins(TestCase):
         self.assertEqual(page_2.orderedItems[0]["content"], "test status 14")
         self.assertEqual(page_2.orderedItems[-1]["content"], "test status 0")
 
+    def test_get_field_plan(self, *_):
+        """fields are sorted once for each model class"""
+        plan = models.Status.get_field_plan()
+        self.assertIs(models.Status.get_field_plan(), plan)
+        self.assertIs(models.Status().simple_fields, plan.simple_fields)
+        self.assertNotEqual(models.Comment.get_field_plan(), plan)
+        self.assertTrue(
+            any(f.name == "mention_users" for f in plan.many_to_many_fields)
+        )
+
+        user_plan = models.User.get_field_plan()
+        # includes the following property
+        self.assertEqual(
+            len(user_plan.activity_fields),
+            len(user_plan.image_fields)
+            + len(user_plan.many_to_many_fields)
+            + len(user_plan.simple_fields)
+            + 1,
+        )
+
+    def test_get_field_plan_boost(self, *_):
+        """boosts only serialize a few fields"""
+        plan = models.Boost.get_field_plan()
+        self.assertEqual(
+            {f.name for f in plan.simple_fields},
+            {"user", "boosted_status", "published_date", "privacy"},
+        )
+        self.assertEqual(plan.activity_fields, plan.simple_fields)
+        self.assertEqual(plan.many_to_many_fields, ())
+        self.assertEqual(models.Boost.deserialize_reverse_fields, ())
+
+    def test_to_activity_json(self, *_):
+        """serialized once for each version"""
+        status = models.Status.objects.create(
+            content="test status", user=self.local_user
+        )
+        key = f"activity-json-bookwyrm.status-{status.id}-"
+        key += f"{status.updated_date.timestamp()}-pure"
+        self.assertEqual(activity_json_id(status, pure=True), key)
+
+        with patch("bookwyrm.models.activitypub_mixin.cache") as cache_mock:
+            cache_mock.get.return_value = None
+            result = status.to_activity_json(pure=True)
+            self.assertEqual(json.loads(result)["id"], status.remote_id)
+            cache_mock.set.assert_called_once_with(key, result, ACTIVITY_JSON_TIMEOUT)
+
+            cache_mock.get.return_value = b"cached"
+            with patch.object(models.Status, "to_activity") as to_activity:
+                self.assertEqual(status.to_activity_json(pure=True), b"cached")
+            self.assertFalse(to_activity.called)
+
+            status.save(broadcast=False, update_fields=["content"])
+            cache_mock.delete_many.assert_called_with(
+                [key, key.replace("-pure", "-bookwyrm")]
+            )
+
+    def test_to_activity_json_reverse_m2m(self, *_):
+        """changing a field from the other side clears the object that has it"""
+        status = models.Status.objects.create(
+            content="test status", user=self.local_user
+        )
+        key = activity_json_id(status, pure=True)
+
+        with patch("bookwyrm.models.activitypub_mixin.cache") as cache_mock:
+            self.local_user.mention_user.add(status)
+            self.assertIn(key, cache_mock.delete_many.call_args_list[0][0][0])
+            # the status and the user, and nothing for pre_add
+            self.assertEqual(cache_mock.delete_many.call_count, 2)
+
+            cache_mock.reset_mock()
+            self.local_user.mention_user.clear()
+            self.assertIn(key, cache_mock.delete_many.call_args_list[0][0][0])
+
     def test_broadcast_task(self, *_):
         """Should be calling asyncio"""
         recipients = [
             "https://instance.example/user/inbox",
             "https://instance.example/okay/inbox",
         ]
-        with patch("bookwyrm.models.activitypub_mixin.asyncio.run") as mock:
+        with patch(
+            "bookwyrm.models.activitypub_mixin.broadcast_client.run"
+        ) as mock, patch("bookwyrm.models.activitypub_mixin.delivery") as delivery:
+            delivery.filter_available.return_value = recipients
+            delivery.record_results.return_value = ([], [])
             broadcast_task(self.local_user.id, {}, recipients)
         self.assertTrue(mock.called)
         self.assertEqual(mock.call_count, 1)
+
+    def test_broadcast_task_retry(self, broadcast_mock, *_):
+        """failed deliveries are tried again later"""
+        recipients = [
+            "https://instance.example/user/inbox",
+            "https://instance.example/okay/inbox",
+        ]
+        with patch("bookwyrm.models.activitypub_mixin.broadcast_client.run"), patch(
+            "bookwyrm.models.activitypub_mixin.delivery"
+        ) as delivery:
+            delivery.filter_available.return_value = recipients
+            parked = [
+                self.local_user.id,
+                {"type": "Note"},
+                "https://parked.example/inbox",
+            ]
+            delivery.record_results.return_value = (recipients[:1], [parked])
+            delivery.get_retry_delay.return_value = 240
+            broadcast_task(self.local_user.id, {}, recipients, attempt=1)
+
+        self.assertEqual(broadcast_mock.call_count, 2)
+        args = broadcast_mock.call_args_list[0][1]
+        self.assertEqual(args["args"], (self.local_user.id, {}, recipients[:1], 2))
+        self.assertEqual(args["countdown"], 240)
+        args = broadcast_mock.call_args_list[1][1]
+        self.assertEqual(
+            args["args"],
+            (self.local_user.id, {"type": "Note"}, ["https://parked.example/inbox"]),
+        )
+
+    def test_broadcast_task_unavailable(self, *_):
+        """nothing is sent when every server is down"""
+        with patch(
+            "bookwyrm.models.activitypub_mixin.broadcast_client.run"
+        ) as mock, patch("bookwyrm.models.activitypub_mixin.delivery") as delivery:
+            delivery.filter_available.return_value = []
+            broadcast_task(self.local_user.id, {}, ["https://down.example/inbox"])
+        self.assertFalse(mock.called)
+
+    def test_broadcast_client(self, *_):
+        """the event loop and session outlive a broadcast"""
+        client = BroadcastClient()
+
+        async def get_session():
+            return await client.get_session()
+
+        with patch("bookwyrm.models.activitypub_mixin.metrics") as metrics:
+            session = client.run(get_session())
+            loop = client.loop
+            client.connections["example.com-new"] += 1
+            self.assertEqual(client.run(get_session()), session)
+        self.assertEqual(client.loop, loop)
+        metrics.increment_many.assert_called_with(
+            "broadcast-connections", client.connections
+        )
+        self.assertEqual(len(client.connections), 0)
+        client.run(session.close())
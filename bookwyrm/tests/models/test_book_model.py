@@ -50,6 +50,54 @@ class Book(TestCase):
         """you shouldn't be able to create Books (only editions and works)"""
         self.assertRaises(ValueError, models.Book.objects.create, title="Invalid Book")
 
+    def test_identifier_index(self):
+        """identifiers are indexed when book data is saved"""
+        self.first_edition.isbn_13 = "9780300000000"
+        self.first_edition.save()
+        self.assertEqual(
+            models.Edition.find_existing({"isbn13": "9780300000000"}),
+            self.first_edition,
+        )
+        # the isbn 10 was filled in too
+        self.assertEqual(
+            models.Book.find_existing({"isbn10": self.first_edition.isbn_10}),
+            self.first_edition,
+        )
+        # it's not a work
+        self.assertIsNone(models.Work.find_existing({"isbn13": "9780300000000"}))
+
+        self.first_edition.isbn_13 = "9780300000001"
+        self.first_edition.save()
+        self.assertIsNone(models.Edition.find_existing({"isbn13": "9780300000000"}))
+
+        edition_id = self.first_edition.id
+        self.first_edition.delete()
+        self.assertFalse(models.Identifier.objects.filter(object_id=edition_id))
+
+    def test_find_by_identifiers(self):
+        """look up a batch of identifiers at once"""
+        self.first_edition.isbn_13 = "9780300000000"
+        self.first_edition.save()
+        self.second_edition.openlibrary_key = "OL123M"
+        self.second_edition.save()
+
+        with self.assertNumQueries(2):
+            result = models.Edition.find_by_identifiers(
+                [
+                    ("isbn_13", "9780300000000"),
+                    ("openlibrary_key", "OL123M"),
+                    ("isbn_13", "OL123M"),
+                    ("origin_id", "https://example.com/book/1"),
+                ]
+            )
+        self.assertEqual(
+            result,
+            {
+                ("isbn_13", "9780300000000"): self.first_edition,
+                ("openlibrary_key", "OL123M"): self.second_edition,
+            },
+        )
+
     def test_isbn_10_to_13(self):
         """checksums and so on"""
         isbn_10 = "178816167X"
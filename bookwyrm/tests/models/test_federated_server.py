@@ -1,8 +1,10 @@
 """ testing models """
 from unittest.mock import patch
 from django.test import TestCase
+from redis.exceptions import RedisError
 
 from bookwyrm import models
+from bookwyrm.models import federated_server
 
 
 class FederatedServer(TestCase):
@@ -65,3 +67,105 @@ class FederatedServer(TestCase):
         self.inactive_remote_user.refresh_from_db()
         self.assertFalse(self.inactive_remote_user.is_active)
         self.assertEqual(self.inactive_remote_user.deactivation_reason, "self_deletion")
+
+    def test_get_domain_suffixes(self):
+        """a domain and the domains it belongs to"""
+        self.assertEqual(
+            federated_server.get_domain_suffixes("a.b.example.com:8000"),
+            [
+                "a.b.example.com:8000",
+                "a.b.example.com",
+                "b.example.com",
+                "example.com",
+                "com",
+            ],
+        )
+
+    def test_is_blocked_subdomain(self):
+        """blocking a domain blocks its subdomains"""
+        models.FederatedServer.objects.create(server_name="bad.com", status="blocked")
+        with patch.object(federated_server.blocked_domains, "get", return_value=None):
+            self.assertTrue(models.FederatedServer.is_blocked("https://bad.com/u/a"))
+            self.assertTrue(models.FederatedServer.is_blocked("https://x.bad.com/u"))
+            self.assertFalse(models.FederatedServer.is_blocked("https://notbad.com/u"))
+            self.assertFalse(models.FederatedServer.is_blocked("https://test.server"))
+
+    @patch("bookwyrm.models.federated_server.connection")
+    @patch("bookwyrm.models.federated_server.r")
+    def test_blocked_domains(self, redis_mock, connection_mock):
+        """the set is loaded once and reloaded on a message"""
+        connection_mock.in_atomic_block = False
+        blocked_domains = federated_server.BlockedDomains()
+        models.FederatedServer.objects.create(server_name="bad.com", status="blocked")
+        self.assertEqual(blocked_domains.get(), {"bad.com"})
+
+        self.server.block()
+        self.assertEqual(blocked_domains.get(), {"bad.com"})
+        blocked_domains.handle_message({"data": b""})
+        self.assertEqual(blocked_domains.get(), {"bad.com", "test.server"})
+        self.assertEqual(redis_mock.pubsub.call_count, 1)
+
+    @patch("bookwyrm.models.federated_server.r")
+    def test_blocked_domains_invalidate(self, redis_mock):
+        """changing a server's status tells every process once it's committed"""
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.server.block()
+            self.assertFalse(redis_mock.publish.called)
+        self.assertEqual(len(callbacks), 1)
+        redis_mock.publish.assert_called_once_with("blocked-domains", "")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.server.notes = "hi"
+            self.server.save(update_fields=["notes"])
+            models.FederatedServer.objects.create(server_name="fine.com")
+        self.assertEqual(redis_mock.publish.call_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            models.FederatedServer.objects.create(
+                server_name="bad.com", status="blocked"
+            )
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(redis_mock.publish.call_count, 2)
+
+    @patch("bookwyrm.models.federated_server.r")
+    def test_blocked_domains_in_transaction(self, _):
+        """nothing loaded during a transaction is kept"""
+        blocked_domains = federated_server.BlockedDomains()
+        self.assertIsNone(blocked_domains.get())
+        self.assertIsNone(blocked_domains.domains)
+        self.assertFalse(models.FederatedServer.is_blocked("https://test.server"))
+
+    @patch("bookwyrm.models.federated_server.connection")
+    @patch("bookwyrm.models.federated_server.r")
+    def test_blocked_domains_changed_while_loading(self, _, connection_mock):
+        """a load that started before a change isn't kept"""
+        connection_mock.in_atomic_block = False
+        blocked_domains = federated_server.BlockedDomains()
+        real_filter = models.FederatedServer.objects.filter
+
+        def filter_mock(*args, **kwargs):
+            blocked_domains.handle_message({"data": b""})
+            return real_filter(*args, **kwargs)
+
+        with patch.object(models.FederatedServer.objects, "filter", filter_mock):
+            self.assertEqual(blocked_domains.get(), set())
+        self.assertIsNone(blocked_domains.domains)
+
+    @patch("bookwyrm.models.federated_server.r")
+    def test_blocked_domains_rename(self, redis_mock):
+        """renaming a blocked server tells every process"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.server.block()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.server.server_name = "other.server"
+            self.server.save(update_fields=["server_name"])
+        self.assertEqual(redis_mock.publish.call_count, 2)
+
+    @patch("bookwyrm.models.federated_server.r")
+    def test_blocked_domains_no_redis(self, redis_mock):
+        """without redis the database is checked every time"""
+        redis_mock.pubsub.side_effect = RedisError()
+        blocked_domains = federated_server.BlockedDomains()
+        self.assertIsNone(blocked_domains.get())
+        self.assertIsNone(blocked_domains.get())
+        self.assertEqual(redis_mock.pubsub.call_count, 1)
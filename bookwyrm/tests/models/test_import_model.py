@@ -38,6 +38,77 @@ class ImportJob(TestCase):
         )
         self.assertEqual(item.isbn, "9780356506999")
 
+    def test_progress_counters(self):
+        """items keep the job's progress up to date as they're saved"""
+        items = [
+            models.ImportItem.objects.create(
+                index=i, job=self.job, data={}, normalized_data={}
+            )
+            for i in range(3)
+        ]
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.item_count, 3)
+        self.assertEqual(self.job.pending_item_count, 3)
+        self.assertEqual(self.job.percent_complete, 0)
+
+        work = models.Work.objects.create(title="Test Work")
+        book = models.Edition.objects.create(title="Test Book", parent_work=work)
+        items[0].book = book
+        items[0].save()
+        items[1].fail_reason = "nope"
+        items[1].save()
+        # saving again doesn't count it twice
+        items[1].save()
+
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.pending_item_count, 1)
+        self.assertEqual(self.job.successful_item_count, 1)
+        self.assertEqual(self.job.failed_item_count, 1)
+        self.assertEqual(self.job.percent_complete, 66)
+
+        # a failed item that was retried
+        item = models.ImportItem.objects.get(id=items[1].id)
+        item.fail_reason = None
+        item.book = book
+        item.save()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.pending_item_count, 1)
+        self.assertEqual(self.job.successful_item_count, 2)
+        self.assertEqual(self.job.failed_item_count, 0)
+
+    def test_complete_job_counters(self):
+        """items that were never done count as failed"""
+        models.ImportItem.objects.create(
+            index=0, job=self.job, data={}, normalized_data={}
+        )
+        self.job.refresh_from_db()
+        self.job.complete_job()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.pending_item_count, 0)
+        self.assertEqual(self.job.failed_item_count, 1)
+        self.assertEqual(self.job.percent_complete, 100)
+
+    def test_delete_book_counters(self):
+        """items that lose their book when it's deleted are pending again"""
+        work = models.Work.objects.create(title="Test Work")
+        book = models.Edition.objects.create(title="Test Book", parent_work=work)
+        models.ImportItem.objects.create(
+            index=0, job=self.job, data={}, normalized_data={}, book=book
+        )
+        models.ImportItem.objects.create(
+            index=1, job=self.job, data={}, normalized_data={}, fail_reason="nope"
+        )
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.successful_item_count, 1)
+        self.assertEqual(self.job.pending_item_count, 0)
+
+        book.delete()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.item_count, 2)
+        self.assertEqual(self.job.successful_item_count, 0)
+        self.assertEqual(self.job.failed_item_count, 1)
+        self.assertEqual(self.job.pending_item_count, 1)
+
     def test_shelf(self):
         """converts to the local shelf typology"""
         item = models.ImportItem.objects.create(
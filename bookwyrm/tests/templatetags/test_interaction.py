@@ -5,6 +5,7 @@ from django.test import TestCase
 
 from bookwyrm import models
 from bookwyrm.templatetags import interaction
+from bookwyrm.utils.interactions import ViewerInteractions
 
 
 @patch("bookwyrm.activitystreams.add_status_task.delay")
@@ -51,3 +52,42 @@ class InteractionTags(TestCase):
         with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
             models.Boost.objects.create(user=self.user, boosted_status=status)
         self.assertTrue(interaction.get_user_boosted(self.user, status))
+
+    def test_loaded_interactions(self, *_):
+        """interactions loaded for a page are used instead of queries"""
+        status = models.Review.objects.create(
+            user=self.remote_user, book=self.book, rating=3
+        )
+        other_status = models.Review.objects.create(
+            user=self.remote_user, book=self.book
+        )
+        with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
+            models.Favorite.objects.create(user=self.user, status=status)
+            models.Review.objects.create(user=self.user, book=self.book, rating=4)
+            self.user.following.add(self.remote_user)
+
+        interactions = ViewerInteractions(self.user, statuses=[status])
+        self.assertEqual(interactions.liked, {status.id})
+        self.assertEqual(interactions.boosted, set())
+        self.assertEqual(interactions.ratings, {self.book.id: 4})
+        self.assertFalse(interactions.shelves[self.book.id])
+        self.assertTrue(interactions.relationships[self.remote_user.id]["is_following"])
+
+        self.user.interactions = interactions
+        with self.assertNumQueries(0):
+            self.assertTrue(interaction.get_user_liked(self.user, status))
+            self.assertFalse(interaction.get_user_boosted(self.user, status))
+        # statuses that weren't loaded still work
+        self.assertFalse(interaction.get_user_liked(self.user, other_status))
+
+    def test_loaded_interactions_boosts(self, *_):
+        """the books and authors of boosted statuses are loaded too"""
+        status = models.Review.objects.create(user=self.remote_user, book=self.book)
+        with patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async"):
+            boost = models.Boost.objects.create(user=self.user, boosted_status=status)
+        boost = models.Boost.objects.get(id=boost.id)
+
+        interactions = ViewerInteractions(self.user, statuses=[boost])
+        self.assertEqual(interactions.boosted, {status.id})
+        self.assertEqual(interactions.book_ids, {self.book.id})
+        self.assertEqual(interactions.user_ids, {self.remote_user.id})
@@ -0,0 +1,153 @@
+""" testing the cached sets used to fan out statuses """
+from unittest.mock import patch
+from django.test import TestCase
+
+from bookwyrm import activitystreams, audience_cache, models
+
+
+@patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+@patch("bookwyrm.activitystreams.add_status_task.delay")
+@patch("bookwyrm.activitystreams.add_user_statuses_task.delay")
+@patch("bookwyrm.activitystreams.remove_user_statuses_task.delay")
+@patch("bookwyrm.lists_stream.add_user_lists_task.delay")
+@patch("bookwyrm.lists_stream.remove_user_lists_task.delay")
+@patch("bookwyrm.audience_cache.r")
+class AudienceCache(TestCase):
+    """using redis to work out who sees a status"""
+
+    def setUp(self):
+        """use a test csv"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            self.local_user = models.User.objects.create_user(
+                "mouse", "mouse@mouse.mouse", "password", local=True, localname="mouse"
+            )
+            self.another_user = models.User.objects.create_user(
+                "nutria",
+                "nutria@nutria.nutria",
+                "password",
+                local=True,
+                localname="nutria",
+            )
+        with patch("bookwyrm.models.user.set_remote_server.delay"):
+            self.remote_user = models.User.objects.create_user(
+                "rat",
+                "rat@rat.com",
+                "ratword",
+                local=False,
+                remote_id="https://example.com/users/rat",
+                inbox="https://example.com/users/rat/inbox",
+                outbox="https://example.com/users/rat/outbox",
+            )
+        self.cache = audience_cache.AudienceCache()
+
+    def test_set_ids(self, *_):
+        """redis keys for the sets"""
+        self.assertEqual(
+            self.cache.followers_id(self.local_user),
+            f"{self.local_user.id}-local-followers",
+        )
+        self.assertEqual(
+            self.cache.blocks_id(self.local_user.id), f"{self.local_user.id}-blocks"
+        )
+
+    def test_get_sets_cached(self, redis_mock, *_):
+        """loaded sets don't touch the database"""
+        redis_mock.pipeline.return_value.execute.return_value = [
+            {b"0", b"4", b"5"},
+        ]
+        with patch.object(self.cache, "populate_set") as populate:
+            result = self.cache.get_sets("1-local-followers")
+        self.assertEqual(result, [{4, 5}])
+        self.assertFalse(populate.called)
+
+    def test_get_sets_missing(self, redis_mock, *_):
+        """sets without the sentinel are rebuilt"""
+        models.UserFollows.objects.create(
+            user_subject=self.local_user, user_object=self.remote_user
+        )
+        redis_mock.pipeline.return_value.execute.return_value = [set(), set()]
+
+        local_users, followers = self.cache.get_sets(
+            self.cache.local_users_id, self.cache.followers_id(self.remote_user)
+        )
+        self.assertEqual(local_users, {self.local_user.id, self.another_user.id})
+        self.assertEqual(followers, {self.local_user.id})
+        redis_mock.pipeline.return_value.sadd.assert_called_with(
+            self.cache.followers_id(self.remote_user), 0, self.local_user.id
+        )
+
+    def test_get_ids_for_set_blocks(self, *_):
+        """blocks go both ways"""
+        models.UserBlocks.objects.create(
+            user_subject=self.local_user, user_object=self.remote_user
+        )
+        models.UserBlocks.objects.create(
+            user_subject=self.another_user, user_object=self.local_user
+        )
+        self.assertEqual(
+            set(self.cache.get_ids_for_set(self.cache.blocks_id(self.local_user))),
+            {self.remote_user.id, self.another_user.id},
+        )
+
+    def test_get_audience_ids(self, redis_mock, *_):
+        """the cached audience matches the database audience"""
+        redis_mock.pipeline.return_value.execute.return_value = [set()] * 3
+        status = models.Status.objects.create(
+            user=self.remote_user, content="hi", privacy="public"
+        )
+        stream = activitystreams.HomeStream()
+        self.assertEqual(stream.get_audience_ids(status), set())
+
+        models.UserFollows.objects.create(
+            user_subject=self.local_user, user_object=self.remote_user
+        )
+        self.assertEqual(stream.get_audience_ids(status), {self.local_user.id})
+        self.assertEqual(
+            stream.get_audience_ids(status),
+            set(stream.get_audience(status).values_list("id", flat=True)),
+        )
+
+    def test_get_audience_ids_direct(self, redis_mock, *_):
+        """only mentioned users see direct statuses"""
+        redis_mock.pipeline.return_value.execute.return_value = [set()] * 3
+        status = models.Comment.objects.create(
+            user=self.remote_user,
+            content="hi",
+            privacy="direct",
+            book=models.Edition.objects.create(title="test book"),
+        )
+        status.mention_users.add(self.local_user)
+        stream = activitystreams.LocalStream()
+        self.assertEqual(stream.get_audience_ids(status), set())
+
+        stream = activitystreams.streams["home"]
+        self.assertEqual(stream.get_audience_ids(status), set())
+        self.assertEqual(
+            activitystreams.ActivityStream.get_audience_ids(stream, status),
+            {self.local_user.id},
+        )
+
+    def test_update_on_follow(self, redis_mock, *_):
+        """following adds to the followers set"""
+        with self.captureOnCommitCallbacks(execute=True):
+            models.UserFollows.objects.create(
+                user_subject=self.local_user, user_object=self.remote_user
+            )
+        redis_mock.sadd.assert_called_with(
+            f"{self.remote_user.id}-local-followers", self.local_user.id
+        )
+
+    def test_update_on_block(self, redis_mock, *_):
+        """blocking adds to both block sets"""
+        with self.captureOnCommitCallbacks(execute=True):
+            models.UserBlocks.objects.create(
+                user_subject=self.local_user, user_object=self.remote_user
+            )
+        redis_mock.sadd.assert_any_call(
+            f"{self.local_user.id}-blocks", self.remote_user.id
+        )
+        redis_mock.sadd.assert_any_call(
+            f"{self.remote_user.id}-blocks", self.local_user.id
+        )
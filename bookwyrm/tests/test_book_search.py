@@ -1,6 +1,9 @@
 """ test searching for books """
 import datetime
-from django.test import TestCase
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
 from bookwyrm import book_search, models
@@ -34,7 +37,8 @@ class BookSearch(TestCase):
             isbn_10="022222222X",
         )
 
-    def test_search(self):
+    @patch("bookwyrm.book_search.metrics")
+    def test_search(self, _):
         """search for a book in the db"""
         # title/author
         results = book_search.search("Example")
@@ -51,6 +55,39 @@ class BookSearch(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0], self.second_edition)
 
+    @override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    )
+    @patch("bookwyrm.book_search.metrics")
+    def test_search_cached(self, metrics_mock):
+        """repeated searches don't hit the database until editions change"""
+        cache.clear()
+        results = book_search.search("example  EDITION")
+        self.assertEqual(results, [self.first_edition])
+        # only the editions are loaded
+        with self.assertNumQueries(1):
+            cached_results = book_search.search("Example Edition ")
+        self.assertEqual(cached_results, [self.first_edition])
+        self.assertEqual(cached_results[0].rank, results[0].rank)
+        counts = [c[0][1] for c in metrics_mock.increment_many.call_args_list]
+        self.assertEqual(counts[0]["miss"], 1)
+        self.assertEqual(counts[1]["hit"], 1)
+
+        # saving fields that searches don't use keeps the cache
+        self.first_edition.description = "A book"
+        self.first_edition.save()
+        with self.assertNumQueries(1):
+            book_search.search("Example Edition")
+
+        self.first_edition.title = "Changed Title"
+        self.first_edition.save()
+        self.assertEqual(book_search.search("Example Edition"), [])
+
+    def test_normalize_query(self):
+        """searches that mean the same thing"""
+        self.assertEqual(book_search.normalize_query(" A  Book\n"), "a book")
+        self.assertEqual(book_search.normalize_query(" OL123M "), "OL123M")
+
     def test_isbn_search(self):
         """test isbn search"""
         results = book_search.isbn_search("0000000000")
@@ -87,6 +124,20 @@ class BookSearch(TestCase):
         )
         self.assertEqual(results, self.second_edition)
 
+    def test_search_title_author_best_edition(self):
+        """one edition for each work, the closest match first"""
+        work = models.Work.objects.create(title="Another Work")
+        models.Edition.objects.create(title="Another Another", parent_work=work)
+        # same title, more metadata
+        edition = models.Edition.objects.create(
+            title="Another Another", parent_work=work, isbn_13="9780300000000"
+        )
+
+        with self.assertNumQueries(1):
+            results = book_search.search_title_author("Another", min_confidence=0)
+        self.assertEqual(len(results), 2)
+        self.assertEqual(set(results), {edition, self.second_edition})
+
     def test_format_search_result(self):
         """format a search result"""
         result = book_search.format_search_result(self.first_edition)
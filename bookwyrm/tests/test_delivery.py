@@ -0,0 +1,271 @@
+""" testing recipients, retries and server health for outgoing activities """
+import json
+import time
+from unittest.mock import patch
+
+from django.test import TestCase
+from redis.exceptions import RedisError
+
+from bookwyrm import delivery, models
+
+
+@patch("bookwyrm.delivery.metrics")
+@patch("bookwyrm.delivery.r")
+class Delivery(TestCase):
+    """keeping track of which servers are up"""
+
+    def test_get_host(self, *_):
+        """matches the FederatedServer server name"""
+        self.assertEqual(
+            delivery.get_host("https://example.com/user/mouse/inbox"), "example.com"
+        )
+
+    def test_get_retry_delay(self, *_):
+        """exponential backoff"""
+        self.assertEqual(delivery.get_retry_delay(0), 60)
+        self.assertEqual(delivery.get_retry_delay(1), 240)
+        self.assertEqual(delivery.get_retry_delay(2), 960)
+
+    def test_get_delivery_health(self, redis_mock, _):
+        """a score from consecutive failures"""
+        redis_mock.hmget.return_value = [None, None]
+        health = delivery.get_delivery_health("example.com")
+        self.assertEqual(health["failures"], 0)
+        self.assertEqual(health["score"], 100)
+
+        redis_mock.hmget.return_value = [b"3", b"1000.5"]
+        health = delivery.get_delivery_health("example.com")
+        self.assertEqual(health["failures"], 3)
+        self.assertEqual(health["failing_since"], 1000.5)
+        self.assertEqual(health["score"], 25)
+
+    def test_filter_available(self, redis_mock, _):
+        """servers that have been down a long time are skipped"""
+        recipients = ["https://up.example/inbox", "https://down.example/inbox"]
+        long_ago = time.time() - 60 * 60 * 24
+        health = {
+            "up.example": [b"2", str(long_ago).encode()],
+            "down.example": [b"20", str(long_ago).encode()],
+        }
+        # hosts are checked in set order
+        hosts = {delivery.get_host(i) for i in recipients}
+        redis_mock.pipeline.return_value.execute.side_effect = [
+            [health[h] for h in hosts],
+            # another delivery is already checking on the dead server
+            [None],
+            [],
+        ]
+        result = delivery.filter_available(1, {"type": "Note"}, recipients)
+        self.assertEqual(result, ["https://up.example/inbox"])
+        redis_mock.pipeline.return_value.set.assert_called_once_with(
+            "down.example-delivery-probe", 1, nx=True, ex=60 * 60
+        )
+        redis_mock.pipeline.return_value.rpush.assert_called_once_with(
+            "down.example-parked-deliveries",
+            json.dumps([1, {"type": "Note"}, "https://down.example/inbox"]),
+        )
+
+    def test_filter_available_probe(self, redis_mock, _):
+        """a dead server is tried every so often"""
+        long_ago = time.time() - 60 * 60 * 24
+        redis_mock.pipeline.return_value.execute.side_effect = [
+            [[b"20", str(long_ago).encode()]],
+            [True],
+            [],
+        ]
+        recipients = ["https://down.example/inbox"]
+        result = delivery.filter_available(1, {"type": "Note"}, recipients)
+        self.assertEqual(result, recipients)
+        self.assertTrue(redis_mock.pipeline.return_value.set.called)
+        self.assertFalse(redis_mock.pipeline.return_value.rpush.called)
+
+    def test_record_results(self, redis_mock, metrics_mock):
+        """failures count against a server, successes clear it"""
+        parked = [1, {"type": "Note"}, "https://up.example/other/inbox"]
+        redis_mock.pipeline.return_value.execute.return_value = [
+            1,
+            [json.dumps(parked).encode()],
+            1,
+            1,
+            True,
+        ]
+        retry, unparked = delivery.record_results(
+            ["https://up.example/inbox", "https://down.example/inbox"],
+            [delivery.DELIVERED, delivery.RETRY],
+        )
+        self.assertEqual(retry, ["https://down.example/inbox"])
+        self.assertEqual(unparked, [parked])
+
+        pipeline = redis_mock.pipeline.return_value
+        pipeline.delete.assert_any_call("up.example-delivery-health")
+        pipeline.hincrby.assert_called_once_with(
+            "down.example-delivery-health", "failures", 1
+        )
+        self.assertEqual(
+            metrics_mock.increment_many.call_args[0][1],
+            {delivery.DELIVERED: 1, delivery.RETRY: 1},
+        )
+
+
+@patch("bookwyrm.models.activitypub_mixin.broadcast_task.apply_async")
+@patch("bookwyrm.delivery.r")
+class DeliverySets(TestCase):
+    """cached inboxes for each local user's remote followers"""
+
+    def setUp(self):
+        """a local user with remote followers"""
+        with patch("bookwyrm.suggested_users.rerank_suggestions_task.delay"), patch(
+            "bookwyrm.activitystreams.populate_stream_task.delay"
+        ), patch("bookwyrm.lists_stream.populate_lists_task.delay"):
+            self.local_user = models.User.objects.create_user(
+                "mouse", "mouse@mouse.mouse", "password", local=True, localname="mouse"
+            )
+        with patch("bookwyrm.models.user.set_remote_server.delay"):
+            self.remote_user = models.User.objects.create_user(
+                "rat",
+                "rat@rat.com",
+                "ratword",
+                local=False,
+                remote_id="https://example.com/users/rat",
+                inbox="https://example.com/users/rat/inbox",
+                shared_inbox="https://example.com/inbox",
+                outbox="https://example.com/users/rat/outbox",
+            )
+            self.other_user = models.User.objects.create_user(
+                "nutria",
+                "nutria@nutria.com",
+                "nutriaword",
+                local=False,
+                bookwyrm_user=False,
+                remote_id="https://other.com/users/nutria",
+                inbox="https://other.com/users/nutria/inbox",
+                outbox="https://other.com/users/nutria/outbox",
+            )
+        self.local_user.followers.add(self.remote_user, self.other_user)
+
+    def test_get_delivery_set_cached(self, redis_mock, _):
+        """loaded sets don't touch the database"""
+        redis_mock.pipeline.return_value.execute.return_value = [
+            {b"0": b"", b"4": b"https://a.com/inbox", b"5": b"https://a.com/inbox"},
+            {b"0": b"", b"6": b"https://b.com/user/inbox"},
+        ]
+        with patch("bookwyrm.delivery.populate_delivery_set") as populate:
+            result = delivery.get_delivery_set(self.local_user)
+        self.assertEqual(
+            set(result), {"https://a.com/inbox", "https://b.com/user/inbox"}
+        )
+        self.assertFalse(populate.called)
+
+    def test_get_delivery_set_missing(self, redis_mock, _):
+        """sets without the sentinel are rebuilt"""
+        redis_mock.pipeline.return_value.execute.return_value = [{}, {}]
+        result = delivery.get_delivery_set(self.local_user)
+        self.assertEqual(
+            set(result),
+            {"https://example.com/inbox", "https://other.com/users/nutria/inbox"},
+        )
+        redis_mock.pipeline.return_value.hset.assert_any_call(
+            f"{self.local_user.id}-delivery-bookwyrm",
+            self.remote_user.id,
+            "https://example.com/inbox",
+        )
+
+    def test_get_delivery_set_software(self, redis_mock, _):
+        """only one kind of server"""
+        redis_mock.pipeline.return_value.execute.return_value = [{}]
+        result = delivery.get_delivery_set(self.local_user, software="bookwyrm")
+        self.assertEqual(result, ["https://example.com/inbox"])
+
+    def test_get_delivery_set_no_redis(self, redis_mock, _):
+        """activities still go out without redis"""
+        redis_mock.pipeline.return_value.execute.side_effect = RedisError()
+        result = delivery.get_delivery_set(self.local_user)
+        self.assertEqual(
+            set(result),
+            {"https://example.com/inbox", "https://other.com/users/nutria/inbox"},
+        )
+
+    def test_follow_updates_delivery_set(self, redis_mock, _):
+        """new followers are added, and removed when they unfollow"""
+        models.UserFollows.objects.filter(user_subject=self.remote_user).delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            follow = models.UserFollows.objects.create(
+                user_subject=self.remote_user, user_object=self.local_user
+            )
+        redis_mock.pipeline.return_value.hset.assert_called_with(
+            f"{self.local_user.id}-delivery-bookwyrm",
+            self.remote_user.id,
+            "https://example.com/inbox",
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            follow.delete()
+        redis_mock.hdel.assert_any_call(
+            f"{self.local_user.id}-delivery-bookwyrm", self.remote_user.id
+        )
+
+    def test_remote_user_changes_inbox(self, redis_mock, _):
+        """followers who move are updated"""
+        self.remote_user.shared_inbox = "https://example.com/new-inbox"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.remote_user.save(broadcast=False, update_fields=["shared_inbox"])
+        redis_mock.pipeline.return_value.hset.assert_called_once_with(
+            f"{self.local_user.id}-delivery-bookwyrm",
+            self.remote_user.id,
+            "https://example.com/new-inbox",
+        )
+
+        redis_mock.reset_mock()
+        self.remote_user.summary = "hi"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.remote_user.save(broadcast=False, update_fields=["summary"])
+        self.assertFalse(redis_mock.pipeline.called)
+
+    def test_remote_user_deactivated(self, redis_mock, _):
+        """deactivated followers are taken out of the sets"""
+        self.remote_user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.remote_user.save(broadcast=False, update_fields=["is_active"])
+        self.assertFalse(models.User.objects.get(id=self.remote_user.id).is_active)
+        redis_mock.pipeline.return_value.hdel.assert_any_call(
+            f"{self.local_user.id}-delivery-bookwyrm", self.remote_user.id
+        )
+        self.assertFalse(redis_mock.pipeline.return_value.hset.called)
+
+        # saving it again isn't a change
+        redis_mock.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.remote_user.save(broadcast=False)
+        self.assertFalse(redis_mock.pipeline.called)
+
+    @patch("bookwyrm.models.federated_server.r")
+    @patch("bookwyrm.activitystreams.add_status_task.delay")
+    def test_block_server_clears_delivery_sets(self, _, __, redis_mock, *___):
+        """followers on a blocked server stop getting activities"""
+        server = models.FederatedServer.objects.create(server_name="example.com")
+        models.User.objects.filter(id=self.remote_user.id).update(
+            federated_server=server
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            server.block()
+        redis_mock.pipeline.return_value.delete.assert_called_once_with(
+            f"{self.local_user.id}-delivery-bookwyrm",
+            f"{self.local_user.id}-delivery-other",
+        )
+
+        # the sets are rebuilt without the blocked server
+        redis_mock.pipeline.return_value.execute.return_value = [{}, {}]
+        status = models.Status.objects.create(
+            user=self.local_user, content="hi", privacy="followers"
+        )
+        self.assertEqual(
+            status.get_recipients(), ["https://other.com/users/nutria/inbox"]
+        )
+
+        redis_mock.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            server.unblock()
+        redis_mock.pipeline.return_value.delete.assert_called_once_with(
+            f"{self.local_user.id}-delivery-bookwyrm",
+            f"{self.local_user.id}-delivery-other",
+        )
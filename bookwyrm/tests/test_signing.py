@@ -12,11 +12,14 @@ import pytest
 
 from django.test import TestCase, Client
 from django.utils.http import http_date
+from redis.exceptions import RedisError
 
 from bookwyrm import models
 from bookwyrm.activitypub import Follow
 from bookwyrm.settings import DOMAIN
-from bookwyrm.signatures import create_key_pair, make_signature, make_digest
+from bookwyrm.views import inbox
+from bookwyrm.signatures import create_key_pair, make_signature, make_signatures
+from bookwyrm.signatures import make_digest, get_signer
 
 
 def get_follow_activity(follower, followee):
@@ -61,6 +64,7 @@ class Signature(TestCase):
         )
 
         models.SiteSettings.objects.create()
+        inbox.public_keys.clear()
 
     def send(self, signature, now, data, digest):
         """test request"""
@@ -86,7 +90,10 @@ class Signature(TestCase):
         data = json.dumps(get_follow_activity(sender, self.rat))
         digest = digest or make_digest(data)
         signature = make_signature(signer or sender, self.rat.inbox, now, digest)
-        with patch("bookwyrm.views.inbox.activity_task.delay"):
+        with patch("bookwyrm.views.inbox.activity_task.delay"), patch(
+            "bookwyrm.views.inbox.r"
+        ) as redis_mock:
+            redis_mock.get.return_value = None
             with patch("bookwyrm.models.user.set_remote_server.delay"):
                 return self.send(signature, now, send_data or data, digest)
 
@@ -199,3 +206,96 @@ class Signature(TestCase):
                 self.mouse, date=http_date(time.time() - 301)
             )
             self.assertEqual(response.status_code, 401)
+
+    def test_make_signatures(self):
+        """one signature for each destination, matching the single version"""
+        now = http_date()
+        digest = make_digest("hi")
+        destinations = [self.rat.inbox, self.cat.inbox]
+        signatures = make_signatures(self.mouse, destinations, now, digest)
+        self.assertEqual(set(signatures.keys()), set(destinations))
+        self.assertEqual(
+            signatures[self.rat.inbox],
+            make_signature(self.mouse, self.rat.inbox, now, digest),
+        )
+        self.assertNotEqual(signatures[self.rat.inbox], signatures[self.cat.inbox])
+
+    def test_get_signer_cached(self):
+        """keys are only parsed once, and a new key gets a new signer"""
+        private_key = self.fake_remote.key_pair.private_key
+        self.assertIs(get_signer(private_key), get_signer(private_key))
+
+        new_private_key, _ = create_key_pair()
+        self.assertIsNot(get_signer(new_private_key), get_signer(private_key))
+
+    def test_get_public_key_cached(self):
+        """keys are kept in memory and in redis"""
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.activitypub.resolve_remote_id"
+        ) as resolve:
+            redis_mock.get.return_value = None
+            resolve.return_value = self.mouse
+            self.assertEqual(
+                inbox.get_public_key(self.mouse.remote_id),
+                self.mouse.key_pair.public_key,
+            )
+            self.assertEqual(
+                inbox.get_public_key(self.mouse.remote_id),
+                self.mouse.key_pair.public_key,
+            )
+        self.assertEqual(resolve.call_count, 1)
+        redis_mock.set.assert_called_once_with(
+            f"{self.mouse.remote_id}-public-key",
+            self.mouse.key_pair.public_key,
+            ex=inbox.PUBLIC_KEY_TIMEOUT,
+        )
+
+    def test_get_public_key_redis(self):
+        """another process already found the key"""
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.activitypub.resolve_remote_id"
+        ) as resolve:
+            redis_mock.get.return_value = b"key"
+            self.assertEqual(inbox.get_public_key(self.mouse.remote_id), "key")
+        self.assertFalse(resolve.called)
+
+    def test_get_public_key_no_redis(self):
+        """keys are still found when redis is down"""
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.activitypub.resolve_remote_id"
+        ) as resolve:
+            redis_mock.get.side_effect = RedisError()
+            redis_mock.set.side_effect = RedisError()
+            resolve.return_value = self.mouse
+            self.assertEqual(
+                inbox.get_public_key(self.mouse.remote_id),
+                self.mouse.key_pair.public_key,
+            )
+
+    def test_get_public_key_missing(self):
+        """a key pair without a public key isn't cached"""
+        self.mouse.key_pair.public_key = None
+        with patch("bookwyrm.views.inbox.r") as redis_mock, patch(
+            "bookwyrm.activitypub.resolve_remote_id"
+        ) as resolve:
+            redis_mock.get.return_value = None
+            resolve.return_value = self.mouse
+            self.assertIsNone(inbox.get_public_key(self.mouse.remote_id))
+        self.assertFalse(redis_mock.set.called)
+        self.assertNotIn(self.mouse.remote_id, inbox.public_keys)
+
+    def test_get_public_key_refresh(self):
+        """a failed check skips the caches"""
+        inbox.remember_public_key(self.mouse.remote_id, "old key", time.time())
+        with patch("bookwyrm.views.inbox.r"), patch(
+            "bookwyrm.activitypub.resolve_remote_id"
+        ) as resolve:
+            resolve.return_value = self.mouse
+            self.assertEqual(inbox.get_public_key(self.mouse.remote_id), "old key")
+            self.assertEqual(
+                inbox.get_public_key(self.mouse.remote_id, refresh=True),
+                self.mouse.key_pair.public_key,
+            )
+        self.assertEqual(
+            inbox.public_keys[self.mouse.remote_id][0], self.mouse.key_pair.public_key
+        )
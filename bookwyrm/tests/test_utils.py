@@ -2,7 +2,7 @@
 import re
 from django.test import TestCase
 
-from bookwyrm.utils import regex
+from bookwyrm.utils import metrics, regex
 
 
 class TestUtils(TestCase):
@@ -11,3 +11,18 @@ class TestUtils(TestCase):
     def test_regex(self):
         """Regexes used throughout the app"""
         self.assertTrue(re.match(regex.DOMAIN, "xn--69aa8bzb.xn--y9a3aq"))
+
+    def test_latency_field(self):
+        """timings are counted in buckets"""
+        self.assertEqual(metrics.latency_field(0.001), "latency-5ms")
+        self.assertEqual(metrics.latency_field(0.2), "latency-250ms")
+        self.assertEqual(metrics.latency_field(10), "latency-slower")
+
+    def test_get_latency_percentiles(self):
+        """which bucket each percentile falls in"""
+        counts = {"hit": 3, "latency-5ms": 90, "latency-50ms": 9, "latency-slower": 1}
+        self.assertEqual(
+            metrics.get_latency_percentiles(counts),
+            {50: "latency-5ms", 90: "latency-5ms", 99: "latency-50ms"},
+        )
+        self.assertEqual(metrics.get_latency_percentiles({"hit": 3}), {})
@@ -168,3 +168,80 @@ class Inbox(TestCase):
             content_type="application/json",
         )
         self.assertEqual(response.status_code, 403)
+
+    @patch("bookwyrm.views.inbox.settings.INBOX_DEFERRED_VERIFICATION", True)
+    @patch("bookwyrm.views.inbox.metrics")
+    def test_inbox_deferred(self, _):
+        """the view only queues the activity"""
+        with patch("bookwyrm.views.inbox.verify_activity_task.delay") as mock, patch(
+            "bookwyrm.views.inbox.has_valid_signature"
+        ) as mock_valid:
+            result = self.client.post(
+                "/user/mouse/inbox",
+                json.dumps(self.create_json),
+                content_type="application/json",
+                HTTP_SIGNATURE='keyId="hi#main-key",headers="date",signature="aGk="',
+                HTTP_DATE="Thu, 01 Dec 2022 00:00:00 GMT",
+            )
+        self.assertEqual(result.status_code, 200)
+        self.assertFalse(mock_valid.called)
+        args = mock.call_args[0]
+        self.assertEqual(args[0], "/user/mouse/inbox")
+        self.assertEqual(args[1]["date"], "Thu, 01 Dec 2022 00:00:00 GMT")
+        self.assertEqual(json.loads(args[2]), self.create_json)
+        self.assertEqual(args[4], "mouse")
+
+    @patch("bookwyrm.views.inbox.settings.INBOX_DEFERRED_VERIFICATION", True)
+    @patch("bookwyrm.views.inbox.metrics")
+    def test_inbox_deferred_unsigned(self, _):
+        """no need to queue activities that can't be valid"""
+        with patch("bookwyrm.views.inbox.verify_activity_task.delay") as mock:
+            result = self.client.post(
+                "/inbox", json.dumps(self.create_json), content_type="application/json"
+            )
+        self.assertEqual(result.status_code, 401)
+        self.assertFalse(mock.called)
+
+    def test_verify_activity(self):
+        """run the inbox checks in a task"""
+        body = json.dumps(self.create_json)
+        headers = {"Signature": "sig", "Date": "Thu, 01 Dec 2022 00:00:00 GMT"}
+        with patch("bookwyrm.views.inbox.has_valid_signature") as mock_valid, patch(
+            "bookwyrm.views.inbox.activity_task"
+        ) as mock_task:
+            mock_valid.return_value = False
+            result = views.inbox.verify_activity("/inbox", headers, body, 1669852800)
+            self.assertEqual(result, "rejected")
+            self.assertFalse(mock_task.called)
+
+            mock_valid.return_value = True
+            result = views.inbox.verify_activity("/inbox", headers, body, 1669852800)
+            self.assertEqual(result, "accepted")
+            mock_task.assert_called_once_with(self.create_json)
+
+        request = mock_valid.call_args[0][0]
+        self.assertEqual(request.headers["date"], "Thu, 01 Dec 2022 00:00:00 GMT")
+        self.assertEqual(request.body, body.encode("utf8"))
+
+    def test_verify_activity_task_error(self):
+        """the pending count goes down even when the checks fail"""
+        with patch("bookwyrm.views.inbox.verify_activity") as mock_verify, patch(
+            "bookwyrm.views.inbox.metrics.increment_many"
+        ) as mock_metrics:
+            mock_verify.side_effect = ValueError()
+            with self.assertRaises(ValueError):
+                views.inbox.verify_activity_task("/inbox", {}, "{}", 1669852800)
+        mock_metrics.assert_called_once_with("inbox", {"pending": -1})
+
+    @patch("bookwyrm.suggested_users.remove_user_task.delay")
+    def test_verify_activity_blocked(self, _):
+        """blocklists are checked in the task too"""
+        self.remote_user.delete(broadcast=False)
+        activity = self.create_json
+        activity["actor"] = self.remote_user.remote_id
+        with patch("bookwyrm.views.inbox.activity_task") as mock_task:
+            result = views.inbox.verify_activity(
+                "/inbox", {}, json.dumps(activity), 1669852800
+            )
+        self.assertEqual(result, "blocked")
+        self.assertFalse(mock_task.called)
@@ -37,7 +37,7 @@ class LandingViews(TestCase):
         view = views.Home.as_view()
         request = self.factory.get("")
         request.user = self.local_user
-        with patch("bookwyrm.activitystreams.ActivityStream.get_activity_stream"):
+        with patch("bookwyrm.activitystreams.ActivityStream.get_activity_page"):
             result = view(request)
         self.assertEqual(result.status_code, 200)
         validate_html(result.render())
@@ -1,4 +1,5 @@
 """ test for app action functionality """
+import json
 from io import BytesIO
 from unittest.mock import patch
 import pathlib
@@ -15,7 +16,7 @@ from bookwyrm.activitypub import ActivitypubResponse
 from bookwyrm.tests.validate_html import validate_html
 
 
-@patch("bookwyrm.activitystreams.ActivityStream.get_activity_stream")
+@patch("bookwyrm.activitystreams.ActivityStream.get_activity_page")
 @patch("bookwyrm.activitystreams.add_status_task.delay")
 @patch("bookwyrm.suggested_users.rerank_suggestions_task.delay")
 @patch("bookwyrm.activitystreams.populate_stream_task.delay")
@@ -62,6 +63,23 @@ class FeedViews(TestCase):
         validate_html(result.render())
         self.assertEqual(result.status_code, 200)
 
+    @patch("bookwyrm.suggested_users.SuggestedUsers.get_suggestions")
+    def test_feed_cursor(self, *args):
+        """pages start after the rank and id in the query string"""
+        page_mock = args[-1]
+        view = views.Feed.as_view()
+        request = self.factory.get("", {"max": "1.5", "id": "3"})
+        request.user = self.local_user
+        view(request, "home")
+        self.assertEqual(page_mock.call_args[1]["max_cursor"], (1.5, 3))
+        self.assertIsNone(page_mock.call_args[1]["min_cursor"])
+
+        for value in ["nan", "inf", "-inf", "hi"]:
+            request = self.factory.get("", {"min": value, "id": "3"})
+            request.user = self.local_user
+            view(request, "home")
+            self.assertIsNone(page_mock.call_args[1]["min_cursor"])
+
     @patch("bookwyrm.suggested_users.SuggestedUsers.get_suggestions")
     def test_save_feed_settings(self, *_):
         """update display preferences"""
@@ -100,6 +118,7 @@ class FeedViews(TestCase):
             result = view(request, "mouse", status.id)
         self.assertIsInstance(result, ActivitypubResponse)
         self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.content)["id"], status.remote_id)
 
     def test_status_page_not_found(self, *_):
         """there are so many views, this just makes sure it LOADS"""
@@ -45,6 +45,24 @@ class UpdateViews(TestCase):
         data = json.loads(result.getvalue())
         self.assertEqual(data["count"], 1)
 
+    def test_get_import_progress(self):
+        """cheap to check while an import runs"""
+        job = models.ImportJob.objects.create(user=self.local_user, mappings={})
+        models.ImportItem.objects.create(
+            index=0, job=job, data={}, normalized_data={}, fail_reason="nope"
+        )
+        models.ImportItem.objects.create(index=1, job=job, data={}, normalized_data={})
+        request = self.factory.get("")
+        request.user = self.local_user
+
+        result = views.get_import_progress(request, job.id)
+        self.assertIsInstance(result, JsonResponse)
+        data = json.loads(result.getvalue())
+        self.assertEqual(
+            data,
+            {"item_count": 2, "complete_count": 1, "percent": 50, "complete": False},
+        )
+
     def test_get_unread_status_string(self):
         """there are so many views, this just makes sure it LOADS"""
         request = self.factory.get("")
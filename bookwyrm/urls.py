@@ -58,6 +58,11 @@ urlpatterns = [
         views.get_unread_status_string,
         name="stream-updates",
     ),
+    re_path(
+        r"^api/updates/import/(?P<job_id>\d+)/?$",
+        views.get_import_progress,
+        name="import-updates",
+    ),
     # instance setup
     re_path(r"^setup/?$", views.InstanceConfig.as_view(), name="setup"),
     re_path(r"^setup/admin/?$", views.CreateAdmin.as_view(), name="setup-admin"),
@@ -0,0 +1,137 @@
+""" load how a viewer has interacted with everything on a page all at once """
+from django.db.models import prefetch_related_objects
+
+from bookwyrm import models
+
+
+class ViewerInteractions:
+    """likes, boosts, shelves, ratings and relationships for one viewer, loaded
+    with a few queries for a whole page instead of a few for each status"""
+
+    def __init__(self, viewer, statuses=None, users=None):
+        statuses = list(statuses or [])
+        users = list(users or [])
+
+        # statuses from raw queries don't come with their mentions or authors
+        prefetch_related_objects(
+            [s for s in statuses if not is_prefetched(s, "mention_books")],
+            "mention_books",
+            "user",
+        )
+        status_ids = {s.id for s in statuses}
+        # boosts show the boosted status, so that's what gets liked or boosted,
+        # and its book and author are shown too
+        boosted_ids = {
+            s.boosted_status_id for s in statuses if isinstance(s, models.Boost)
+        }
+        if boosted_ids:
+            statuses += (
+                models.Status.objects.select_subclasses()
+                .filter(id__in=boosted_ids)
+                .select_related(
+                    "user", "comment__book", "review__book", "quotation__book"
+                )
+                .prefetch_related("mention_books")
+            )
+        status_ids |= boosted_ids
+        self.status_ids = status_ids
+        self.liked = set(
+            models.Favorite.objects.filter(
+                user=viewer, status__id__in=status_ids
+            ).values_list("status__id", flat=True)
+        )
+        self.boosted = set(
+            models.Boost.objects.filter(
+                user=viewer, boosted_status__id__in=status_ids
+            ).values_list("boosted_status__id", flat=True)
+        )
+
+        books = {}
+        for status in statuses:
+            if hasattr(status, "book"):
+                books[status.book.id] = status.book
+            for book in status.mention_books.all():
+                books[book.id] = book
+        self.book_ids = set(books.keys())
+        self.shelves = self.get_active_shelves(viewer, books.values())
+        self.ratings = self.get_ratings(viewer, self.book_ids)
+
+        users = {u.id: u for u in users + [s.user for s in statuses]}
+        users.pop(viewer.id, None)
+        self.user_ids = set(users.keys())
+        self.relationships = self.get_relationships(viewer, self.user_ids)
+
+    @staticmethod
+    def get_active_shelves(viewer, books):
+        """the shelf each book, or another edition of it, is on"""
+        works = {b.id: b.parent_work_id for b in books}
+        shelved = {}
+        for shelf_book in models.ShelfBook.objects.filter(
+            shelf__user=viewer, book__parent_work__id__in=works.values()
+        ).select_related("shelf", "book"):
+            # shelf books are ordered newest first, keep the first one like .first()
+            shelved.setdefault(shelf_book.book.parent_work_id, shelf_book)
+        return {
+            book_id: shelved.get(work_id, False) for (book_id, work_id) in works.items()
+        }
+
+    @staticmethod
+    def get_ratings(viewer, book_ids):
+        """the viewer's latest rating of each book"""
+        ratings = models.Review.objects.filter(
+            user=viewer,
+            book__id__in=book_ids,
+            rating__isnull=False,
+            deleted=False,
+        ).order_by("published_date")
+        # later ratings overwrite earlier ones
+        return {r.book_id: r.rating for r in ratings}
+
+    @staticmethod
+    def get_relationships(viewer, user_ids):
+        """how the viewer relates to each user"""
+        blocked = set(
+            viewer.blocks.filter(id__in=user_ids).values_list("id", flat=True)
+        )
+        following = set(
+            viewer.following.filter(id__in=user_ids).values_list("id", flat=True)
+        )
+        requested = set(
+            models.UserFollowRequest.objects.filter(
+                user_subject=viewer, user_object__id__in=user_ids
+            ).values_list("user_object__id", flat=True)
+        )
+        relationships = {}
+        for user_id in user_ids:
+            relationships[user_id] = {
+                "is_following": False,
+                "is_follow_pending": False,
+                "is_blocked": False,
+            }
+            if user_id in blocked:
+                relationships[user_id]["is_blocked"] = True
+            elif user_id in following:
+                relationships[user_id]["is_following"] = True
+            elif user_id in requested:
+                relationships[user_id]["is_follow_pending"] = True
+        return relationships
+
+
+def is_prefetched(obj, lookup):
+    """whether a many to many field has already been loaded for an object"""
+    return lookup in getattr(obj, "_prefetched_objects_cache", {})
+
+
+def load_interactions(request, statuses=None, users=None):
+    """attach the viewer's interactions with a page to the logged in user, where
+    the template tags can find them"""
+    if not request.user.is_authenticated:
+        return
+    request.user.interactions = ViewerInteractions(
+        request.user, statuses=statuses, users=users
+    )
+
+
+def get_interactions(user):
+    """the interactions loaded for this request, if any"""
+    return getattr(user, "interactions", None)
@@ -0,0 +1,78 @@
+""" simple counters kept in redis, for keeping an eye on how things are running """
+import logging
+from redis.exceptions import RedisError
+
+from bookwyrm.redis_store import r
+
+logger = logging.getLogger(__name__)
+
+# the upper bounds, in milliseconds, of the buckets timings are counted in
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+
+def metrics_id(name):
+    """the redis key for a group of counters"""
+    return f"metrics-{name}"
+
+
+def increment(name, field, amount=1, pipeline=None):
+    """add to a counter, as part of a pipeline if one is provided"""
+    client = r if pipeline is None else pipeline
+    client.hincrby(metrics_id(name), field, amount)
+
+
+def increment_many(name, counts):
+    """add to several counters at once, without letting a redis problem get in the
+    way of whatever is being counted"""
+    if not counts:
+        return
+    pipeline = r.pipeline()
+    for (field, amount) in counts.items():
+        increment(name, field, amount, pipeline)
+    try:
+        pipeline.execute()
+    except RedisError as err:
+        logger.warning("Unable to save %s metrics: %s", name, err)
+
+
+def latency_field(seconds):
+    """the counter for the bucket a timing falls in"""
+    milliseconds = seconds * 1000
+    for bound in LATENCY_BUCKETS:
+        if milliseconds <= bound:
+            return f"latency-{bound}ms"
+    return "latency-slower"
+
+
+def get_latency_percentiles(counts, percentiles=(50, 90, 99)):
+    """roughly how long things took, as the bucket each percentile falls in"""
+    buckets = [f"latency-{b}ms" for b in LATENCY_BUCKETS] + ["latency-slower"]
+    total = sum(counts.get(b, 0) for b in buckets)
+    if not total:
+        return {}
+
+    result = {}
+    seen = 0
+    for bucket in buckets:
+        seen += counts.get(bucket, 0)
+        for percentile in percentiles:
+            if percentile not in result and seen * 100 >= total * percentile:
+                result[percentile] = bucket
+    return result
+
+
+def get_metrics(name):
+    """all the counters in a group"""
+    values = r.hgetall(metrics_id(name))
+    return {k.decode("utf-8"): int(v) for (k, v) in values.items()}
+
+
+def get_metric_names():
+    """every group of counters that has been recorded"""
+    prefix = metrics_id("")
+    return sorted(k.decode("utf-8")[len(prefix) :] for k in r.keys(f"{prefix}*"))
+
+
+def reset_metrics(name):
+    """start counting from zero"""
+    r.delete(metrics_id(name))
@@ -24,7 +24,7 @@ class Author(View):
         author = get_object_or_404(models.Author, id=author_id)
 
         if is_api_request(request):
-            return ActivitypubResponse(author.to_activity())
+            return ActivitypubResponse(author.to_activity_json())
 
         if redirect_local_path := maybe_redirect_local_path(request, author):
             return redirect_local_path
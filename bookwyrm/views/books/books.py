@@ -28,7 +28,7 @@ class Book(View):
             book = get_object_or_404(
                 models.Book.objects.select_subclasses(), id=book_id
             )
-            return ActivitypubResponse(book.to_activity())
+            return ActivitypubResponse(book.to_activity_json())
 
         user_statuses = (
             kwargs.get("user_statuses", False)
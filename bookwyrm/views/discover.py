@@ -6,7 +6,7 @@ from django.template.response import TemplateResponse
 from django.utils.decorators import method_decorator
 from django.views import View
 
-from bookwyrm import activitystreams
+from bookwyrm import activitystreams, models
 
 
 # pylint: disable= no-self-use
@@ -16,40 +16,43 @@ class Discover(View):
 
     def get(self, request):
         """tiled book activity page"""
+        stream = activitystreams.streams["local"]
+        status_ids = stream.get_activity_ids(request.user)
         # all activities in the "federated" feed associated with a book
-        activities = (
-            activitystreams.streams["local"]
-            .get_activity_stream(request.user)
-            .filter(
-                Q(comment__isnull=False)
-                | Q(review__isnull=False)
-                | Q(quotation__isnull=False)
-                | Q(mention_books__isnull=False)
-            )
+        activities = models.Status.objects.filter(id__in=status_ids).filter(
+            Q(comment__isnull=False)
+            | Q(review__isnull=False)
+            | Q(quotation__isnull=False)
+            | Q(mention_books__isnull=False)
         )
-
-        large_activities = Paginator(
+        # statuses with no user-provided content don't get large panels
+        no_content = Q(Q(content="") | Q(content__isnull=True)) & Q(
+            quotation__isnull=True
+        )
+        large_ids = set(
             activities.filter(mention_books__isnull=True)
-            # exclude statuses with no user-provided content for large panels
-            .exclude(
-                Q(Q(content="") | Q(content__isnull=True)) & Q(quotation__isnull=True),
-            ),
-            6,
+            .exclude(no_content)
+            .values_list("id", flat=True)
         )
-        small_activities = Paginator(
-            activities.filter(
-                Q(mention_books__isnull=False)
-                | Q(
-                    Q(Q(content="") | Q(content__isnull=True))
-                    & Q(quotation__isnull=True),
-                )
-            ),
-            4,
+        small_ids = set(
+            activities.filter(Q(mention_books__isnull=False) | no_content).values_list(
+                "id", flat=True
+            )
         )
 
         page = request.GET.get("page")
+        # only the statuses on the page are loaded, in stream order
+        large_activities = Paginator(
+            [i for i in status_ids if i in large_ids], 6
+        ).get_page(page)
+        large_activities.object_list = stream.get_statuses(large_activities)
+        small_activities = Paginator(
+            [i for i in status_ids if i in small_ids], 4
+        ).get_page(page)
+        small_activities.object_list = stream.get_statuses(small_activities)
+
         data = {
-            "large_activities": large_activities.get_page(page),
-            "small_activities": small_activities.get_page(page),
+            "large_activities": large_activities,
+            "small_activities": small_activities,
         }
         return TemplateResponse(request, "discover/discover.html", data)
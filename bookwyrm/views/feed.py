@@ -1,4 +1,6 @@
 """ non-interactive pages """
+import math
+
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
 from django.db.models import Q
@@ -14,7 +16,8 @@ from bookwyrm.models.user import FeedFilterChoices
 from bookwyrm.activitypub import ActivitypubResponse
 from bookwyrm.settings import PAGE_LENGTH, STREAMS
 from bookwyrm.suggested_users import suggested_users
-from .helpers import filter_stream_by_status_type, get_user_from_username
+from bookwyrm.utils.interactions import load_interactions
+from .helpers import get_user_from_username
 from .helpers import is_api_request, is_bookwyrm_request, maybe_redirect_local_path
 from .annual_summary import get_annual_summary_year
 
@@ -41,22 +44,21 @@ class Feed(View):
         tab = [s for s in STREAMS if s["key"] == tab]
         tab = tab[0] if tab else STREAMS[0]
 
-        activities = activitystreams.streams[tab["key"]].get_activity_stream(
-            request.user
-        )
-        filtered_activities = filter_stream_by_status_type(
-            activities,
+        activities = activitystreams.streams[tab["key"]].get_activity_page(
+            request.user,
             allowed_types=request.user.feed_status_types,
+            max_cursor=get_stream_cursor(request, "max"),
+            min_cursor=get_stream_cursor(request, "min"),
         )
-        paginated = Paginator(filtered_activities, PAGE_LENGTH)
 
         suggestions = suggested_users.get_suggestions(request.user)
+        load_interactions(request, statuses=activities, users=suggestions)
 
         data = {
             **feed_page_data(request.user),
             **{
                 "user": request.user,
-                "activities": paginated.get_page(request.GET.get("page")),
+                "activities": activities,
                 "suggested_users": suggestions,
                 "tab": tab,
                 "streams": STREAMS,
@@ -129,7 +131,7 @@ class Status(View):
 
         if is_api_request(request):
             return ActivitypubResponse(
-                status.to_activity(pure=not is_bookwyrm_request(request))
+                status.to_activity_json(pure=not is_bookwyrm_request(request))
             )
 
         if redirect_local_path := maybe_redirect_local_path(request, status):
@@ -184,6 +186,9 @@ class Status(View):
         """,
             params=[status.id, visible_thread, visible_thread],
         )
+        # load these now so that interactions can be loaded for the whole thread
+        ancestors, children = list(ancestors), list(children)
+        load_interactions(request, statuses=[status] + ancestors + children)
 
         preview = None
         if hasattr(status, "book"):
@@ -222,6 +227,19 @@ class Replies(View):
         return ActivitypubResponse(status.to_replies(**request.GET))
 
 
+def get_stream_cursor(request, name):
+    """the (rank, status id) in the query string that a page of a stream starts
+    after, if it's a real one"""
+    try:
+        score = float(request.GET.get(name, ""))
+        status_id = int(request.GET.get("id", ""))
+    except ValueError:
+        return None
+    if not math.isfinite(score):
+        return None
+    return (score, status_id)
+
+
 def feed_page_data(user):
     """info we need for every feed page"""
     if not user.is_authenticated:
@@ -6,7 +6,6 @@ import dateutil.tz
 from dateutil.parser import ParserError
 
 from requests import HTTPError
-from django.db.models import Q
 from django.conf import settings as django_settings
 from django.shortcuts import redirect
 from django.http import Http404
@@ -177,32 +176,6 @@ def set_language(user, response):
     return response
 
 
-def filter_stream_by_status_type(activities, allowed_types=None):
-    """filter out activities based on types"""
-    if not allowed_types:
-        allowed_types = []
-
-    if "review" not in allowed_types:
-        activities = activities.filter(
-            Q(review__isnull=True), Q(boost__boosted_status__review__isnull=True)
-        )
-    if "comment" not in allowed_types:
-        activities = activities.filter(
-            Q(comment__isnull=True), Q(boost__boosted_status__comment__isnull=True)
-        )
-    if "quotation" not in allowed_types:
-        activities = activities.filter(
-            Q(quotation__isnull=True), Q(boost__boosted_status__quotation__isnull=True)
-        )
-    if "everything" not in allowed_types:
-        activities = activities.filter(
-            Q(generatednote__isnull=True),
-            Q(boost__boosted_status__generatednote__isnull=True),
-        )
-
-    return activities
-
-
 def maybe_redirect_local_path(request, model):
     """
     if the request had an invalid path, return a permanent redirect response to the
@@ -1,10 +1,13 @@
 """ incoming activities """
+import datetime
 import json
 import re
 import logging
+import time
 
 from urllib.parse import urldefrag
 import requests
+from requests.structures import CaseInsensitiveDict
 
 from django.http import HttpResponse, Http404
 from django.core.exceptions import BadRequest, PermissionDenied
@@ -12,14 +15,26 @@ from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
+from redis.exceptions import RedisError
 
-from bookwyrm import activitypub, models
+from bookwyrm import activitypub, models, settings
+from bookwyrm.redis_store import r
 from bookwyrm.tasks import app, MEDIUM
 from bookwyrm.signatures import Signature
-from bookwyrm.utils import regex
+from bookwyrm.utils import metrics, regex
 
 logger = logging.getLogger(__name__)
 
+# keys rarely change, and a failed check always looks up the key again
+PUBLIC_KEY_TIMEOUT = 60 * 60 * 24
+# other processes may have found a new key, so check redis more often
+LOCAL_PUBLIC_KEY_TIMEOUT = 60 * 5
+MAX_LOCAL_PUBLIC_KEYS = 1000
+# public keys and when they expire, by key id
+public_keys = {}
+# always kept for deferred checks, on top of the headers that were signed
+SIGNED_HEADERS = ["Signature", "Date", "Digest", "Host", "User-Agent"]
+
 
 @method_decorator(csrf_exempt, name="dispatch")
 # pylint: disable=no-self-use
@@ -28,6 +43,9 @@ class Inbox(View):
 
     def post(self, request, username=None):
         """only works as POST request"""
+        if settings.INBOX_DEFERRED_VERIFICATION:
+            return defer_activity(request, username)
+
         # first check if this server is on our shitlist
         raise_is_blocked_user_agent(request)
 
@@ -36,20 +54,12 @@ class Inbox(View):
             get_object_or_404(models.User, localname=username, is_active=True)
 
         # is it valid json? does it at least vaguely resemble an activity?
-        try:
-            activity_json = json.loads(request.body)
-        except json.decoder.JSONDecodeError:
-            raise BadRequest()
+        activity_json = parse_activity(request)
 
         # let's be extra sure we didn't block this domain
         raise_is_blocked_activity(activity_json)
 
-        if (
-            not "object" in activity_json
-            or not "type" in activity_json
-            or not activity_json["type"] in activitypub.activity_objects
-        ):
-            raise Http404()
+        raise_is_unknown_activity(activity_json)
 
         # verify the signature
         if not has_valid_signature(request, activity_json):
@@ -64,6 +74,97 @@ class Inbox(View):
         return HttpResponse()
 
 
+def parse_activity(request):
+    """load the json, or give up on the request"""
+    try:
+        return json.loads(request.body)
+    except json.decoder.JSONDecodeError:
+        raise BadRequest()
+
+
+def raise_is_unknown_activity(activity_json):
+    """does it at least vaguely resemble an activity?"""
+    if (
+        not "object" in activity_json
+        or not "type" in activity_json
+        or not activity_json["type"] in activitypub.activity_objects
+    ):
+        raise Http404()
+
+
+def defer_activity(request, username):
+    """do the checks that don't need the database or a key, and leave the rest
+    for celery so the web process can get on with the next request"""
+    raise_is_unknown_activity(parse_activity(request))
+    if "Signature" not in request.headers:
+        metrics.increment_many("inbox", {"rejected": 1})
+        return HttpResponse(status=401)
+
+    try:
+        body = request.body.decode("utf8")
+    except UnicodeDecodeError:
+        raise BadRequest()
+
+    # the date, digest and so on, and anything a blocklist check needs
+    headers = {k: v for (k, v) in request.headers.items() if k in SIGNED_HEADERS}
+    try:
+        signed_headers = Signature.parse(request).headers.split(" ")
+    except ValueError:
+        metrics.increment_many("inbox", {"rejected": 1})
+        return HttpResponse(status=401)
+    for header in signed_headers:
+        if header in request.headers:
+            headers[header] = request.headers[header]
+
+    verify_activity_task.delay(request.path, headers, body, time.time(), username)
+    metrics.increment_many("inbox", {"queued": 1, "pending": 1})
+    return HttpResponse()
+
+
+class DeferredRequest:
+    """the parts of an incoming request needed to check it in a task"""
+
+    def __init__(self, path, headers, body):
+        self.path = path
+        self.headers = CaseInsensitiveDict(headers)
+        self.body = body
+
+
+@app.task(queue=MEDIUM)
+def verify_activity_task(path, headers, body, received, username=None):
+    """the checks from the inbox view, for activities that were queued first"""
+    counts = {"pending": -1}
+    try:
+        result = verify_activity(path, headers, body, received, username)
+        counts[result] = 1
+    finally:
+        metrics.increment_many("inbox", counts)
+
+
+def verify_activity(path, headers, body, received, username=None):
+    """check a queued activity and process it if it's alright"""
+    request = DeferredRequest(path, headers, body.encode("utf8"))
+    activity_json = json.loads(body)
+    try:
+        raise_is_blocked_user_agent(request)
+        raise_is_blocked_activity(activity_json)
+    except PermissionDenied:
+        return "blocked"
+
+    if (
+        username
+        and not models.User.objects.filter(localname=username, is_active=True).exists()
+    ):
+        return "rejected"
+
+    received = datetime.datetime.utcfromtimestamp(received)
+    if not has_valid_signature(request, activity_json, received=received):
+        return "rejected"
+
+    activity_task(activity_json)
+    return "accepted"
+
+
 def raise_is_blocked_user_agent(request):
     """check if a request is from a blocked server based on user agent"""
     # check user agent
@@ -109,7 +210,7 @@ def activity_task(activity_json):
     activity.action()
 
 
-def has_valid_signature(request, activity):
+def has_valid_signature(request, activity, received=None):
     """verify incoming signature"""
     try:
         signature = Signature.parse(request)
@@ -118,20 +219,67 @@ def has_valid_signature(request, activity):
         if key_actor != activity.get("actor"):
             raise ValueError("Wrong actor created signature.")
 
-        remote_user = activitypub.resolve_remote_id(key_actor, model=models.User)
-        if not remote_user:
+        public_key = get_public_key(key_actor)
+        if not public_key:
             return False
 
         try:
-            signature.verify(remote_user.key_pair.public_key, request)
+            signature.verify(public_key, request, received)
         except ValueError:
-            old_key = remote_user.key_pair.public_key
-            remote_user = activitypub.resolve_remote_id(
-                remote_user.remote_id, model=models.User, refresh=True
-            )
-            if remote_user.key_pair.public_key == old_key:
+            old_key = public_key
+            public_key = get_public_key(key_actor, refresh=True)
+            if public_key == old_key:
                 raise  # Key unchanged.
-            signature.verify(remote_user.key_pair.public_key, request)
+            signature.verify(public_key, request, received)
     except (ValueError, requests.exceptions.HTTPError):
         return False
     return True
+
+
+def public_key_id(key_actor):
+    """the redis key for a cached public key"""
+    return f"{key_actor}-public-key"
+
+
+def get_public_key(key_actor, refresh=False):
+    """the actor's public key, from memory or redis if possible, and otherwise
+    from the database or the actor's server"""
+    now = time.time()
+    if not refresh:
+        public_key, expires = public_keys.get(key_actor, (None, 0))
+        if expires > now:
+            return public_key
+
+        try:
+            public_key = r.get(public_key_id(key_actor))
+        except RedisError as err:
+            logger.warning("Unable to load the public key for %s: %s", key_actor, err)
+            public_key = None
+        if public_key:
+            public_key = public_key.decode("utf8")
+            remember_public_key(key_actor, public_key, now)
+            return public_key
+
+    remote_user = activitypub.resolve_remote_id(
+        key_actor, model=models.User, refresh=refresh
+    )
+    if not remote_user:
+        return None
+    public_key = remote_user.key_pair.public_key
+    if not public_key:
+        return None
+    try:
+        r.set(public_key_id(key_actor), public_key, ex=PUBLIC_KEY_TIMEOUT)
+    except RedisError as err:
+        logger.warning("Unable to store the public key for %s: %s", key_actor, err)
+    remember_public_key(key_actor, public_key, now)
+    return public_key
+
+
+def remember_public_key(key_actor, public_key, now):
+    """keep a key in memory for this process"""
+    public_keys.pop(key_actor, None)
+    if len(public_keys) >= MAX_LOCAL_PUBLIC_KEYS:
+        # dicts are in insertion order, so this is the oldest key
+        del public_keys[next(iter(public_keys))]
+    public_keys[key_actor] = (public_key, now + LOCAL_PUBLIC_KEY_TIMEOUT)
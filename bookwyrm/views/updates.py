@@ -1,9 +1,10 @@
 """ endpoints for getting updates about activity """
 from django.contrib.auth.decorators import login_required
 from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
 from django.utils.translation import ngettext
 
-from bookwyrm import activitystreams
+from bookwyrm import activitystreams, models
 
 
 @login_required
@@ -17,6 +18,13 @@ def get_notification_count(request):
     )
 
 
+@login_required
+def get_import_progress(request, job_id):
+    """how far along is the import?"""
+    job = get_object_or_404(models.ImportJob, id=job_id, user=request.user)
+    return JsonResponse(job.get_progress())
+
+
 @login_required
 def get_unread_status_string(request, stream="home"):
     """any unread statuses for this feed?"""
@@ -11,6 +11,7 @@ from django.views.decorators.http import require_POST
 from bookwyrm import models
 from bookwyrm.activitypub import ActivitypubResponse
 from bookwyrm.settings import PAGE_LENGTH
+from bookwyrm.utils.interactions import load_interactions
 from .helpers import get_user_from_username, is_api_request
 
 
@@ -24,7 +25,7 @@ class User(View):
 
         if is_api_request(request):
             # we have a json request
-            return ActivitypubResponse(user.to_activity())
+            return ActivitypubResponse(user.to_activity_json())
         # otherwise we're at a UI view
 
         shelf_preview = []
@@ -79,6 +80,8 @@ class User(View):
         )
 
         paginated = Paginator(activities, PAGE_LENGTH)
+        page = paginated.get_page(request.GET.get("page", 1))
+        load_interactions(request, statuses=page, users=[user])
         goal = models.AnnualGoal.objects.filter(
             user=user, year=timezone.now().year
         ).first()
@@ -93,7 +96,7 @@ class User(View):
             "is_self": is_self,
             "shelves": shelf_preview,
             "shelf_count": shelves.count(),
-            "activities": paginated.get_page(request.GET.get("page", 1)),
+            "activities": page,
             "goal": goal,
         }
 